@@ -3,21 +3,44 @@ import numpy
 from typing import List
 from math import pi
 
-from wand.image import Image as WImage
+from Augmentations.Geometry import (getRemapCache, getAffineProjectionMatrix, renderTransforms, transformBoxes,
+                                    ArcTransform, MatrixTransform)
+from profiler import PROFILER
 
 
 class CustomAugmentation:
     def __init__(self, p):
         self.p = p
 
-    def isRun(self):
-        rand = numpy.random.rand()
+    def isRun(self, rng: numpy.random.Generator):
+        rand = rng.random()
         if rand <= self.p:
             return True
         else:
             return False
 
-    def apply(self, image: numpy.ndarray):
+    def apply(self, image: numpy.ndarray, rng: numpy.random.Generator):
+        raise NotImplementedError()
+
+
+class GeometricAugmentation(CustomAugmentation):
+    """
+        augmentation given by a coordinate transform, so that a sequence of them resamples the image once
+        (see GeometricSequenceAugmentations)
+    """
+
+    def apply(self, image: numpy.ndarray, rng: numpy.random.Generator):
+        h, w = image.shape[:2]
+        transform = self.getTransform(w, h, rng)
+        if transform is not None:
+            image = transform.render(image)
+        return image
+
+    def getTransform(self, w: int, h: int, rng: numpy.random.Generator):
+        """
+            draw the parameters of a w x h image
+        :return: ArcTransform or MatrixTransform, None if the augmentation does not run
+        """
         raise NotImplementedError()
 
 
@@ -28,21 +51,21 @@ class PadLeftRight(CustomAugmentation):
         assert pad[0] < pad[1]
         self.pad = numpy.array(pad)
 
-    def apply(self, image: numpy.ndarray):
-        if self.isRun():
+    def apply(self, image: numpy.ndarray, rng: numpy.random.Generator):
+        if self.isRun(rng):
             h, w, c = image.shape
             assert c == 4, "Image has to be RGBA"
-            padLeft, padRight = self.getPadSizes(w=w)
+            padLeft, padRight = self.getPadSizes(w=w, rng=rng)
             image = numpy.concatenate((numpy.zeros((h, padLeft, 4), dtype=numpy.uint8),
                                        image,
                                        numpy.zeros((h, padRight, 4), dtype=numpy.uint8)), axis=1)
         return image
 
-    def getPadSizes(self, w: int):
+    def getPadSizes(self, w: int, rng: numpy.random.Generator):
         # assert w > 5
         pad = numpy.ceil(self.pad * w).astype(int)
-        padLeft = numpy.random.randint(low=pad[0], high=pad[1]+1)
-        padRight = numpy.random.randint(low=pad[0], high=pad[1]+1)
+        padLeft = rng.integers(low=pad[0], high=pad[1]+1)
+        padRight = rng.integers(low=pad[0], high=pad[1]+1)
         assert padLeft != 0 and padRight != 0
         return padLeft, padRight
 
@@ -56,16 +79,16 @@ class ResizeChar(CustomAugmentation):
         self.minW = minW
         self.minH = minH
 
-    def apply(self, image: numpy.ndarray):
-        if self.isRun():
+    def apply(self, image: numpy.ndarray, rng: numpy.random.Generator):
+        if self.isRun(rng):
             h, w, _ = image.shape
-            newW, newH = self.getNewWH(w, h)
+            newW, newH = self.getNewWH(w, h, rng)
             if newW != w or newH != h:
                 image = cv2.resize(image, (newW, newH), interpolation=cv2.INTER_NEAREST)
         return image
 
-    def getNewWH(self, w: int, h: int):
-        r = numpy.random.randint(low=self.ratio[0], high=self.ratio[1]) / 100
+    def getNewWH(self, w: int, h: int, rng: numpy.random.Generator):
+        r = rng.integers(low=self.ratio[0], high=self.ratio[1]) / 100
         newW = int(w * r)
         newH = int(h * r)
         if newW < self.minW or newH < self.minH:
@@ -74,56 +97,65 @@ class ResizeChar(CustomAugmentation):
         return newW, newH
 
 
-class AffineTransform(CustomAugmentation):
+class AffineTransform(GeometricAugmentation):
 
     def __init__(self, p, maxRotate: int, maxTranslate: int):
         super().__init__(p)
         self.maxRotate = maxRotate
         self.maxTranslate = maxTranslate
 
-    def apply(self, image: numpy.ndarray):
-        if self.isRun():
-            args = self.getAffineMatrixArgs()
-            image = WImage.from_array(numpy.array(image))
-            image.virtual_pixel = 'transparent'
-            image.distort('affine_projection', args)
-            image = numpy.array(image)
-        return image
+    def getTransform(self, w: int, h: int, rng: numpy.random.Generator):
+        if self.isRun(rng):
+            matrix = numpy.vstack((getAffineProjectionMatrix(self.getAffineMatrixArgs(rng)), [0, 0, 1]))
+            return MatrixTransform(matrix, (w, h))
+        return None
 
-    def getAffineMatrixArgs(self):
-        rotateX = numpy.random.randint(low=-self.maxRotate, high=self.maxRotate) / 100
-        rotateY = numpy.random.randint(low=-self.maxRotate, high=self.maxRotate) / 100
+    def getAffineMatrixArgs(self, rng: numpy.random.Generator):
+        rotateX = rng.integers(low=-self.maxRotate, high=self.maxRotate) / 100
+        rotateY = rng.integers(low=-self.maxRotate, high=self.maxRotate) / 100
         scaleX = 1
         scaleY = 1
-        translateX = numpy.random.randint(low=-self.maxTranslate, high=self.maxTranslate)
-        translateY = numpy.random.randint(low=-self.maxTranslate, high=self.maxTranslate)
+        translateX = rng.integers(low=-self.maxTranslate, high=self.maxTranslate)
+        translateY = rng.integers(low=-self.maxTranslate, high=self.maxTranslate)
         return scaleX, rotateX, rotateY, scaleY, translateX, translateY
 
 
-class WrapText(CustomAugmentation):
-    def __init__(self, p, arcAngle: List[int], rotateAngle: List[int]):
+class WrapText(GeometricAugmentation):
+    def __init__(self, p, arcAngle: List[int], rotateAngle: List[int], cacheBytes: int = None, quantize: int = 1,
+                 chainCacheBytes: int = None):
+        """
+        :param cacheBytes: memory limit of the process wide arc map cache, maps are rebuilt for every image if None
+        :param quantize: with a cache, image sizes are padded to a multiple of quantize pixels to share maps
+        :param chainCacheBytes: with a cache, memory limit of the process wide cache of the maps of arcs fused with
+                                the layout transforms after them (see renderTransforms), None disables it. Only useful
+                                when the layout parameters are narrow or repeat, otherwise every chain misses and a
+                                miss costs more than no cache
+        """
         super().__init__(p)
         assert arcAngle[0] < arcAngle[1]
         assert rotateAngle[0] < rotateAngle[1]
+        assert quantize >= 1
         self.arcAngle = numpy.array(arcAngle)
         self.rotateAngle = numpy.array(rotateAngle)
-
-    def apply(self, image: numpy.ndarray):
-        if self.isRun():
-            arc, rotate = self.getAngles()
-            image = WImage.from_array(numpy.array(image))
-            image.virtual_pixel = 'transparent'
-            image.distort('arc', (arc, rotate))
-            image = numpy.array(image)
-        return image
-
-    def getAngles(self):
-        arc = numpy.random.randint(low=self.arcAngle[0], high=self.arcAngle[1])
-        rotate = numpy.random.randint(low=self.rotateAngle[0], high=self.rotateAngle[1])
+        self.quantize = quantize
+        self.cache = getRemapCache("arcMaps", cacheBytes) if cacheBytes is not None else None
+        self.chainCache = getRemapCache("layoutMaps", chainCacheBytes) if chainCacheBytes is not None else None
+
+    def getTransform(self, w: int, h: int, rng: numpy.random.Generator):
+        if self.isRun(rng):
+            arc, rotate = self.getAngles(rng)
+            return ArcTransform(w, h, arc, rotate, cache=self.cache, quantize=self.quantize,
+                                chainCache=self.chainCache)
+        return None
+
+    def getAngles(self, rng: numpy.random.Generator):
+        # integer degrees, so the arc maps can be cached
+        arc = int(rng.integers(low=self.arcAngle[0], high=self.arcAngle[1]))
+        rotate = int(rng.integers(low=self.rotateAngle[0], high=self.rotateAngle[1]))
         return arc, rotate
 
 
-class Transformation3D(CustomAugmentation):
+class Transformation3D(GeometricAugmentation):
     """
     Reference : https://github.com/eborboihuc/rotate_3d
     """
@@ -135,20 +167,26 @@ class Transformation3D(CustomAugmentation):
         self.maxGamma = maxGamma
         self.pParam = numpy.sqrt(p) // 2
 
-    def apply(self, image: numpy.ndarray):
-        if self.isRun():
-            h, w, _ = image.shape
-            theta, phi, gamma, dx, dy, dz = self.getParams()
+    def getTransform(self, w: int, h: int, rng: numpy.random.Generator):
+        if self.isRun(rng):
+            theta, phi, gamma, dx, dy, dz = self.getParams(rng)
             rTheta, rPhi, rGamma = self.get_rad(theta, phi, gamma)
             d = numpy.sqrt(h ** 2 + w ** 2)
             focal = d / (2 * numpy.sin(rGamma) if numpy.sin(rGamma) != 0 else 1)
             dz = focal
             H = self.getH(focal, w, h, rTheta, rPhi, rGamma, dx, dy, dz)
-            image = self.wrap(image, H)
-        return image
+            return self.getWrapTransform(w, h, H)
+        return None
 
     def wrap(self, image: numpy.ndarray, H: numpy.array):
         h, w, _ = image.shape
+        return self.getWrapTransform(w, h, H).render(image)
+
+    @staticmethod
+    def getWrapTransform(w: int, h: int, H: numpy.array):
+        """
+            H moved to the bounding box of the projected image corners
+        """
         corners = numpy.array([[
             [0, 0],
             [0, h - 1],
@@ -163,20 +201,19 @@ class Transformation3D(CustomAugmentation):
             [0, 0, 1]
         ])
         mat = th @ H
-        image = cv2.warpPerspective(image, mat, (bboxWidth, bboxHeight), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT)
-        return image
+        return MatrixTransform(mat, (bboxWidth, bboxHeight), interpolation=cv2.INTER_CUBIC, clips=False)
 
-    def getParams(self):
-        if self.pParam < numpy.random.rand():
-            theta = numpy.random.randint(low=-self.maxTheta, high=self.maxTheta)  # rotation around x-axis
+    def getParams(self, rng: numpy.random.Generator):
+        if self.pParam < rng.random():
+            theta = rng.integers(low=-self.maxTheta, high=self.maxTheta)  # rotation around x-axis
         else:
             theta = 0
-        if self.pParam < numpy.random.rand():
-            phi = numpy.random.randint(low=-self.maxPhi, high=self.maxPhi)
+        if self.pParam < rng.random():
+            phi = rng.integers(low=-self.maxPhi, high=self.maxPhi)
         else:
             phi = 0
-        if self.pParam < numpy.random.rand():
-            gamma = numpy.random.randint(low=-self.maxGamma, high=self.maxGamma)
+        if self.pParam < rng.random():
+            gamma = rng.integers(low=-self.maxGamma, high=self.maxGamma)
         else:
             gamma = 0
         dx = 0
@@ -234,10 +271,41 @@ class Transformation3D(CustomAugmentation):
 
 
 class CustomSequenceAugmentations:
-    def __init__(self, augmentations: List[CustomAugmentation]):
+    def __init__(self, augmentations: List[CustomAugmentation], name: str = "CustomSequenceAugmentations"):
         self.augmentations = augmentations
+        # profiler stage names
+        self.stageNames = [f"{name}/{type(aug).__name__}" for aug in augmentations]
 
-    def __call__(self, image: numpy.ndarray):
-        for aug in self.augmentations:
-            image = aug.apply(image)
+    def __call__(self, image: numpy.ndarray, rng: numpy.random.Generator):
+        for aug, stageName in zip(self.augmentations, self.stageNames):
+            with PROFILER.stage(stageName, image):
+                image = aug.apply(image, rng)
         return image
+
+
+class GeometricSequenceAugmentations:
+    """
+        sequence of GeometricAugmentation, the transforms that run are composed and the image is resampled once
+    """
+
+    def __init__(self, augmentations: List[GeometricAugmentation], name: str = "GeometricSequenceAugmentations"):
+        self.augmentations = augmentations
+        self.stageName = f"{name}/Geometry"
+
+    def __call__(self, image: numpy.ndarray, rng: numpy.random.Generator):
+        return self.applyWithBoxes(image, rng, bboxes=[])[0]
+
+    def applyWithBoxes(self, image: numpy.ndarray, rng: numpy.random.Generator, bboxes: list):
+        """
+            augment the image and the [x1, y1, x2, y2] boxes of its characters
+        """
+        h, w = image.shape[:2]
+        transforms = []
+        for aug in self.augmentations:
+            transform = aug.getTransform(w, h, rng)
+            if transform is not None:
+                transforms.append(transform)
+                w, h = transform.size
+        with PROFILER.stage(self.stageName, image):
+            image = renderTransforms(image, transforms)
+        return image, transformBoxes(bboxes, transforms)
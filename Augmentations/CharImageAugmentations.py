@@ -5,6 +5,8 @@ import numpy
 import imgaug.augmenters as iaa
 
 from Augmentations import PadLeftRight, CustomSequenceAugmentations, ResizeChar
+from Augmentations.Elastic import BankElasticTransformation
+from profiler import PROFILER
 
 
 class CharImageAugmentations:
@@ -12,49 +14,56 @@ class CharImageAugmentations:
         self.augmentationSequence = self.getAugmentations(args)
         self.customAugmentationSequence = self.getCustomAugmentations(args)
 
-    def apply(self, image: numpy.ndarray, bboxes: list):
-        crops = []
-        cropH = []
-        for bbox in bboxes:
-            [x1, y1, x2, y2] = bbox
-            crop = image[:, x1:x2]
-            crop = self.augmentationSequence(image=crop)
-            crop = self.customAugmentationSequence(image=crop)
-            crops.append(crop)
-            cropH.append(crop.shape[0])
-        image = self.concatenateCrops(crops, cropH)
-        return image
+    def apply(self, image: numpy.ndarray, bboxes: list, rng: numpy.random.Generator):
+        return self.applyWithBoxes(image, bboxes, rng)[0]
 
-    @staticmethod
-    def concatenateCrops(crops: List[numpy.ndarray], cropH: List[int]):
-        def getPadHSize(maxPad):
-            if maxPad == 0:
-                pad = 0
-            else:
-                pad = numpy.random.randint(low=0, high=maxPad)
-            return pad
+    def applyWithBoxes(self, image: numpy.ndarray, bboxes: list, rng: numpy.random.Generator):
+        """
+            augment every character crop of the word image
+        :param image: word image
+        :param bboxes: [x1, y1, x2, y2] character boxes, the crops are image[:, x1:x2]
+        :param rng: random generator of the word
+        :return: augmented image, character boxes in it
+        """
+        # imgaug draws from its own random state, it is reseeded from rng
+        self.augmentationSequence.seed_(rng.integers(low=0, high=2 ** 31))
+        crops = [image[:, x1:x2] for [x1, y1, x2, y2] in bboxes]
+        # one batched call for all characters of the word, parameters are still drawn per crop
+        with PROFILER.stage("CharImageAugmentations/ElasticTransformation", image):
+            crops = self.augmentationSequence(images=crops)
+        crops = [self.customAugmentationSequence(image=crop, rng=rng) for crop in crops]
+        cropH = [crop.shape[0] for crop in crops]
+        return self.concatenateCrops(crops, cropH, rng)
 
+    @staticmethod
+    def concatenateCrops(crops: List[numpy.ndarray], cropH: List[int], rng: numpy.random.Generator):
+        """
+            place the crops side by side in one canvas, crops shorter than the tallest one get a random vertical
+            offset (the same for crops of equal height)
+        :param crops: RGBA crops
+        :param cropH: crop heights
+        :param rng: random generator
+        :return: image, character boxes (opaque pixels of every crop, the whole crop if it has none)
+        """
         maxH = max(cropH)
-        minH = min(cropH)
-        if maxH == minH:
-            image = numpy.concatenate(crops, axis=1)
-        else:
-            tmp = []
-            pads = {}
-
-            for crop in crops:
-                h, w, c = crop.shape
-                newCrop = numpy.zeros((maxH, w, 4), dtype=numpy.uint8)
-                if h in list(pads.keys()):
-                    pad = pads[h]
-                else:
-                    pad = getPadHSize(maxPad=(maxH - h))
-                    pads[h] = pad
+        pads = {}
+        for h in cropH:
+            if h not in pads:
+                pads[h] = rng.integers(low=0, high=maxH - h) if h < maxH else 0
 
-                newCrop[pad:h + pad, ...] = crop
-                tmp.append(newCrop)
-            image = numpy.concatenate(tmp, axis=1)
-        return image
+        image = numpy.zeros((maxH, sum(crop.shape[1] for crop in crops), 4), dtype=numpy.uint8)
+        bboxes = []
+        x = 0
+        for crop, h in zip(crops, cropH):
+            w = crop.shape[1]
+            y = int(pads[h])
+            image[y:y + h, x:x + w] = crop
+            bx, by, bw, bh = cv2.boundingRect(crop[..., 3])
+            if bw == 0 or bh == 0:
+                bx, by, bw, bh = 0, 0, w, h
+            bboxes.append([x + bx, y + by, x + bx + bw, y + by + bh])
+            x += w
+        return image, bboxes
 
     @staticmethod
     def getAugmentations(args):
@@ -62,7 +71,13 @@ class CharImageAugmentations:
         augmentations = args['geometricAugmentations']
         for augName in list(augmentations.keys()):
             p = augmentations[augName]['p']
-            if 'ElasticTransformation' in augName:
+            if 'ElasticTransformation' in augName and 'bank' in augmentations[augName]:
+                newAugmentation = iaa.Sometimes(p, BankElasticTransformation(
+                    alpha=(augmentations[augName]['min_alpha'], augmentations[augName]['max_alpha']),
+                    sigma=(augmentations[augName]['min_sigma'], augmentations[augName]['max_sigma']),
+                    mode=augmentations[augName]['mode'],
+                    **augmentations[augName]['bank']))
+            elif 'ElasticTransformation' in augName:
                 newAugmentation = iaa.Sometimes(p, iaa.ElasticTransformation(alpha=(augmentations[augName]['min_alpha'],
                                                                                     augmentations[augName][
                                                                                         'max_alpha']),
@@ -99,4 +114,4 @@ class CharImageAugmentations:
                 raise Exception("Unknown augmentation type pn char image augmentations!")
             sequence.append(newAugmentation)
 
-        return CustomSequenceAugmentations(sequence)
+        return CustomSequenceAugmentations(sequence, name="CharImageAugmentations")
@@ -0,0 +1,143 @@
+"""
+    Elastic transformation from a bank of pre-smoothed displacement fields. imgaug's ElasticTransformation draws
+    uniform noise at the crop size and Gaussian-smooths it for every call; the bank smooths a few large fields once
+    per process and every call takes a random crop and flip of a field, scaled by its alpha.
+"""
+from functools import lru_cache
+
+import cv2
+import numpy
+import imgaug.augmenters.meta as meta
+from imgaug.augmenters.geometric import ElasticTransformation
+
+
+def getKernelSize(sigma: float):
+    """
+        Gaussian kernel size of imgaug (blur._compute_gaussian_blur_ksize), odd
+    """
+    if sigma < 3.0:
+        ksize = 3.3 * sigma
+    elif sigma < 5.0:
+        ksize = 2.9 * sigma
+    else:
+        ksize = 2.6 * sigma
+    ksize = int(max(ksize, 5))
+    return ksize + 1 if ksize % 2 == 0 else ksize
+
+
+def getDisplacementField(h: int, w: int, sigma: float, rng: numpy.random.Generator):
+    """
+        displacement field of unit alpha, as ElasticTransformation._generate_shift_maps
+    :return: dx, dy (float32, h x w)
+    """
+    ksize = getKernelSize(sigma)
+    hPad, wPad = h + 2 * ksize, w + 2 * ksize
+    field = []
+    for _ in range(2):
+        noise = (rng.random((hPad, wPad)) * 2 - 1).astype(numpy.float32)
+        noise = cv2.GaussianBlur(noise, (ksize, ksize), sigmaX=sigma, sigmaY=sigma, borderType=cv2.BORDER_REFLECT_101)
+        field.append(noise[ksize:-ksize, ksize:-ksize])
+    return field[0], field[1]
+
+
+class DisplacementBank:
+    """
+        unit alpha displacement fields at sigma levels evenly covering [minSigma, maxSigma]
+    """
+
+    def __init__(self, minSigma: float, maxSigma: float, levels: int, size: int, seed: int = 0):
+        """
+        :param minSigma: minimum sigma of the smoothing
+        :param maxSigma: maximum sigma of the smoothing
+        :param levels: number of sigma levels, a field each
+        :param size: fields are size x size, crops larger than that get a live field
+        :param seed: seed of the fields, the bank is the same in every process
+        """
+        assert minSigma <= maxSigma and levels > 0
+        self.size = size
+        step = (maxSigma - minSigma) / levels
+        self.sigmas = numpy.array([minSigma + (i + 0.5) * step for i in range(levels)])
+        rng = numpy.random.default_rng(seed)
+        self.fields = [numpy.stack(getDisplacementField(size, size, sigma, rng)) for sigma in self.sigmas]
+        self.nbytes = sum(field.nbytes for field in self.fields)
+        return
+
+    def getField(self, h: int, w: int, sigma: float, random_state):
+        """
+            random crop and flip of the field of the nearest sigma level
+        :param h: crop height
+        :param w: crop width
+        :param sigma: drawn sigma
+        :param random_state: imgaug random state
+        :return: dx, dy (float32, h x w)
+        """
+        if h > self.size or w > self.size:
+            return getDisplacementField(h, w, sigma, random_state.generator)
+        field = self.fields[int(numpy.abs(self.sigmas - sigma).argmin())]
+        y = random_state.integers(0, self.size - h + 1)
+        x = random_state.integers(0, self.size - w + 1)
+        field = field[:, y:y + h, x:x + w]
+        flip = random_state.integers(0, 4)
+        if flip & 1:
+            field = field[:, :, ::-1]
+        if flip & 2:
+            field = field[:, ::-1, :]
+        return field[0], field[1]
+
+    def stats(self):
+        return {"levels": len(self.fields), "size": self.size, "bytes": self.nbytes}
+
+
+@lru_cache(maxsize=None)
+def getDisplacementBank(minSigma: float, maxSigma: float, levels: int, size: int, seed: int = 0):
+    """
+        process wide bank of the given parameters
+    """
+    return DisplacementBank(minSigma, maxSigma, levels, size, seed)
+
+
+class BankElasticTransformation(meta.Augmenter):
+    """
+        imgaug augmenter with the parameters of ElasticTransformation (alpha and sigma ranges, mode), the fields come
+        from a DisplacementBank. Only images are augmented.
+    """
+
+    def __init__(self, alpha: tuple, sigma: tuple, mode: str = "constant", levels: int = 8, size: int = 256,
+                 seed: int = 0):
+        """
+        :param alpha: (min, max) strength of the displacement
+        :param sigma: (min, max) smoothness of the displacement
+        :param mode: border mode, as ElasticTransformation
+        :param levels: sigma levels of the bank
+        :param size: size of the fields of the bank
+        :param seed: seed of the bank
+        """
+        super().__init__()
+        self.alpha = alpha
+        self.sigma = sigma
+        self.mode = mode
+        self.borderMode = ElasticTransformation._MAPPING_MODE_SCIPY_CV2[mode]
+        self.bank = getDisplacementBank(sigma[0], sigma[1], levels, size, seed)
+
+    def _augment_batch_(self, batch, random_state, parents, hooks):
+        if batch.images is None:
+            return batch
+        for i, image in enumerate(batch.images):
+            batch.images[i] = self.augmentImage(image, random_state)
+        return batch
+
+    def augmentImage(self, image: numpy.ndarray, random_state):
+        h, w = image.shape[:2]
+        if h == 0 or w == 0:
+            return image
+        alpha = random_state.uniform(*self.alpha)
+        sigma = random_state.uniform(*self.sigma)
+        dx, dy = self.bank.getField(h, w, sigma, random_state)
+        # as imgaug, the image is sampled at x - dx, y - dy
+        mapX = numpy.arange(w, dtype=numpy.float32) - numpy.float32(alpha) * dx
+        mapY = numpy.arange(h, dtype=numpy.float32).reshape(-1, 1) - numpy.float32(alpha) * dy
+        return cv2.remap(image, mapX, mapY, interpolation=cv2.INTER_CUBIC, borderMode=self.borderMode,
+                         borderValue=(0, 0, 0, 0))
+
+    def get_parameters(self):
+        return [self.alpha, self.sigma, self.mode]
@@ -0,0 +1,414 @@
+"""
+    Geometric distortions of RGBA images on NumPy arrays, ports of the ImageMagick distortions used through Wand
+    (MagickCore/distort.c). Coordinates follow ImageMagick: pixel centers are at +0.5, pixels outside the image are
+    transparent. Pixels are interpolated bilinearly instead of ImageMagick's EWA filter, a known change of the output:
+    samples are not pixel-identical to the Wand ones, edges are resampled differently (see benchmarks.geometry).
+"""
+from collections import OrderedDict
+from math import pi, floor, ceil, cos, sin
+
+import cv2
+import numpy
+
+from Texture.ImageCache import CACHES
+
+
+def getArcCoefficients(w: int, h: int, arc: float, rotate: float = 0):
+    """
+        coefficients and output geometry of ImageMagick's arc distortion ('arc', (arc, rotate))
+    :param w: image width
+    :param h: image height
+    :param arc: angle (degrees) the image width is bent over
+    :param rotate: rotation (degrees) of the arc from the top center
+    :return: (angle offset, angle scale, top radius, radius scale, center x), (x, y, width, height) of the output
+    """
+    assert arc > 0, "arc angle has to be positive"
+    c0 = -pi / 2 + rotate * pi / 180
+    # normalized to [-pi, pi]
+    c0 /= 2 * pi
+    c0 -= floor(c0 + 0.5)
+    c0 *= 2 * pi
+    c1 = arc * pi / 180
+    c3 = h - 1.0
+    c2 = w / c1 + c3 / 2
+    c4 = (w - 1.0) / 2
+
+    # bounds of the forward mapped corners and of the orthogonal points along the top of the arc
+    points = []
+    for a in (c0 - c1 / 2, c0 + c1 / 2):
+        points += [(c2 * cos(a), c2 * sin(a)), ((c2 - c3) * cos(a), (c2 - c3) * sin(a))]
+    a = ceil((c0 - c1 / 2) / (pi / 2)) * (pi / 2)
+    while a < c0 + c1 / 2:
+        points.append((c2 * cos(a), c2 * sin(a)))
+        a += pi / 2
+    points = numpy.array(points)
+    minX, minY = points.min(axis=0)
+    maxX, maxY = points.max(axis=0)
+    x = floor(minX - 0.5)
+    y = floor(minY - 0.5)
+    geometry = (x, y, int(ceil(maxX - x + 0.5)), int(ceil(maxY - y + 0.5)))
+
+    coefficients = (c0, 2 * pi * w / c1, c2, h / c3 if c3 > 0 else 1.0, c4)
+    return coefficients, geometry
+
+
+def getArcMaps(w: int, h: int, arc: float, rotate: float = 0):
+    """
+        source coordinates of every output pixel of the arc distortion, for cv2.remap
+    :param w: image width
+    :param h: image height
+    :param arc: angle (degrees) the image width is bent over
+    :param rotate: rotation (degrees) of the arc from the top center
+    :return: mapX, mapY (float32, output size)
+    """
+    coefficients, (x, y, width, height) = getArcCoefficients(w, h, arc, rotate)
+    mapX, mapY = getArcSource(coefficients, (x, y),
+                              numpy.arange(width, dtype=numpy.float64),
+                              numpy.arange(height, dtype=numpy.float64).reshape(-1, 1))
+    return mapX.astype(numpy.float32), mapY.astype(numpy.float32)
+
+
+def getArcSource(coefficients, origin, X: numpy.ndarray, Y: numpy.ndarray):
+    """
+        source coordinates of output coordinates of the arc distortion
+    :param coefficients: coefficients of getArcCoefficients
+    :param origin: (x, y) of the output geometry of getArcCoefficients
+    :param X: output x coordinates (pixel index)
+    :param Y: output y coordinates (pixel index), broadcast with X
+    :return: source x, y coordinates (pixel index)
+    """
+    c0, c1, c2, c3, c4 = coefficients
+    dx = X + (origin[0] + 0.5)
+    dy = Y + (origin[1] + 0.5)
+    angle = (numpy.arctan2(dy, dx) - c0) / (2 * pi)
+    angle -= numpy.floor(angle + 0.5)
+    radius = numpy.hypot(dx, dy)
+    return angle * c1 + c4, (c2 - radius) * c3 - 0.5
+
+
+def remapRGBA(image: numpy.ndarray, mapX: numpy.ndarray, mapY: numpy.ndarray):
+    """
+        sample image at the given coordinates, outside is transparent
+    :param mapX: float32 x coordinates, or fixed point maps of cv2.convertMaps (then mapY is the interpolation table)
+    """
+    return cv2.remap(image, mapX, mapY, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT,
+                     borderValue=(0, 0, 0, 0))
+
+
+class RemapCache:
+    """
+        Byte-budgeted LRU cache of remap maps. Maps are stored in OpenCV's fixed point format (cv2.convertMaps),
+        6 bytes per pixel instead of 8, which cv2.remap uses directly.
+    """
+
+    def __init__(self, maxBytes: int):
+        """
+        :param maxBytes: memory limit of cached maps
+        """
+        self.maxBytes = maxBytes
+        self.maps = OrderedDict()
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return
+
+    def get(self, key, build):
+        """
+            returns the fixed point maps of key, built on a miss
+        :param key: hashable key of the maps
+        :param build: function returning float32 (mapX, mapY)
+        :return: (xy, interpolation) maps for cv2.remap
+        """
+        maps = self.maps.get(key)
+        if maps is not None:
+            self.hits += 1
+            self.maps.move_to_end(key)
+            return maps
+
+        self.misses += 1
+        maps = cv2.convertMaps(*build(), cv2.CV_16SC2)
+        self.maps[key] = maps
+        self.nbytes += maps[0].nbytes + maps[1].nbytes
+        while self.nbytes > self.maxBytes and len(self.maps) > 1:
+            _, (xy, interpolation) = self.maps.popitem(last=False)
+            self.nbytes -= xy.nbytes + interpolation.nbytes
+            self.evictions += 1
+        return maps
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"maps": len(self.maps),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": self.hits / total if total > 0 else 0.0}
+
+
+def getRemapCache(name: str, maxBytes: int):
+    """
+        returns the process wide remap cache of given name, reported with the image caches
+    """
+    cache = CACHES.get(name)
+    if cache is None:
+        cache = CACHES[name] = RemapCache(maxBytes=maxBytes)
+    return cache
+
+
+def arcDistort(image: numpy.ndarray, arc: float, rotate: float = 0, cache: RemapCache = None, quantize: int = 1):
+    """
+        bend the image over an arc, as image.distort('arc', (arc, rotate)) with transparent virtual pixels
+    :param image: RGBA image
+    :param arc: angle (degrees) the image width is bent over
+    :param rotate: rotation (degrees) of the arc from the top center
+    :param cache: maps are reused for equal (w, h, arc, rotate) if given
+    :param quantize: with a cache, the image is padded (centered, transparent) to a multiple of quantize pixels so
+                     that near sizes share maps. The arc then spans the padded width.
+    :return: distorted image, its size is the bounding box of the arc
+    """
+    h, w = image.shape[:2]
+    if cache is None:
+        mapX, mapY = getArcMaps(w, h, arc, rotate)
+        return remapRGBA(image, mapX, mapY)
+
+    qw = -(-w // quantize) * quantize
+    qh = -(-h // quantize) * quantize
+    xy, interpolation = cache.get((qw, qh, arc, rotate), lambda: getArcMaps(qw, qh, arc, rotate))
+    return remapRGBA(padCentered(image, qw, qh), xy, interpolation)
+
+
+def padCentered(image: numpy.ndarray, w: int, h: int):
+    """
+        pad the image (centered, transparent) to w x h
+    """
+    ih, iw = image.shape[:2]
+    if iw == w and ih == h:
+        return image
+    left = (w - iw) // 2
+    top = (h - ih) // 2
+    return cv2.copyMakeBorder(image, top, h - ih - top, left, w - iw - left, cv2.BORDER_CONSTANT, value=(0, 0, 0, 0))
+
+
+def getAffineProjectionMatrix(args):
+    """
+        forward 2x3 matrix, in pixel index coordinates, of ImageMagick's affine projection arguments
+    :param args: sx, rx, ry, sy, tx, ty (u = sx*x + ry*y + tx, v = rx*x + sy*y + ty)
+    :return: 2x3 matrix
+    """
+    sx, rx, ry, sy, tx, ty = args
+    # pixel centers are at +0.5 for ImageMagick, at 0 for OpenCV
+    return numpy.array([[sx, ry, tx + 0.5 * (sx + ry) - 0.5],
+                        [rx, sy, ty + 0.5 * (rx + sy) - 0.5]], dtype=numpy.float64)
+
+
+def affineProjection(image: numpy.ndarray, args):
+    """
+        as image.distort('affine_projection', args) with transparent virtual pixels, the size is kept
+    :param image: RGBA image
+    :param args: sx, rx, ry, sy, tx, ty
+    :return: distorted image
+    """
+    h, w = image.shape[:2]
+    return cv2.warpAffine(image, getAffineProjectionMatrix(args), (w, h), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
+
+
+class ArcTransform:
+    """
+        arc distortion of a w x h image, see arcDistort
+    """
+    # the output is the bounding box of the arc, nothing of the image is cut
+    clips = False
+
+    def __init__(self, w: int, h: int, arc: float, rotate: float = 0, cache: RemapCache = None, quantize: int = 1,
+                 chainCache: RemapCache = None):
+        """
+        :param cache: arc maps are reused for equal quantized sizes and angles if given, see arcDistort
+        :param quantize: with a cache, the image is padded to a multiple of quantize pixels
+        :param chainCache: with a cache, maps of the arc fused with the matrix steps after it are reused for equal
+                           quantized sizes, angles and matrices (see renderTransforms)
+        """
+        self.arc = arc
+        self.rotate = rotate
+        self.cache = cache
+        self.chainCache = chainCache if cache is not None else None
+        self.quantize = quantize
+        # the image is padded to the quantized size when cached, the padding is part of the transform
+        if cache is not None:
+            qw, qh = -(-w // quantize) * quantize, -(-h // quantize) * quantize
+        else:
+            qw, qh = w, h
+        self.offset = ((qw - w) // 2, (qh - h) // 2)
+        # cache key of the maps of the padded image
+        self.key = (qw, qh, arc, rotate)
+        self.coefficients, (x, y, width, height) = getArcCoefficients(qw, qh, arc, rotate)
+        self.origin = (x, y)
+        self.size = (width, height)
+
+    def inverse(self, X: numpy.ndarray, Y: numpy.ndarray):
+        """
+            input coordinates of output coordinates
+        """
+        srcX, srcY = getArcSource(self.coefficients, self.origin, X, Y)
+        return srcX - self.offset[0], srcY - self.offset[1]
+
+    def forward(self, points: numpy.ndarray):
+        """
+            output coordinates of input points (n, 2)
+        """
+        c0, c1, c2, c3, c4 = self.coefficients
+        angle = c0 + 2 * pi * (points[:, 0] + self.offset[0] - c4) / c1
+        radius = c2 - (points[:, 1] + self.offset[1] + 0.5) / c3
+        return numpy.stack((radius * numpy.cos(angle) - self.origin[0] - 0.5,
+                            radius * numpy.sin(angle) - self.origin[1] - 0.5), axis=1)
+
+    def render(self, image: numpy.ndarray):
+        return arcDistort(image, self.arc, self.rotate, cache=self.cache, quantize=self.quantize)
+
+
+class MatrixTransform:
+    """
+        affine or perspective transform given by its forward 3x3 matrix (pixel index coordinates)
+    """
+
+    def __init__(self, matrix: numpy.ndarray, size: tuple, interpolation: int = cv2.INTER_LINEAR, clips: bool = True):
+        """
+        :param matrix: forward 3x3 matrix
+        :param size: output (width, height)
+        :param interpolation: OpenCV interpolation flag
+        :param clips: whether the output may cut the transformed image, False if size bounds all of it
+        """
+        self.matrix = numpy.asarray(matrix, dtype=numpy.float64)
+        self.size = size
+        self.interpolation = interpolation
+        self.clips = clips
+
+    def isAffine(self):
+        return numpy.array_equal(self.matrix[2], [0, 0, 1])
+
+    def compose(self, other):
+        """
+            this transform followed by other
+        """
+        return MatrixTransform(other.matrix @ self.matrix, other.size, max(self.interpolation, other.interpolation),
+                               clips=other.clips)
+
+    def inverse(self, X: numpy.ndarray, Y: numpy.ndarray):
+        """
+            input coordinates of output coordinates, points mapped from infinity are outside
+        """
+        m = numpy.linalg.inv(self.matrix).astype(X.dtype)
+        srcX = m[0, 0] * X + m[0, 1] * Y + m[0, 2]
+        srcY = m[1, 0] * X + m[1, 1] * Y + m[1, 2]
+        if self.isAffine():
+            return srcX, srcY
+        W = m[2, 0] * X + m[2, 1] * Y + m[2, 2]
+        W = numpy.divide(1, W, out=numpy.full_like(W, -1e6), where=W != 0)
+        return srcX * W, srcY * W
+
+    def forward(self, points: numpy.ndarray):
+        """
+            output coordinates of input points (n, 2)
+        """
+        return cv2.perspectiveTransform(points.reshape(1, -1, 2).astype(numpy.float64), self.matrix)[0]
+
+    def render(self, image: numpy.ndarray):
+        if self.isAffine():
+            return cv2.warpAffine(image, self.matrix[:2], self.size, flags=self.interpolation,
+                                  borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
+        return cv2.warpPerspective(image, self.matrix, self.size, flags=self.interpolation,
+                                   borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
+
+
+def renderTransforms(image: numpy.ndarray, transforms: list):
+    """
+        apply a sequence of transforms with a single resampling of the image. Matrices are multiplied when the first
+        one does not clip, the remaining steps are chained on the coordinates of the output, from the last transform
+        to the first. Coordinates falling outside of the output of a clipping step are moved outside of the image, as
+        the sequential application would have cut them. The maps of an arc followed by matrix steps are cached as a
+        whole when the arc has a chain cache, on a miss they are computed as above.
+    :param image: RGBA image
+    :param transforms: ArcTransform and MatrixTransform in order, each sized for the output of the previous one
+    :return: transformed image, of the size of the last transform
+    """
+    fused = []
+    for transform in transforms:
+        if fused and isinstance(transform, MatrixTransform) and isinstance(fused[-1], MatrixTransform) \
+                and not fused[-1].clips:
+            fused[-1] = fused[-1].compose(transform)
+        else:
+            fused.append(transform)
+    if len(fused) == 0:
+        return image
+    if len(fused) == 1:
+        return fused[0].render(image)
+    arc = fused[0]
+    if isinstance(arc, ArcTransform) and arc.chainCache is not None \
+            and all(isinstance(t, MatrixTransform) for t in fused[1:]):
+        # the maps depend on the quantized arc and on the matrices only, they are built for the padded image
+        key = (arc.key,) + tuple((t.matrix.tobytes(), t.size, t.clips) for t in fused[1:])
+
+        def build():
+            mapX, mapY = getChainMaps(fused)
+            mapX += arc.offset[0]
+            mapY += arc.offset[1]
+            return mapX, mapY
+        xy, interpolation = arc.chainCache.get(key, build)
+        return remapRGBA(padCentered(image, *arc.key[:2]), xy, interpolation)
+    # a single bilinear resampling, cubic remapping costs several times more
+    return remapRGBA(image, *getChainMaps(fused))
+
+
+def getChainMaps(fused: list):
+    """
+        source coordinates of every output pixel of fused transforms (see renderTransforms)
+    :return: mapX, mapY (float32, size of the last transform)
+    """
+    width, height = fused[-1].size
+    X = numpy.arange(width, dtype=numpy.float32).reshape(1, -1)
+    Y = numpy.arange(height, dtype=numpy.float32).reshape(-1, 1)
+    outside = numpy.zeros((height, width), dtype=bool)
+    for k in range(len(fused) - 1, -1, -1):
+        X, Y = fused[k].inverse(X, Y)
+        if k > 0 and fused[k - 1].clips:
+            # farther than one pixel from the clipped output, the pixel would not contribute to the interpolation
+            w, h = fused[k - 1].size
+            outside |= (X <= -1) | (X >= w) | (Y <= -1) | (Y >= h)
+    X, Y = numpy.broadcast_arrays(X, Y)
+    # out of reach of the interpolation
+    mapX = numpy.where(outside, numpy.float32(-10), X).astype(numpy.float32)
+    mapY = numpy.where(outside, numpy.float32(-10), Y).astype(numpy.float32)
+    return mapX, mapY
+
+
+def transformBoxes(bboxes: list, transforms: list, samples: int = 5):
+    """
+        boxes of the images of bboxes through a sequence of transforms, points along the box edges are mapped so
+        that bent boxes are bounded too
+    :param bboxes: [x1, y1, x2, y2] boxes of the input
+    :param transforms: ArcTransform and MatrixTransform in order
+    :param samples: points per box edge
+    :return: [x1, y1, x2, y2] boxes of the output, clipped to it
+    """
+    if len(transforms) == 0 or len(bboxes) == 0:
+        return bboxes
+    t = numpy.linspace(0, 1, samples)
+    points = []
+    for x1, y1, x2, y2 in bboxes:
+        x = x1 + t * (x2 - x1)
+        y = y1 + t * (y2 - y1)
+        points.append(numpy.concatenate((numpy.stack((x, numpy.full(samples, y1)), axis=1),
+                                         numpy.stack((x, numpy.full(samples, y2)), axis=1),
+                                         numpy.stack((numpy.full(samples, x1), y), axis=1),
+                                         numpy.stack((numpy.full(samples, x2), y), axis=1))))
+    points = numpy.concatenate(points)
+    for transform in transforms:
+        points = transform.forward(points)
+    w, h = transforms[-1].size
+    points = points.reshape(len(bboxes), -1, 2)
+    lows = numpy.floor(points.min(axis=1))
+    highs = numpy.ceil(points.max(axis=1))
+    return [[int(min(max(x1, 0), w)), int(min(max(y1, 0), h)), int(min(max(x2, 0), w)), int(min(max(y2, 0), h))]
+            for (x1, y1), (x2, y2) in zip(lows, highs)]
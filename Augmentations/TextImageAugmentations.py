@@ -1,8 +1,9 @@
 import numpy
 
-from Augmentations import WrapText, CustomSequenceAugmentations, AffineTransform
+from Augmentations import WrapText, GeometricSequenceAugmentations, AffineTransform
 from Augmentations.Augmentations import Transformation3D
 from Texture import Painter, TextureMixer
+from profiler import PROFILER
 
 
 class TextImageAugmentations:
@@ -17,13 +18,33 @@ class TextImageAugmentations:
         p = args["Texture"]["TextureMixer"]["p"]
         root = args["Texture"]["TextureMixer"]["root"]
         maxOpacity = args["Texture"]["TextureMixer"]["maxOpacity"]
-        return TextureMixer(p=p, root=root, maxOpacity=maxOpacity)
+        cacheArgs = args["Texture"]["TextureMixer"]["cache"]
+        return TextureMixer(p=p, root=root, maxOpacity=maxOpacity,
+                            cacheBytes=cacheArgs["maxBytes"], paletteSize=cacheArgs["paletteSize"])
 
-    def apply(self, image: numpy.ndarray):
-        image = self.layoutAugmentation(image=image)
-        image = self.painter(image)
-        image = self.texture(image)
-        return image
+    def apply(self, image: numpy.ndarray, rng: numpy.random.Generator, paletteSeed: tuple = None):
+        """
+            apply layout augmentations, color and texture
+        :param image: text image
+        :param rng: random generator of the word
+        :param paletteSeed: seed of the texture palette (see getPalette)
+        :return: augmented image
+        """
+        return self.applyWithBoxes(image, rng, paletteSeed, bboxes=[])[0]
+
+    def applyWithBoxes(self, image: numpy.ndarray, rng: numpy.random.Generator, paletteSeed: tuple = None,
+                       bboxes: list = None):
+        """
+            apply, the character boxes follow the layout augmentations
+        :param bboxes: [x1, y1, x2, y2] character boxes of image
+        :return: augmented image, character boxes
+        """
+        image, bboxes = self.layoutAugmentation.applyWithBoxes(image=image, rng=rng, bboxes=bboxes or [])
+        with PROFILER.stage("TextImageAugmentations/Painter", image):
+            image = self.painter(image, rng)
+        with PROFILER.stage("TextImageAugmentations/TextureMixer", image):
+            image = self.texture(image, rng, paletteSeed)
+        return image, bboxes
 
     @staticmethod
     def getCustomLayoutAugmentations(args):
@@ -32,11 +53,15 @@ class TextImageAugmentations:
         for augName in list(augmentations.keys()):
             p = augmentations[augName]['p']
             if "WrapText" in augName:
+                cacheArgs = augmentations[augName].get("cache", {})
                 newAugmentation = WrapText(p,
                                            arcAngle=[augmentations[augName]["minArcAngle"],
                                                      augmentations[augName]["maxArcAngle"]],
                                            rotateAngle=[augmentations[augName]["minRotateAngle"],
-                                                        augmentations[augName]["maxRotateAngle"]])
+                                                        augmentations[augName]["maxRotateAngle"]],
+                                           cacheBytes=cacheArgs.get("maxBytes"),
+                                           quantize=cacheArgs.get("quantize", 1),
+                                           chainCacheBytes=cacheArgs.get("chainMaxBytes"))
             elif "AffineTransform" in augName:
                 newAugmentation = AffineTransform(p,
                                                   augmentations[augName]["maxRotate"],
@@ -49,4 +74,4 @@ class TextImageAugmentations:
             else:
                 raise Exception("Unknown augmentation type pn char image augmentations!")
             sequence.append(newAugmentation)
-        return CustomSequenceAugmentations(sequence)
+        return GeometricSequenceAugmentations(sequence, name="TextImageAugmentations")
@@ -1,3 +1,4 @@
-from Augmentations.Augmentations import CustomSequenceAugmentations, PadLeftRight, ResizeChar, WrapText, AffineTransform
+from Augmentations.Augmentations import CustomSequenceAugmentations, GeometricSequenceAugmentations, PadLeftRight, \
+    ResizeChar, WrapText, AffineTransform
 from Augmentations.TextImageAugmentations import TextImageAugmentations
 from Augmentations.CharImageAugmentations import CharImageAugmentations
@@ -1,9 +1,8 @@
-import os
 import cv2
 import numpy
-from PIL import Image
 
 from Texture import Painter
+from Texture.ImageCache import getImageCache, getImageSizeIndex, getPalette
 
 
 class BackgroundBlender:
@@ -14,51 +13,85 @@ class BackgroundBlender:
         self.distanceTh = args["BackgroundTexture"]["distanceTh"]
         self.numColor = args["BackgroundTexture"]["numColor"]
         self.resizeSize = (128, 32)
-        self.imagePaths = None
+        self.sizeIndex = None
         self.oneColorP = args["BackgroundTexture"]["oneColorP"]
+        self.batchSize = args["BackgroundTexture"]["batchSize"]
+        cacheArgs = args["BackgroundTexture"]["cache"]
+        self.paletteSize = cacheArgs["paletteSize"]
+        self.cache = getImageCache("background",
+                                   maxBytes=cacheArgs["maxBytes"],
+                                   maxSide=cacheArgs["maxSide"])
         return
 
-    def __call__(self, image: numpy.ndarray):
-        background = self.getAppropriateBackground(image)
-        if background is not None:
-            image = self.blender(image=image, background=background)
-        return image
+    def __call__(self, image: numpy.ndarray, rng: numpy.random.Generator, paletteSeed: tuple = None):
+        return self.blendBatch(image, n=1, rng=rng, paletteSeed=paletteSeed)[0]
+
+    def blendBatch(self, image: numpy.ndarray, n: int, rng: numpy.random.Generator, paletteSeed: tuple = None):
+        """
+            blend text image with n appropriate backgrounds
+        :param image: text image
+        :param n: number of samples
+        :param rng: random generator
+        :param paletteSeed: backgrounds are drawn from the palette of this seed (None: from all backgrounds)
+        :return: samples (n, h, w, 4), text image itself where there isn't any appropriate background
+        """
+        backgrounds = self.getAppropriateBackgrounds(image, n=n, rng=rng, paletteSeed=paletteSeed)
+        samples = numpy.empty((n,) + image.shape, dtype=numpy.uint8)
+        samples[:] = image
+        blended = [i for i, b in enumerate(backgrounds) if b is not None]
+        if len(blended) > 0:
+            samples[blended] = self.blender(image=image,
+                                            background=numpy.stack([backgrounds[i] for i in blended]))
+        return samples
 
     @staticmethod
     def blender(image: numpy.ndarray, background: numpy.ndarray):
-        h, w, _ = image.shape
-        mask = image[..., 3] > 0
-        mask = mask.reshape(h, w, 1).repeat(4, axis=2)
-        image = image * mask
-
-        image = Image.fromarray(image.astype(numpy.uint8))
-        background = Image.fromarray(background.astype(numpy.uint8))
-        mask = Image.fromarray(numpy.array(image)[..., 3])
-        image = Image.composite(image, background, mask)
-        image = numpy.array(image)
-
-        return image.astype(numpy.uint8)
+        """
+            alpha composite text image over background(s)
+        :param image: text image (h, w, 4)
+        :param background: background (h, w, 4) or backgrounds (n, h, w, 4)
+        :return: composited image(s)
+        """
+        image = image.astype(numpy.uint8)
+        weights = image[..., 3].astype(numpy.float32) / 255
+        backgrounds = background.astype(numpy.uint8).reshape((-1,) + image.shape)
+        images = numpy.stack([cv2.blendLinear(image, bg, weights, 1 - weights) for bg in backgrounds])
+        return images.reshape(background.shape)
 
-    def getAppropriateBackground(self, image: numpy.ndarray):
+    def getAppropriateBackground(self, image: numpy.ndarray, rng: numpy.random.Generator, paletteSeed: tuple = None):
         """
             returns appropriate background image for text image
         :param image: text image
+        :param rng: random generator
+        :param paletteSeed: seed of the background palette
         :return: background image
         """
+        return self.getAppropriateBackgrounds(image, n=1, rng=rng, paletteSeed=paletteSeed)[0]
+
+    def getAppropriateBackgrounds(self, image: numpy.ndarray, n: int, rng: numpy.random.Generator,
+                                  paletteSeed: tuple = None):
+        """
+            returns n appropriate background images for text image, candidates are scored in batches
+        :param image: text image
+        :param n: number of backgrounds
+        :param rng: random generator
+        :param paletteSeed: seed of the background palette
+        :return: list of background images, None if no appropriate background is found
+        """
         h, w, _ = image.shape
         imgResized = cv2.resize(image, self.resizeSize, interpolation=cv2.INTER_CUBIC)
 
-        background = None
-        appropriate = False
+        backgrounds = []
+        maxTries = 11 * n
         counter = 0
-        while not appropriate:
-            background = self.getBackgroundImage(w=w, h=h)
-            appropriate = self.isAppropriate(imageResized=imgResized, background=background)
-            counter += 1
-            if counter > 10:
-                background = None
-                break
-        return background
+        while len(backgrounds) < n and counter < maxTries:
+            k = min(max(self.batchSize, n - len(backgrounds)), maxTries - counter)
+            candidates = [self.getBackgroundImage(w=w, h=h, rng=rng, paletteSeed=paletteSeed) for _ in range(k)]
+            appropriate = self.areAppropriate(imageResized=imgResized, backgrounds=candidates)
+            backgrounds += [c for c, a in zip(candidates, appropriate) if a]
+            counter += k
+        backgrounds = backgrounds[:n]
+        return backgrounds + [None] * (n - len(backgrounds))
 
     def isAppropriate(self, imageResized: numpy.ndarray, background: numpy.ndarray):
         """
@@ -67,78 +100,83 @@ class BackgroundBlender:
         :param background: background
         :return: True / False
         """
+        return self.areAppropriate(imageResized=imageResized, backgrounds=[background])[0]
+
+    def areAppropriate(self, imageResized: numpy.ndarray, backgrounds: list):
+        """
+            check are backgrounds appropriate, all candidates are scored as one (K, h, w) tensor
+        :param imageResized: resized image
+        :param backgrounds: K backgrounds of the same size
+        :return: boolean array (K,)
+        """
         h, w, c = self.resizeSize[1], self.resizeSize[0], 4
         assert imageResized.shape == (h, w, c)
+        k = len(backgrounds)
+        numBins = self.numColor + 1
 
         mask = imageResized[..., 3] > 0
-        mask = mask.astype(int).reshape(h, w, 1).repeat(4, axis=2)
-        bgResized = cv2.resize(background, self.resizeSize, interpolation=cv2.INTER_CUBIC)
-
-        imageResized = imageResized * mask
-        bgResized = bgResized * (1 - mask)
 
-        merged = numpy.concatenate((imageResized, bgResized), axis=0)
+        # candidates are resized as uint8 RGBA images before the gray conversion, as the per-candidate check did, so
+        # the rounding and the decisions are the same
+        resized = numpy.stack([cv2.resize(b, self.resizeSize, interpolation=cv2.INTER_CUBIC) for b in backgrounds])
+        grays = self.rgb2gray(resized) * ~mask
 
         # old version
         # merged = Image.fromarray(merged.astype(numpy.uint8)[..., :3]).quantize(colors=self.numColor)
         # merged = numpy.array(merged)
 
-        merged = self.rgb2gray(merged)
-        merged = merged / 255
-        merged = merged * self.numColor
-        merged = merged.astype(numpy.uint8)
+        imgGray = self.rgb2gray(imageResized) * mask
+        imgHist = numpy.bincount(self.quantize(imgGray).ravel(), minlength=numBins)
 
-        bgHist = numpy.zeros((self.numColor+1,))
-        imgHist = numpy.zeros((self.numColor+1,))
+        bins = self.quantize(grays) + numBins * numpy.arange(k).reshape(k, 1, 1)
+        bgHist = numpy.bincount(bins.ravel(), minlength=k * numBins).reshape(k, numBins)
 
-        colors, counts = numpy.unique(merged[:h], return_counts=True)
-        for i, c in enumerate(colors):
-            imgHist[c] = counts[i]
-
-        maxCount = numpy.max(imgHist)
-
-        colors, counts = numpy.unique(merged[h:], return_counts=True)
-        for i, c in enumerate(colors):
-            bgHist[c] = counts[i]
-
-        if numpy.max(counts) > maxCount:
-            maxCount = numpy.max(bgHist)
-
-        bgHist = bgHist / maxCount
-        imgHist = imgHist / maxCount
-        distance = numpy.sum(numpy.abs(imgHist[1:] - bgHist[1:]))
+        maxCount = numpy.maximum(imgHist.max(), bgHist.max(axis=1))
+        maxCount = maxCount.reshape(k, 1)
+        distance = numpy.abs(imgHist[1:] / maxCount - bgHist[:, 1:] / maxCount).sum(axis=1)
 
         return distance >= self.distanceTh
 
-    def getBackgroundImage(self, w: int, h: int):
+    def quantize(self, gray: numpy.ndarray):
+        return (gray / 255 * self.numColor).astype(numpy.int64)
+
+    def getBackgroundImage(self, w: int, h: int, rng: numpy.random.Generator, paletteSeed: tuple = None):
         """
             produce background image for text image
         :param w: width of text image
         :param h: height of text image
+        :param rng: random generator
+        :param paletteSeed: backgrounds are drawn from the palette of this seed (None: from all backgrounds)
         :return: image of texture
         """
+        paths = []
+        if rng.random() > self.oneColorP:
+            # only images larger than the text image are candidates
+            if paletteSeed is not None:
+                paths = getPalette(self.root, 0, paletteSeed, self.paletteSize).getPaths(w=w, h=h)
+            if len(paths) == 0:
+                paths = self.getSizeIndex().getPaths(w=w, h=h)
         texture = None
-        while texture is None:
-            if numpy.random.rand() <= self.oneColorP:
-                texture = numpy.empty((h, w, 4))
-                texture[..., :] = Painter.getColor()
-                noise = numpy.random.randint(low=-10, high=10, size=texture.shape)
-                texture += noise
-                texture = numpy.clip(texture, a_min=0, a_max=255)
-            else:
-                # if texture is None, there isn't any appropriate w and h
-                path = self.getImagePath()
-                texture = numpy.array(Image.open(path).convert("RGBA"))
-                texture = self.getBackgroundCrop(texture=texture, w=w, h=h)
+        if len(paths) > 0:
+            texture = self.cache.sample(paths, rng)
+            # None if the image was downscaled on decode (cache maxSide) below the text image size
+            texture = self.getBackgroundCrop(texture=texture, w=w, h=h, rng=rng)
+        if texture is None:
+            texture = numpy.empty((h, w, 4), dtype=numpy.int16)
+            texture[..., :] = Painter.getColor(rng)
+            noise = rng.integers(low=-10, high=10, size=texture.shape, dtype=numpy.int16)
+            texture += noise
+            texture = numpy.clip(texture, a_min=0, a_max=255).astype(numpy.uint8)
         return texture
 
     @staticmethod
-    def getBackgroundCrop(texture: numpy.ndarray, w: int, h: int):
+    def getBackgroundCrop(texture: numpy.ndarray, w: int, h: int, rng: numpy.random.Generator):
         """
             crop the background image
         :param texture: texture image
         :param w: width of image
         :param h: height of image
+        :param rng: random generator
         :return: crop of texture
         """
         hTexture, wTexture, _ = texture.shape
@@ -148,21 +186,18 @@ class BackgroundBlender:
 
         rangeH = hTexture - h
         rangeW = wTexture - w
-        x = numpy.random.randint(low=0, high=rangeW)
-        y = numpy.random.randint(low=0, high=rangeH)
+        x = rng.integers(low=0, high=rangeW)
+        y = rng.integers(low=0, high=rangeH)
         return texture[y:y + h, x:x + w, ...]
 
-    def getImagePath(self):
+    def getSizeIndex(self):
         """
-            select randomly an image path for given dataset
-        :return: path
+            size index of background images
+        :return: ImageSizeIndex
         """
-        if self.imagePaths is None:
-            imagePaths = os.listdir(self.root)
-            self.imagePaths = [os.path.join(self.root, p) for p in imagePaths]
-
-        path = numpy.random.choice(self.imagePaths)
-        return path
+        if self.sizeIndex is None:
+            self.sizeIndex = getImageSizeIndex(self.root)
+        return self.sizeIndex
 
     def rgb2gray(self, image: numpy.ndarray):
         """
@@ -1,13 +1,16 @@
 import numpy
 from PIL import ImageFont, Image, ImageDraw
 
+from profiler import PROFILER
+
 
 class CharImage:
     def __init__(self, text: str,
                  font: ImageFont,
                  colorType: str = "OneColor",
                  color: list or tuple = None,
-                 bold: bool = False):
+                 bold: bool = False,
+                 atlas=None):
         """
             Text Image Class
         :param text: text which will draw on an image
@@ -15,6 +18,7 @@ class CharImage:
         :param colorType: texture or OneColor
         :param color: text colour
         :param bold: bold or not
+        :param atlas: GlyphAtlas, rendered glyphs are reused if given (images are read-only)
         """
         if colorType != "texture":
             assert len(color) == 4, "Color has to be 4 channel because of RGBA Image"
@@ -27,6 +31,7 @@ class CharImage:
         else:
             self.color = color
         self.bold = bold
+        self.atlas = atlas
 
         self.stroke_width = 1
         self.direction = "ltr"
@@ -48,6 +53,15 @@ class CharImage:
 
     def getImage(self):
         if self.image is None:
+            if self.atlas is not None:
+                self.image, self.bbox = self.atlas.getGlyph(self)
+            else:
+                self.image, self.bbox = self.render()
+
+        return self.image, self.bbox
+
+    def render(self):
+        with PROFILER.stage("CharImage.render"):
             bbox = self.getBbox()
             width, height = bbox[2:]
 
@@ -61,28 +75,25 @@ class CharImage:
                       direction=self.direction)
 
             image = numpy.array(image, dtype=numpy.uint8)
-
-            self.image = image
-            self.bbox = bbox
-
-        return self.image, self.bbox
+        return image, bbox
 
     def getBbox(self):
         ascent, descent = self.font.getmetrics()
         width = self.font.getsize(self.text, direction=self.direction)[0]
-        height = ascent + descent
-        bbox = [self.x, height-ascent, width, height]
+        self.setMetrics(ascent=ascent, descent=descent, width=width)
+        bbox = [self.x, self.height - ascent, width, self.height]
+        return bbox
 
+    def setMetrics(self, ascent: int, descent: int, width: int):
         self.ascent = ascent
         self.descent = descent
         self.width = width
-        self.height = height
+        self.height = ascent + descent
 
         # can be calculated based on ascent and decent
         self.centerx = width // 2
-        self.centery = height // 2
-
-        return bbox
+        self.centery = self.height // 2
+        return
 
 
 def test1():
@@ -0,0 +1,169 @@
+"""
+    Compiled corpus: the deduplicated, sorted words of the text datasets in one file, memory-mapped at startup so that
+    loading is immediate and forked workers share the pages instead of holding their own Python strings.
+
+    Layout (little-endian):
+        magic (8 bytes) | count, maxLength, blobBytes, sourcesBytes (uint64)
+        sources (JSON, padded to 8 bytes): [path, size, mtime_ns] of every dataset file, a corpus whose sources
+                                           changed is compiled again (see loadCorpus)
+        offsets (uint64, count + 1): UTF-8 byte range of every word in the blob
+        byLength (uint32, count, padded to 8 bytes): word indices ordered by character length, then index
+        buckets (uint64, maxLength + 2): byLength position of the first word of every length
+        blob (UTF-8 bytes of the words)
+
+    python -m Components.Corpus sources/text/corpus.bin sources/text/turkish_words.txt ...
+"""
+import argparse
+import json
+import mmap
+import os
+import tempfile
+
+import numpy
+
+MAGIC = b"STSCORP2"
+
+
+def readWords(datasets: list):
+    """
+        deduplicated and sorted words of the dataset files, one word per line
+    """
+    words = set()
+    for dPath in datasets:
+        with open(dPath, 'r') as fp:
+            for w in fp.readlines():
+                words.add(w.strip())
+    # sorted, so word indices do not depend on the hash seed of the process
+    return sorted(words)
+
+
+def getLengthBuckets(lengths: numpy.ndarray):
+    """
+        word indices ordered by length (then index) and the position of the first word of every length
+    :param lengths: character length of every word
+    :return: byLength, buckets (words of length L are byLength[buckets[L]:buckets[L + 1]])
+    """
+    byLength = numpy.argsort(lengths, kind="stable").astype(numpy.uint32)
+    maxLength = int(lengths.max()) if len(lengths) > 0 else 0
+    buckets = numpy.searchsorted(lengths[byLength], numpy.arange(maxLength + 2), side="left").astype(numpy.uint64)
+    return byLength, buckets
+
+
+def getCandidates(byLength: numpy.ndarray, buckets: numpy.ndarray, maxLength: int):
+    """
+        indices of the words of at most maxLength characters
+    """
+    return byLength[:int(buckets[min(maxLength + 1, len(buckets) - 1)])]
+
+
+def getSources(datasets: list):
+    """
+        [absolute path, size, mtime_ns] of every dataset file
+    """
+    sources = []
+    for dPath in datasets:
+        stat = os.stat(dPath)
+        sources.append([os.path.abspath(dPath), stat.st_size, stat.st_mtime_ns])
+    return sources
+
+
+def compileCorpus(datasets: list, path: str):
+    """
+        write the compiled corpus of the dataset files, processes compiling at the same time write their own
+        temporary files and the last one replaces the corpus
+    :param datasets: text files, one word per line
+    :param path: output path
+    """
+    # read before the words, a file changed while it is read makes the corpus stale
+    sources = json.dumps(getSources(datasets)).encode("utf-8")
+    sources += b" " * (-len(sources) % 8)
+    words = readWords(datasets)
+    encoded = [w.encode("utf-8") for w in words]
+    lengths = numpy.fromiter((len(w) for w in words), dtype=numpy.int64, count=len(words))
+    offsets = numpy.zeros(len(words) + 1, dtype=numpy.uint64)
+    numpy.cumsum([len(b) for b in encoded], out=offsets[1:])
+    byLength, buckets = getLengthBuckets(lengths)
+    maxLength = len(buckets) - 2
+
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with open(fd, 'wb') as f:
+        f.write(MAGIC)
+        f.write(numpy.array([len(words), maxLength, int(offsets[-1]), len(sources)], dtype="<u8").tobytes())
+        f.write(sources)
+        f.write(offsets.astype("<u8").tobytes())
+        f.write(byLength.astype("<u4").tobytes())
+        f.write(b"\0" * (4 * (len(words) % 2)))
+        f.write(buckets.astype("<u8").tobytes())
+        f.write(b"".join(encoded))
+    # mkstemp creates the file readable by the owner only
+    os.chmod(tmpPath, 0o644)
+    os.replace(tmpPath, path)
+    return
+
+
+def loadCorpus(path: str, datasets: list):
+    """
+        memory-map the compiled corpus of the dataset files, it is compiled first if it does not exist, has an older
+        format or its dataset files changed
+    :param path: compiled corpus path
+    :param datasets: text files, one word per line
+    :return: Corpus
+    """
+    if os.path.exists(path):
+        try:
+            corpus = Corpus(path)
+            if corpus.sources == getSources(datasets):
+                return corpus
+            print(f"Dataset files of {path} changed, compiling it again.")
+        except Exception as e:
+            print(f"{e}, compiling it again.")
+    compileCorpus(datasets, path)
+    return Corpus(path)
+
+
+class Corpus:
+    """
+        read-only, memory-mapped compiled corpus, indexed like the sorted word list
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise Exception(f"{path} is not a compiled corpus")
+        self.count, self.maxLength, blobBytes, sourcesBytes = (int(v) for v in
+                                                               numpy.frombuffer(self.mm, "<u8", 4, len(MAGIC)))
+        position = len(MAGIC) + 32
+        self.sources = json.loads(self.mm[position:position + sourcesBytes].decode("utf-8"))
+        position += sourcesBytes
+        self.offsets = numpy.frombuffer(self.mm, "<u8", self.count + 1, position)
+        position += 8 * (self.count + 1)
+        self.byLength = numpy.frombuffer(self.mm, "<u4", self.count, position)
+        position += 4 * (self.count + self.count % 2)
+        self.buckets = numpy.frombuffer(self.mm, "<u8", self.maxLength + 2, position)
+        self.blobStart = position + 8 * (self.maxLength + 2)
+        assert self.blobStart + blobBytes == len(self.mm), f"{path} is truncated"
+        return
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i: int):
+        start = self.blobStart + int(self.offsets[i])
+        end = self.blobStart + int(self.offsets[i + 1])
+        return self.mm[start:end].decode("utf-8")
+
+    def getCandidates(self, maxLength: int):
+        """
+            indices of the words of at most maxLength characters (a view of the mapped file)
+        """
+        return getCandidates(self.byLength, self.buckets, maxLength)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output", help="compiled corpus path")
+    parser.add_argument("datasets", nargs="+", help="text files, one word per line")
+    opt = parser.parse_args()
+    compileCorpus(opt.datasets, opt.output)
+    print(f"{len(Corpus(opt.output))} words written to {opt.output}")
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+
+
+class GlyphAtlas:
+    """
+        LRU cache of rendered character images keyed by (font path, size, char, color, stroke, direction).
+        Cached images are read-only, users have to copy them before writing.
+    """
+
+    def __init__(self, maxBytes: int = 64 * 1024 * 1024):
+        """
+        :param maxBytes: memory limit of cached glyph images
+        """
+        self.maxBytes = maxBytes
+        self.glyphs = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        return
+
+    @staticmethod
+    def getKey(charImage):
+        font = charImage.font
+        # fonts which are not loaded from a file path are keyed by the object itself
+        fontKey = font.path if isinstance(font.path, str) else font
+        return fontKey, font.size, charImage.text, tuple(charImage.color), charImage.stroke_width, charImage.direction
+
+    def getGlyph(self, charImage):
+        """
+            returns rendered image and bbox of the character, renders it on a miss
+        :param charImage: CharImage object
+        :return: image, bbox
+        """
+        key = self.getKey(charImage)
+        glyph = self.glyphs.get(key)
+        if glyph is not None:
+            self.hits += 1
+            self.glyphs.move_to_end(key)
+            image, bbox, (ascent, descent, width) = glyph
+            charImage.setMetrics(ascent=ascent, descent=descent, width=width)
+            return image, list(bbox)
+
+        self.misses += 1
+        image, bbox = charImage.render()
+        image.setflags(write=False)
+        self.glyphs[key] = (image, tuple(bbox), (charImage.ascent, charImage.descent, charImage.width))
+        self.nbytes += image.nbytes
+        while self.nbytes > self.maxBytes and len(self.glyphs) > 1:
+            _, (oldImage, _, _) = self.glyphs.popitem(last=False)
+            self.nbytes -= oldImage.nbytes
+        return image, bbox
+
+    def stats(self):
+        return {"glyphs": len(self.glyphs), "bytes": self.nbytes, "hits": self.hits, "misses": self.misses}
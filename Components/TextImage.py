@@ -1,29 +1,39 @@
-import copy
 from typing import List
 
 import numpy
 import tqdm as tqdm
 from PIL import Image
 
-from Augmentations import TextImageAugmentations, CharImageAugmentations
-from Components.BackgroundBlender import BackgroundBlender
 from Components.CharImage import CharImage
-from utils import saveRGBAImage
+from Components.TextPipeline import TextPipeline
+from profiler import PROFILER
+from utils import StageTracer
 
 
 class TextImage:
-    def __init__(self, characters: List[CharImage], cfgCharAugmentations=None, cfgTextAugmentations=None, cfgBackground=None):
+    def __init__(self, characters: List[CharImage], pipeline: TextPipeline = None, tracer: StageTracer = None,
+                 rng: numpy.random.Generator = None, paletteSeed: tuple = None, progress: bool = True):
+        """
+            state of a word, its samples are generated by the shared pipeline
+        :param characters: character images
+        :param pipeline: augmentation stages (None: only the word image is available)
+        :param tracer: dumps intermediate images of some words
+        :param rng: random generator of the word, every random choice of the samples is drawn from it (None: unseeded)
+        :param paletteSeed: seed of the background and texture palettes (None: images are drawn from all images)
+        :param progress: show a progress bar of the samples
+        """
         self.characters = characters
         self.charLength = len(characters)
+        self.tracer = tracer
+        self.rng = rng if rng is not None else numpy.random.default_rng()
+        self.paletteSeed = paletteSeed
+        self.progress = progress
+        self.pipeline = pipeline
 
         self.wordImage = None
         self.charBBoxes = None
 
         self.mergeCharacters()
-
-        self.charImageAugmentations = CharImageAugmentations(cfgCharAugmentations)
-        self.textImageAugmentations = TextImageAugmentations(cfgTextAugmentations)
-        self.blendBackground = BackgroundBlender(cfgBackground)
         return
 
     def getSamples(self, N: [list, tuple]):
@@ -32,30 +42,66 @@ class TextImage:
         :param N: number of generated image (how many char, how many text, how many background)
         :return: image list (length == n)
         """
+        return list(self.iterSamples(N))
+
+    def iterSamples(self, N: [list, tuple]):
+        """
+            generate text images one by one, only the parents of the current branch are kept in memory.
+            Parents (word, char augmented and layout images) are read-only and shared by their branches, augmentations
+            return new arrays instead of copying their input.
+        :param N: number of generated image (how many char, how many text, how many background)
+        :return: generator of images (length == n)
+        """
+        for image, _ in self.iterLabeledSamples(N):
+            yield image
+
+    def iterLabeledSamples(self, N: [list, tuple]):
+        """
+            iterSamples, with the character boxes of every image
+        :param N: number of generated image (how many char, how many text, how many background)
+        :return: generator of (image, [x1, y1, x2, y2] character boxes) (length == n)
+        """
         assert len(N) == 3
-        tbar = tqdm.tqdm(total=N[0]*N[1]*N[2], colour='CYAN')
-        tbar.set_postfix_str(f" str: {''.join(c.text for c in self.characters)}")
-        images = []
+        assert self.pipeline is not None, "TextImage has no pipeline!"
+        charImageAugmentations = self.pipeline.charImageAugmentations
+        textImageAugmentations = self.pipeline.textImageAugmentations
+        blendBackground = self.pipeline.blendBackground
+        text = ''.join(c.text for c in self.characters)
+        traced = self.tracer is not None and self.tracer.isTraced(text)
+        tbar = tqdm.tqdm(total=N[0]*N[1]*N[2], colour='CYAN', disable=not self.progress)
+        tbar.set_postfix_str(f" str: {text}")
         for i in range(N[0]):
             # get base text image
             image, charBboxes = self.getWordImage()
-            saveRGBAImage(image+(255-image[..., 3:4]), f"tests/results/{i}_raw_text_img.jpg")
+            if traced:
+                self.tracer.dump(text, f"{i}_raw_text_img", image+(255-image[..., 3:4]))
             # augment base chars
-            image = self.charImageAugmentations.apply(image=image, bboxes=charBboxes)
-            saveRGBAImage(image+(255-image[..., 3:4]), f"tests/results/{i}_CharAugmented_text_img.jpg")
+            with PROFILER.stage("CharImageAugmentations", image):
+                image, charBboxes = charImageAugmentations.applyWithBoxes(image=image, bboxes=charBboxes,
+                                                                          rng=self.rng)
+            image.setflags(write=False)
+            if traced:
+                self.tracer.dump(text, f"{i}_CharAugmented_text_img", image+(255-image[..., 3:4]))
             for j in range(N[1]):
                 # augment text image
-                image_ = copy.deepcopy(image)
-                image_ = self.textImageAugmentations.apply(image=image_)
-                saveRGBAImage(image_, f"tests/results/{i}-{j}_ImageAugmented_text_img.jpg")
+                with PROFILER.stage("TextImageAugmentations", image):
+                    image_, bboxes = textImageAugmentations.applyWithBoxes(image=image, rng=self.rng,
+                                                                           paletteSeed=self.paletteSeed,
+                                                                           bboxes=charBboxes)
+                image_.setflags(write=False)
+                if traced:
+                    self.tracer.dump(text, f"{i}-{j}_ImageAugmented_text_img", image_)
+                # blend backgrounds, all N[2] samples of the layout at once
+                with PROFILER.stage("BackgroundBlender", image_):
+                    blended = blendBackground.blendBatch(image_, n=N[2], rng=self.rng,
+                                                         paletteSeed=self.paletteSeed)
                 for k in range(N[2]):
-                    # blend background
-                    image__ = copy.deepcopy(image_)
-                    image__ = self.blendBackground(image__)
-                    saveRGBAImage(image__, f"tests/results/{i}-{j}-{k}_last_img.jpg")
-                    images.append(image__)
+                    image__ = blended[k]
+                    if traced:
+                        self.tracer.dump(text, f"{i}-{j}-{k}_last_img", image__)
                     tbar.update(1)
-        return images
+                    yield image__, bboxes
+        tbar.close()
 
     def mergeCharacters(self):
         image_arr = []
@@ -78,11 +124,16 @@ class TextImage:
             image_arr.append(image)
 
         self.wordImage = numpy.concatenate(image_arr, axis=1)
+        # shared by all samples, augmentations do not write their input
+        self.wordImage.setflags(write=False)
         self.charBBoxes = bbox_arr
         return
 
     def getWordImage(self):
-        return copy.deepcopy(self.wordImage), self.charBBoxes
+        """
+            word image (read-only) and character bboxes
+        """
+        return self.wordImage, self.charBBoxes
 
 
 
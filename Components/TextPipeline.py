@@ -0,0 +1,21 @@
+from Augmentations import TextImageAugmentations, CharImageAugmentations
+from Components.BackgroundBlender import BackgroundBlender
+
+
+class TextPipeline:
+    """
+        Augmentation stages of text images (character augmentations, layout / color / texture augmentations and
+        background blending), built once from the configs and shared by every word, forked workers inherit them.
+        Stages keep no state of a word, every random choice is drawn from the random generator of the word.
+    """
+
+    def __init__(self, cfgCharAugmentations, cfgTextAugmentations, cfgBackground):
+        """
+        :param cfgCharAugmentations: char augmentation config
+        :param cfgTextAugmentations: text augmentation config
+        :param cfgBackground: background augmentation config
+        """
+        self.charImageAugmentations = CharImageAugmentations(cfgCharAugmentations)
+        self.textImageAugmentations = TextImageAugmentations(cfgTextAugmentations)
+        self.blendBackground = BackgroundBlender(cfgBackground)
+        return
@@ -1,5 +1,7 @@
 import numpy
 
+from Components.Corpus import loadCorpus, readWords, getLengthBuckets, getCandidates
+
 
 class TextProducer:
     """
@@ -24,86 +26,131 @@ class TextProducer:
         self.pFirstUpperCase = args["pFirstUpperCase"]
         self.pAddNonAlphanumeric = args["pAddNonAlphanumeric"]
 
-        self.words = set()
+        self.words = None
         self.length = None
+        # indices of the words of at most maxLength characters
+        self.candidates = None
         self._readDataset()
         return
 
-    def getText(self):
+    def getText(self, rng: numpy.random.Generator):
         """
             get a text (number or word)
+        :param rng: random generator
         :return: text
         """
-        if numpy.random.rand() <= self.pWord:
-            word = self._getWord()
-            txt = self._augmentWord(word)
+        if rng.random() <= self.pWord:
+            word = self._getWord(rng)
+            txt = self._augmentWord(word, rng)
         else:
-            txt = self._getNumber()
+            txt = self._getNumber(rng)
         return txt
 
-    def _augmentWord(self, word):
+    def getTexts(self, n: int, rng: numpy.random.Generator):
+        """
+            get n texts at once, with the distribution of getText, e.g. for a dispatcher handing out batches of text
+            jobs. Choices are drawn vectorized, only the texts that are changed go through Python string operations.
+            The batch depends only on the state of rng, it is not the texts getText draws from the per-word
+            generators (main.py, the engine and stream keep getText).
+        :param n: number of texts
+        :param rng: random generator the whole batch is drawn from
+        :return: list of texts
+        """
+        isWord = rng.random(n) <= self.pWord
+        words = self.candidates[rng.integers(low=0, high=len(self.candidates), size=n)]
+        allUpper = rng.random(n) <= self.pAllUpperCase
+        firstUpper = ~allUpper & (rng.random(n) <= self.pFirstUpperCase)
+        addChar = rng.random(n) <= self.pAddNonAlphanumeric
+        position = rng.random(n)
+        beginning = rng.integers(low=0, high=len(self.atTheBeginning), size=n)
+        middle = rng.integers(low=0, high=len(self.atTheMiddle), size=n)
+        end = rng.integers(low=0, high=len(self.atTheEnd), size=n)
+        lower10 = rng.random(n) <= self.pLower10
+        numbers = numpy.where(lower10, rng.integers(low=0, high=10, size=n), rng.integers(low=10, high=10 ** 9, size=n))
+
+        texts = numbers.astype(str).tolist()
+        for i in numpy.flatnonzero(isWord):
+            word = self.words[words[i]]
+            if allUpper[i]:
+                word = word.translate(self.lower2upper).upper()
+            elif firstUpper[i]:
+                word = f"{word[0].translate(self.lower2upper).upper()}{word[1:]}"
+            if addChar[i]:
+                if position[i] < 0.33:
+                    word = f"{self.atTheBeginning[beginning[i]]}{word}"
+                elif position[i] <= 0.66:
+                    mid = len(word) // 2
+                    word = f"{word[:mid]}{self.atTheMiddle[middle[i]]}{word[mid:]}"
+                else:
+                    word = f"{word}{self.atTheEnd[end[i]]}"
+            texts[i] = word
+        return texts
+
+    def _augmentWord(self, word, rng: numpy.random.Generator):
         """
             Augment Text
         :param word: raw text
+        :param rng: random generator
         :return: processed text
         """
         # lower case or upper case
-        if numpy.random.rand() <= self.pAllUpperCase:
+        if rng.random() <= self.pAllUpperCase:
             word = word.translate(self.lower2upper).upper()
-        elif numpy.random.rand() <= self.pFirstUpperCase:
+        elif rng.random() <= self.pFirstUpperCase:
             word = f"{word[0].translate(self.lower2upper).upper()}{word[1:]}"
 
         # add non-alphanumeric characters
-        if numpy.random.rand() <= self.pAddNonAlphanumeric:
-            rnd = numpy.random.rand()
+        if rng.random() <= self.pAddNonAlphanumeric:
+            rnd = rng.random()
             if rnd < 0.33:
-                nonAlphanumericChar = numpy.random.choice(self.atTheBeginning)
+                nonAlphanumericChar = rng.choice(self.atTheBeginning)
                 word = f"{nonAlphanumericChar}{word}"
             elif 0.33 <= rnd <= 0.66:
                 mid = len(word) // 2
-                nonAlphanumericChar = numpy.random.choice(self.atTheMiddle)
+                nonAlphanumericChar = rng.choice(self.atTheMiddle)
                 word = f"{word[:mid]}{nonAlphanumericChar}{word[mid:]}"
             else:
-                nonAlphanumericChar = numpy.random.choice(self.atTheEnd)
+                nonAlphanumericChar = rng.choice(self.atTheEnd)
                 word = f"{word}{nonAlphanumericChar}"
 
         return word
 
-    def _getNumber(self):
+    def _getNumber(self, rng: numpy.random.Generator):
         """
             get a number
+        :param rng: random generator
         :return: string of a number
         """
-        if numpy.random.rand() <= self.pLower10:
-            num = numpy.random.randint(low=0, high=10)
+        if rng.random() <= self.pLower10:
+            num = rng.integers(low=0, high=10)
         else:
-            num = numpy.random.randint(low=10, high=1e9)
+            num = rng.integers(low=10, high=10 ** 9)
         return str(num)
 
-    def _getWord(self):
+    def _getWord(self, rng: numpy.random.Generator):
         """
             get a word
+        :param rng: random generator
         :return:
         """
-        flag = True
-        while flag:
-            idx = numpy.random.randint(low=0, high=self.length)
-            word = self.words[idx]
-            if len(word) <= self.maxLength:
-                flag = False
-        return word
+        idx = self.candidates[rng.integers(low=0, high=len(self.candidates))]
+        return self.words[idx]
 
     def _readDataset(self):
         """
-            read datasets and produce set of words
+            read datasets and produce set of words. With a compiled corpus (args "corpus"), it is memory-mapped,
+            compiled from the datasets first if it does not exist or the datasets changed.
         :return:
         """
-        for dPath in self.datasets:
-            with open(dPath, 'r') as fp:
-                words = fp.readlines()
-                for w in words:
-                    w = w.strip()
-                    self.words.add(w)
-        self.length = len(self.words)
-        self.words = list(self.words)
+        corpusPath = self.args.get("corpus")
+        if corpusPath is not None:
+            self.words = loadCorpus(corpusPath, self.datasets)
+            self.length = len(self.words)
+            self.candidates = self.words.getCandidates(self.maxLength)
+        else:
+            self.words = readWords(self.datasets)
+            self.length = len(self.words)
+            lengths = numpy.fromiter((len(w) for w in self.words), dtype=numpy.int64, count=self.length)
+            self.candidates = getCandidates(*getLengthBuckets(lengths), self.maxLength)
+        assert len(self.candidates) > 0, f"No word of at most {self.maxLength} characters"
         return
@@ -1,9 +1,9 @@
-import os
-
 import numpy
 from PIL import Image
 import blend_modes
 
+from Texture.ImageCache import getImageCache, getImageSizeIndex, getPalette
+
 
 class Painter:
     """
@@ -13,15 +13,16 @@ class Painter:
     def __init__(self):
         return
 
-    def __call__(self, image: numpy.ndarray):
+    def __call__(self, image: numpy.ndarray, rng: numpy.random.Generator):
         """
             apply a random color to given image
         :param image: image
+        :param rng: random generator
         :return: painted image
         """
         alpha = image[..., 3]
         src = numpy.empty_like(image)
-        src[..., :] = self.getColor()
+        src[..., :] = self.getColor(rng)
         src = Image.fromarray(src)
         dst = Image.fromarray(image)
         out = Image.alpha_composite(dst, src)
@@ -30,14 +31,15 @@ class Painter:
         return out
 
     @staticmethod
-    def getColor():
+    def getColor(rng: numpy.random.Generator):
         """
          get random color
+        :param rng: random generator
         :return: color ( R, G, B)
         """
-        r = numpy.random.randint(low=0, high=255)
-        g = numpy.random.randint(low=0, high=255)
-        b = numpy.random.randint(low=0, high=255)
+        r = rng.integers(low=0, high=255)
+        g = rng.integers(low=0, high=255)
+        b = rng.integers(low=0, high=255)
         alpha = 255
         return numpy.array([r, g, b, alpha])
 
@@ -49,12 +51,14 @@ class TextureMixer:
         blend functions : https://en.wikipedia.org/w/index.php?title=Blend_modes&oldid=747749280#Difference
     """
 
-    def __init__(self, p: int, root: str, maxOpacity: float):
+    def __init__(self, p: int, root: str, maxOpacity: float, cacheBytes: int = 268435456, paletteSize: int = None):
         self.p = p
         self.root = root
         assert 0 <= maxOpacity <= 1
         self.maxOpacity = maxOpacity
-        self.imagePaths = None
+        self.sizeIndex = None
+        self.paletteSize = paletteSize
+        self.cache = getImageCache("texture", maxBytes=cacheBytes)
         self.blendFunctions = [
             blend_modes.addition,
             blend_modes.divide,
@@ -65,67 +69,71 @@ class TextureMixer:
         ]
         return
 
-    def __call__(self, image: numpy.ndarray):
-        if self.isRun():
+    def __call__(self, image: numpy.ndarray, rng: numpy.random.Generator, paletteSeed: tuple = None):
+        if self.isRun(rng):
             h, w, _ = image.shape
-            texture = self.getTextureImage(w=w, h=h)
+            texture = self.getTextureImage(w=w, h=h, rng=rng, paletteSeed=paletteSeed)
             # there is appropriate texture image
             if texture is not None:
-                image = self.blend(textImage=image, texture=texture)
+                image = self.blend(textImage=image, texture=texture, rng=rng)
         return image
 
-    def blend(self, textImage: numpy.ndarray, texture: numpy.ndarray):
+    def blend(self, textImage: numpy.ndarray, texture: numpy.ndarray, rng: numpy.random.Generator):
         """
             blend texture and text image
         :param textImage: text image
         :param texture: texture image
+        :param rng: random generator
         :return: blended image
         """
         alpha = textImage[..., 3]
-        blender = self.getBlendFunction()
-        opacity = self.getOpacity()
+        blender = self.getBlendFunction(rng)
+        opacity = self.getOpacity(rng)
         image = blender(texture.astype(float), textImage.astype(float), opacity)
         image[..., 3] = alpha
         return image.astype(numpy.uint8)
 
-    def getOpacity(self):
-        opacity = numpy.random.randint(low=0.6, high=int(self.maxOpacity * 100)) / 100
+    def getOpacity(self, rng: numpy.random.Generator):
+        # low was 0.6, which randint truncated to 0
+        opacity = rng.integers(low=0, high=int(self.maxOpacity * 100)) / 100
         return opacity
 
-    def getBlendFunction(self):
+    def getBlendFunction(self, rng: numpy.random.Generator):
         """
             select blend functions
+        :param rng: random generator
         :return: blend function
         """
-        return numpy.random.choice(self.blendFunctions)
+        return self.blendFunctions[rng.integers(low=0, high=len(self.blendFunctions))]
 
-    def getTextureImage(self, w: int, h: int):
+    def getTextureImage(self, w: int, h: int, rng: numpy.random.Generator, paletteSeed: tuple = None):
         """
             produce texture image for text image
         :param w: width of text image
         :param h: height of text image
+        :param rng: random generator
+        :param paletteSeed: textures are drawn from the palette of this seed (None: from all textures)
         :return: image of texture
         """
-        # if texture is None, there isn't any appropriate w and h
-        texture = None
-        counter = 0
-        while texture is None:
-            path = self.getImagePath()
-            texture = numpy.array(Image.open(path).convert("RGBA"))
-            texture = self.getTextureCrop(texture=texture, w=w, h=h)
-            counter += 1
-            if counter > 10:
-                texture
-                break
-        return texture
+        # only textures larger than the text image are candidates, None if there isn't any
+        paths = []
+        if paletteSeed is not None:
+            paths = getPalette(self.root, 1, paletteSeed, self.paletteSize).getPaths(w=w, h=h)
+        if len(paths) == 0:
+            paths = self.getSizeIndex().getPaths(w=w, h=h)
+        if len(paths) == 0:
+            return None
+        texture = self.cache.sample(paths, rng)
+        return self.getTextureCrop(texture=texture, w=w, h=h, rng=rng)
 
     @staticmethod
-    def getTextureCrop(texture: numpy.ndarray, w: int, h: int):
+    def getTextureCrop(texture: numpy.ndarray, w: int, h: int, rng: numpy.random.Generator):
         """
             crop the texture image
         :param texture: texture image
         :param w: width of image
         :param h: height of image
+        :param rng: random generator
         :return: crop of texture
         """
         hTexture, wTexture, _ = texture.shape
@@ -134,28 +142,21 @@ class TextureMixer:
 
         rangeH = hTexture - h
         rangeW = wTexture - w
-        x = numpy.random.randint(low=0, high=rangeW)
-        y = numpy.random.randint(low=0, high=rangeH)
+        x = rng.integers(low=0, high=rangeW)
+        y = rng.integers(low=0, high=rangeH)
         return texture[y:y + h, x:x + w, ...]
 
-    def getImagePath(self):
+    def getSizeIndex(self):
         """
-            select randomly an image path for given dataset
-        :return: path
+            size index of texture images
+        :return: ImageSizeIndex
         """
-        if self.imagePaths is None:
-            imagePaths = []
-            dirs = os.listdir(self.root)
-            for dirName in dirs:
-                path = os.path.join(self.root, dirName)
-                imagePaths += [os.path.join(path, p) for p in os.listdir(path)]
-            self.imagePaths = imagePaths
-
-        path = numpy.random.choice(self.imagePaths)
-        return path
-
-    def isRun(self):
-        rand = numpy.random.rand()
+        if self.sizeIndex is None:
+            self.sizeIndex = getImageSizeIndex(self.root, depth=1)
+        return self.sizeIndex
+
+    def isRun(self, rng: numpy.random.Generator):
+        rand = rng.random()
         if rand <= self.p:
             return True
         else:
@@ -1,4 +1,6 @@
+import io
 import os
+from collections import OrderedDict
 from typing import List
 
 import numpy
@@ -8,18 +10,52 @@ from PIL import ImageFont
 class Font:
     def __init__(self, args: dict):
         # self.fonts = args["fonts"]
-        self.fonts = [os.path.join(args["fonts"], l)for l in os.listdir(args["fonts"])]
+        self.fonts = [os.path.join(args["fonts"], l)for l in sorted(os.listdir(args["fonts"]))]
         print(self.fonts)
         self.minSize = args["minSize"]
         self.maxSize = args["maxSize"]
+
+        # font files are read once, forked workers share the bytes and the pooled fonts
+        self.fontBytes = []
+        for path in self.fonts:
+            with open(path, 'rb') as f:
+                self.fontBytes.append(f.read())
+
+        # (font index, size) -> FreeTypeFont, least recently used fonts are dropped after poolSize
+        self.poolSize = args.get("poolSize")
+        self.pool = OrderedDict()
+        if args.get("preload", False):
+            for idx in range(len(self.fonts)):
+                for size in range(self.minSize, self.maxSize):
+                    self.getFont(idx, size)
         return
 
-    def getRandomFont(self):
-        path = numpy.random.choice(self.fonts)
-        size = self.getSize()
-        font = ImageFont.truetype(path, size=size)
+    def getRandomFont(self, rng: numpy.random.Generator):
+        idx = int(rng.integers(low=0, high=len(self.fonts)))
+        size = self.getSize(rng)
+        font = self.getFont(idx, size)
+        return font
+
+    def getFont(self, idx: int, size: int):
+        """
+            get pooled font
+        :param idx: index of font file
+        :param size: font size
+        :return: FreeTypeFont
+        """
+        key = (idx, size)
+        font = self.pool.get(key)
+        if font is None:
+            font = ImageFont.truetype(io.BytesIO(self.fontBytes[idx]), size=size)
+            # keep the file path, glyph cache keys and font_variant rely on it
+            font.path = self.fonts[idx]
+            self.pool[key] = font
+            if self.poolSize is not None and len(self.pool) > self.poolSize:
+                self.pool.popitem(last=False)
+        else:
+            self.pool.move_to_end(key)
         return font
 
-    def getSize(self):
-        size = numpy.random.randint(low=self.minSize, high=self.maxSize)
+    def getSize(self, rng: numpy.random.Generator):
+        size = int(rng.integers(low=self.minSize, high=self.maxSize))
         return size
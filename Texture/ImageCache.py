@@ -0,0 +1,200 @@
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy
+from PIL import Image
+
+from utils import listImagePaths
+
+
+class ImageCache:
+    """
+        Byte-budgeted LRU cache of decoded RGBA images.
+        Cached images are read-only, crops taken from them are views.
+        Which image is used never depends on the cache content, so cached runs are reproducible. Reuse comes from
+        palettes (see getPalette): consecutive words draw their images from the same small random subset.
+    """
+
+    def __init__(self, maxBytes: int, maxSide: int = None):
+        """
+        :param maxBytes: memory limit of decoded images
+        :param maxSide: images are downscaled on decode so that their longer side is at most maxSide (None: keep)
+        """
+        self.maxBytes = maxBytes
+        self.maxSide = maxSide
+        self.images = OrderedDict()
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return
+
+    def get(self, path: str):
+        """
+            returns decoded image of path
+        :param path: image path
+        :return: RGBA image
+        """
+        image = self.images.get(path)
+        if image is None:
+            self.misses += 1
+            image = self.decode(path)
+            self.put(path, image)
+        else:
+            self.hits += 1
+            self.images.move_to_end(path)
+        return image
+
+    def sample(self, paths, rng: numpy.random.Generator):
+        """
+            returns decoded image of a random path
+        :param paths: image paths
+        :param rng: random generator
+        :return: RGBA image
+        """
+        return self.get(paths[rng.integers(low=0, high=len(paths))])
+
+    def put(self, path: str, image: numpy.ndarray):
+        if path in self.images:
+            self.evict(path)
+        image.setflags(write=False)
+        self.images[path] = image
+        self.nbytes += image.nbytes
+        while self.nbytes > self.maxBytes and len(self.images) > 1:
+            self.evict(next(iter(self.images)))
+        return
+
+    def evict(self, path: str):
+        image = self.images.pop(path)
+        self.nbytes -= image.nbytes
+        self.evictions += 1
+        return
+
+    def decode(self, path: str):
+        image = Image.open(path)
+        if self.maxSide is not None and max(image.size) > self.maxSide:
+            # let the JPEG decoder skip resolution it does not need
+            image.draft("RGB", (self.maxSide, self.maxSide))
+            image.thumbnail((self.maxSide, self.maxSide))
+        return numpy.array(image.convert("RGBA"))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"images": len(self.images),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": self.hits / total if total > 0 else 0.0}
+
+
+# process wide caches by name (image caches, and remap caches of Augmentations.Geometry)
+CACHES = {}
+
+
+def getImageCache(name: str, maxBytes: int, maxSide: int = None):
+    """
+        returns the process wide cache of given name, so short-lived users share decoded images
+    """
+    cache = CACHES.get(name)
+    if cache is None:
+        cache = CACHES[name] = ImageCache(maxBytes=maxBytes, maxSide=maxSide)
+    return cache
+
+
+def getCacheStats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+def mergeCacheStats(stats: list):
+    """
+        merge getCacheStats() of several processes, counters are summed
+    """
+    merged = {}
+    for processStats in stats:
+        for name, s in processStats.items():
+            m = merged.setdefault(name, {})
+            for k, v in s.items():
+                if k != "hitRate":
+                    m[k] = m.get(k, 0) + v
+    for m in merged.values():
+        total = m["hits"] + m["misses"]
+        m["hitRate"] = m["hits"] / total if total > 0 else 0.0
+    return merged
+
+
+class ImageSizeIndex:
+    """
+        Image paths indexed by their width and height, read from file headers without decoding.
+    """
+
+    def __init__(self, paths, widths=None, heights=None):
+        """
+        :param paths: image paths
+        :param widths: image widths, read from the files if None
+        :param heights: image heights, read from the files if None
+        """
+        if widths is None or heights is None:
+            widths = []
+            heights = []
+            for path in paths:
+                with Image.open(path) as image:
+                    w, h = image.size
+                widths.append(w)
+                heights.append(h)
+
+        # sorted by width, images wider than w are a suffix
+        order = numpy.argsort(widths, kind="stable")
+        self.paths = numpy.array(paths, dtype=object)[order]
+        self.widths = numpy.array(widths)[order]
+        self.heights = numpy.array(heights)[order]
+        return
+
+    def getPaths(self, w: int, h: int):
+        """
+            paths of images strictly larger than (w, h)
+        :param w: width
+        :param h: height
+        :return: array of paths
+        """
+        start = numpy.searchsorted(self.widths, w, side="right")
+        return self.paths[start:][self.heights[start:] > h]
+
+    def subset(self, positions):
+        """
+            index of some images of this index
+        :param positions: positions of the images in this index
+        :return: ImageSizeIndex
+        """
+        positions = numpy.sort(positions)
+        return ImageSizeIndex(self.paths[positions], self.widths[positions], self.heights[positions])
+
+    def __len__(self):
+        return len(self.paths)
+
+
+@lru_cache(maxsize=None)
+def getImageSizeIndex(root: str, depth: int = 0):
+    """
+        returns the process wide size index of the images under root
+    """
+    return ImageSizeIndex(listImagePaths(root, depth=depth))
+
+
+@lru_cache(maxsize=64)
+def getPalette(root: str, depth: int, paletteSeed: tuple, size: int):
+    """
+        returns the size index of a random subset of the images under root, the same seed gives the same subset.
+        Words sharing a palette reuse a few decoded images instead of decoding a new one per crop.
+    :param root: image folder
+    :param depth: number of sub folder levels
+    :param paletteSeed: seed of the subset, e.g. (run seed, word index // palette block)
+    :param size: number of images (None: all images)
+    :return: ImageSizeIndex
+    """
+    index = getImageSizeIndex(root, depth=depth)
+    if size is None or size >= len(index):
+        return index
+    rng = numpy.random.default_rng(list(paletteSeed))
+    return index.subset(rng.choice(len(index), size=size, replace=False))
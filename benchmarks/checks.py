@@ -0,0 +1,146 @@
+"""
+    Assertion checks of the outputs on synthetic fixtures, a failed check raises (non-zero exit code):
+        determinism: a serial run, a parallel run and a run resumed from a checkpoint write the same LMDB records
+        raw shards: samples read back from raw shards (every available compression) are the written pixels
+        tar shards: members read back from tar shards are the written images, labels and character boxes
+
+    python -m benchmarks.checks --output checks.json
+"""
+import copy
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import lmdb
+
+import main
+from benchmarks.fixtures import buildFixtures, getParser, saveResults
+from benchmarks.shards import CODECS, isAvailable
+from benchmarks.tarshards import getWords
+from shards import RawShardReader, iterTarShards
+from utils import ImageWriter, ImageEncoder
+
+
+def getDigest(root: str):
+    """
+        number of records and sha1 of the keys and values of the LMDB output of a run
+    """
+    env = lmdb.open(os.path.join(root, "SyntheticTurkishStyleText"), readonly=True, lock=False)
+    digest, count = hashlib.sha1(), 0
+    with env.begin() as txn:
+        for key, value in txn.cursor():
+            digest.update(key)
+            digest.update(value)
+            count += 1
+    env.close()
+    return count, digest.hexdigest()
+
+
+def runWords(cfg, root: str, numWords: int, workers: int):
+    """
+        generate the first numWords words of a run into root with main.main, resuming from its checkpoint
+    :return: LMDB digest (see getDigest)
+    """
+    cfg = copy.deepcopy(cfg)
+    cfg[0].update({"root": root, "numUniqueText": numWords, "resume": True, "isLMDB": True})
+    cfg[0]["tar"] = dict(cfg[0]["tar"], enabled=False)
+    main.main(cfg, workers=workers)
+    return getDigest(root)
+
+
+def checkDeterminism(cfg, root: str, numWords: int, workers: int):
+    """
+        serial, parallel and resumed runs write the same records
+    """
+    serial = runWords(cfg, os.path.join(root, "serial"), numWords, workers=1)
+    parallel = runWords(cfg, os.path.join(root, "parallel"), numWords, workers=workers)
+    # half of the words serially, then resumed from the checkpoint in parallel
+    runWords(cfg, os.path.join(root, "resumed"), numWords // 2, workers=1)
+    resumed = runWords(cfg, os.path.join(root, "resumed"), numWords, workers=workers)
+    assert serial[0] > 0, "The serial run wrote no record!"
+    assert parallel == serial, f"Parallel run differs from the serial run: {parallel} != {serial}"
+    assert resumed == serial, f"Resumed run differs from the serial run: {resumed} != {serial}"
+    return {"records": serial[0], "sha1": serial[1]}
+
+
+def checkRawShards(cfg, root: str, numSamples: int, seed: int, height: int = 32):
+    """
+        raw shards of every available compression give back the written samples, labels and keys
+    """
+    words = getWords(cfg, numSamples, seed, {"format": "raw", "height": height})
+    expected = [(index, i, text, sample) for index, text, samples, _ in words for i, sample in enumerate(samples)]
+    results = {}
+    for codec in filter(isAvailable, CODECS):
+        path = os.path.join(root, f"raw-{codec}")
+        # small shards and chunks, samples are read across several of them
+        writer = ImageWriter(root=path, isLMDB=True, encoder=ImageEncoder({"format": "raw", "height": height}),
+                             rawArgs={"compression": codec, "shardBytes": 2 ** 20, "chunkBytes": 2 ** 16})
+        for index, text, samples, _ in words:
+            writer.writeEncodedSamples(text, samples, index)
+        writer.close()
+
+        reader = RawShardReader(os.path.join(path, "raw"))
+        assert len(reader) == len(expected), f"raw-{codec}: {len(reader)} samples read, {len(expected)} written"
+        for j, (index, i, text, sample) in enumerate(expected):
+            label, image = reader[j]
+            assert reader.getKey(j) == (index, i), f"raw-{codec}: sample {j} is {reader.getKey(j)}, not {(index, i)}"
+            assert label == text, f"raw-{codec}: label of sample {j} is '{label}', not '{text}'"
+            assert image.tobytes() == sample, f"raw-{codec}: pixels of sample {j} differ"
+        results[codec] = {"samples": len(reader), "shards": len(reader.data)}
+    return results
+
+
+def checkTarShards(cfg, root: str, numSamples: int, seed: int, threads: int = 4):
+    """
+        tar shards written by several threads give back every written member once
+    """
+    words = getWords(cfg, numSamples, seed)
+    expected = {}
+    for index, text, samples, bboxes in words:
+        for i, sample in enumerate(samples):
+            expected[f"{index:09d}_{i}"] = (sample, text, [[int(v) for v in box] for box in bboxes[i]])
+
+    writer = ImageWriter(root=root, isLMDB=True, encoder=ImageEncoder({"format": "jpg"}),
+                         tarArgs={"enabled": True, "maxRecords": 50, "threads": threads})
+    for index, text, samples, bboxes in words:
+        writer.writeEncodedSamples(text, samples, index, bboxes=bboxes)
+    writer.close()
+
+    count = 0
+    for key, sample in iterTarShards(os.path.join(root, "tar")):
+        assert key in expected, f"tar: unexpected or repeated sample {key}"
+        image, text, boxes = expected.pop(key)
+        assert bytes(sample[".jpg"]) == image, f"tar: image of {key} differs"
+        assert bytes(sample[".txt"]).decode("utf-8") == text, f"tar: label of {key} differs"
+        assert json.loads(bytes(sample[".json"])) == boxes, f"tar: boxes of {key} differ"
+        count += 1
+    assert len(expected) == 0, f"tar: {len(expected)} samples were not read back, e.g. {next(iter(expected))}"
+    return {"samples": count}
+
+
+if __name__ == '__main__':
+    parser = getParser(__doc__)
+    parser.add_argument("--output-root", default=None, help="folder of the written outputs (default: a temporary "
+                                                            "folder, removed afterwards)")
+    parser.add_argument("--words", type=int, default=12, help="words of the determinism runs")
+    parser.add_argument("--workers", type=int, default=3, help="workers of the parallel runs")
+    parser.add_argument("--samples", type=int, default=400, help="samples of the shard round-trips")
+    opt = parser.parse_args()
+
+    cfg = buildFixtures(opt.fixtures, seed=opt.seed)
+    cfg[0]["seed"] = opt.seed
+    root = opt.output_root if opt.output_root is not None else tempfile.mkdtemp(prefix="sts_checks")
+    try:
+        results = {"determinism": checkDeterminism(cfg, os.path.join(root, "runs"), opt.words, opt.workers)}
+        print(f"determinism: {results['determinism']}")
+        results["rawShards"] = checkRawShards(cfg, os.path.join(root, "raw"), opt.samples, opt.seed)
+        print(f"raw shards: {results['rawShards']}")
+        results["tarShards"] = checkTarShards(cfg, os.path.join(root, "tar"), opt.samples, opt.seed)
+        print(f"tar shards: {results['tarShards']}")
+    finally:
+        if opt.output_root is None:
+            shutil.rmtree(root, ignore_errors=True)
+    saveResults(results, opt.output)
+    print("OK")
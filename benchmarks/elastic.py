@@ -0,0 +1,112 @@
+"""
+    Statistical check of the displacement-field bank (Augmentations/Elastic.py) against imgaug's live
+    ElasticTransformation, for the elastic layers of configs/charAugmentations.yaml. For every layer, fields are drawn
+    with both paths at character crop sizes and the distributions of their RMS displacement, maximum displacement and
+    lag-1 autocorrelation (smoothness) are compared with a two-sample Kolmogorov-Smirnov test. The time per augmented
+    crop is reported for both paths.
+
+    python -m benchmarks.elastic --fields 2000 --output elastic.json
+"""
+import os
+import sys
+import time
+
+import imgaug.random as iarandom
+import numpy
+from imgaug.augmenters.geometric import ElasticTransformation
+from scipy.stats import ks_2samp
+
+from Augmentations.Elastic import BankElasticTransformation
+from benchmarks.fixtures import REPO, getParser, saveResults
+from utils import readYAML
+
+SHAPES = [(40, 24), (48, 36), (64, 40), (96, 64)]
+
+
+def getMetrics(dx: numpy.ndarray, dy: numpy.ndarray):
+    """
+        RMS and maximum displacement, lag-1 autocorrelation of dx along x
+    """
+    magnitude = numpy.hypot(dx, dy)
+    a, b = dx[:, :-1].ravel(), dx[:, 1:].ravel()
+    correlation = numpy.corrcoef(a, b)[0, 1] if a.std() > 0 and b.std() > 0 else 1.0
+    return float(numpy.sqrt((magnitude ** 2).mean())), float(magnitude.max()), float(correlation)
+
+
+def liveField(args: dict, shape: tuple, randomState):
+    alpha = randomState.uniform(args["min_alpha"], args["max_alpha"])
+    sigma = randomState.uniform(args["min_sigma"], args["max_sigma"])
+    dx, dy = ElasticTransformation._generate_shift_maps(shape, alpha=alpha, sigma=sigma, random_state=randomState)
+    return dx, dy
+
+
+def bankField(aug: BankElasticTransformation, shape: tuple, randomState):
+    alpha = randomState.uniform(*aug.alpha)
+    sigma = randomState.uniform(*aug.sigma)
+    dx, dy = aug.bank.getField(shape[0], shape[1], sigma, randomState)
+    return alpha * dx, alpha * dy
+
+
+def timePerCrop(aug, crops: list):
+    t = time.perf_counter()
+    for crop in crops:
+        aug(image=crop)
+    return (time.perf_counter() - t) / len(crops)
+
+
+def check(args: dict, numFields: int, seed: int):
+    bank = args.get("bank", {})
+    aug = BankElasticTransformation(alpha=(args["min_alpha"], args["max_alpha"]),
+                                    sigma=(args["min_sigma"], args["max_sigma"]), mode=args["mode"], **bank)
+    live = ElasticTransformation(alpha=(args["min_alpha"], args["max_alpha"]),
+                                 sigma=(args["min_sigma"], args["max_sigma"]), mode=args["mode"])
+
+    liveState = iarandom.RNG(seed)
+    bankState = iarandom.RNG(seed + 1)
+    liveMetrics, bankMetrics = [], []
+    for i in range(numFields):
+        shape = SHAPES[i % len(SHAPES)]
+        liveMetrics.append(getMetrics(*liveField(args, shape, liveState)))
+        bankMetrics.append(getMetrics(*bankField(aug, shape, bankState)))
+    liveMetrics, bankMetrics = numpy.array(liveMetrics), numpy.array(bankMetrics)
+
+    result = {"bank": aug.bank.stats()}
+    for k, name in enumerate(["rms", "max", "correlation"]):
+        ks = ks_2samp(liveMetrics[:, k], bankMetrics[:, k])
+        result[name] = {"liveMean": float(liveMetrics[:, k].mean()), "bankMean": float(bankMetrics[:, k].mean()),
+                        "ks": float(ks.statistic), "pValue": float(ks.pvalue)}
+
+    rng = numpy.random.default_rng(seed)
+    crops = [rng.integers(0, 256, (*SHAPES[i % len(SHAPES)], 4), dtype=numpy.uint8) for i in range(200)]
+    live.seed_(seed)
+    aug.seed_(seed)
+    result["liveSeconds"] = timePerCrop(live, crops)
+    result["bankSeconds"] = timePerCrop(aug, crops)
+    return result
+
+
+if __name__ == '__main__':
+    parser = getParser(__doc__, fixtures=False)
+    parser.add_argument("--config", default=os.path.join(REPO, "configs", "charAugmentations.yaml"))
+    parser.add_argument("--fields", type=int, default=2000, help="fields drawn per path and layer")
+    parser.add_argument("--threshold", type=float, default=0.1, help="maximum KS statistic")
+    opt = parser.parse_args()
+
+    results = {}
+    failed = False
+    print(f"{'layer':<25}{'metric':<13}{'live mean':>11}{'bank mean':>11}{'KS':>8}{'p':>9}")
+    for name, args in readYAML(opt.config)["geometricAugmentations"].items():
+        if "ElasticTransformation" not in name:
+            continue
+        r = results[name] = check(args, opt.fields, opt.seed)
+        for metric in ["rms", "max", "correlation"]:
+            m = r[metric]
+            failed |= m["ks"] > opt.threshold
+            print(f"{name:<25}{metric:<13}{m['liveMean']:>11.4f}{m['bankMean']:>11.4f}{m['ks']:>8.3f}"
+                  f"{m['pValue']:>9.3f}")
+        print(f"{name:<25}{'ms/crop':<13}{1000 * r['liveSeconds']:>11.4f}{1000 * r['bankSeconds']:>11.4f}"
+              f"   bank {r['bank']['bytes'] / 2 ** 20:.1f} MB")
+
+    saveResults(results, opt.output)
+    print("FAILED" if failed else "OK", f"(KS threshold {opt.threshold})")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+
+import numpy
+from PIL import Image
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+from utils import readYAML
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOWER = "abcçdefgğhıijklmnoöpqrsştuüvwxyz"
+UPPER = "ABCÇDEFGĞHIİJKLMNOÖPQRSŞTUÜVWXYZ"
+CHARSET = LOWER + UPPER + "0123456789" + "()-%$#[]*{}!?_&"
+
+
+def buildFont(path: str, seed: int):
+    """
+        build a TrueType font whose glyphs are random bar patterns, one distinct glyph per character of CHARSET
+    :param path: output .ttf path
+    :param seed: random seed of the glyph shapes
+    """
+    rng = numpy.random.default_rng(seed)
+    unitsPerEm, ascent, descent = 1000, 800, 200
+
+    glyphOrder = [".notdef", "space"] + [f"uni{ord(c):04X}" for c in CHARSET]
+    cmap = {ord(" "): "space"}
+    glyphs = {".notdef": TTGlyphPen(None).glyph(), "space": TTGlyphPen(None).glyph()}
+    metrics = {".notdef": (500, 0), "space": (300, 0)}
+    for c in CHARSET:
+        name = f"uni{ord(c):04X}"
+        width = int(rng.integers(350, 750))
+        height = 700 if c in UPPER or c.isdigit() else int(rng.integers(450, 700))
+        pen = TTGlyphPen(None)
+        numBars = int(rng.integers(2, 5))
+        for x0 in numpy.linspace(50, width - 100, numBars).astype(int):
+            top = int(rng.integers(height // 2, height + 1))
+            bottom = -150 if rng.random() < 0.1 else 0
+            pen.moveTo((x0, bottom))
+            pen.lineTo((x0, top))
+            pen.lineTo((x0 + 60, top))
+            pen.lineTo((x0 + 60, bottom))
+            pen.closePath()
+        glyphs[name] = pen.glyph()
+        metrics[name] = (width, 0)
+        cmap[ord(c)] = name
+
+    fb = FontBuilder(unitsPerEm, isTTF=True)
+    fb.setupGlyphOrder(glyphOrder)
+    fb.setupCharacterMap(cmap)
+    fb.setupGlyf(glyphs)
+    fb.setupHorizontalMetrics(metrics)
+    fb.setupHorizontalHeader(ascent=ascent, descent=-descent)
+    fb.setupNameTable({"familyName": f"Fixture{seed}", "styleName": "Regular"})
+    fb.setupOS2(sTypoAscender=ascent, sTypoDescender=-descent, usWinAscent=ascent, usWinDescent=descent)
+    fb.setupPost()
+    fb.save(path)
+    return
+
+
+def buildImages(folder: str, n: int, minSize: int, maxSize: int, seed: int):
+    """
+        write n random JPEG images (smooth color gradients with noise)
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = numpy.random.default_rng(seed)
+    for i in range(n):
+        w, h = rng.integers(minSize, maxSize, size=2)
+        y, x = numpy.mgrid[0:h, 0:w]
+        image = numpy.empty((h, w, 3))
+        for c in range(3):
+            fx, fy, phase = rng.random(3) * [0.05, 0.05, 6.28]
+            image[..., c] = 127 + 100 * numpy.sin(fx * x + fy * y + phase)
+        image += rng.normal(0, 20, size=image.shape)
+        image = numpy.clip(image, 0, 255).astype(numpy.uint8)
+        Image.fromarray(image).save(os.path.join(folder, f"{i:04d}.jpg"), quality=90)
+    return
+
+
+def buildCorpus(path: str, n: int, seed: int):
+    rng = numpy.random.default_rng(seed)
+    words = set()
+    while len(words) < n:
+        length = int(rng.integers(2, 14))
+        words.add("".join(rng.choice(list(LOWER), size=length)))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(sorted(words)) + "\n")
+    return
+
+
+def buildFixtures(root: str, seed: int = 0, numFonts: int = 3, numBackgrounds: int = 24, numTextures: int = 24):
+    """
+        build fonts, corpus, background and texture images under root (skipped if they exist) and return the repo
+        configs pointing at them
+    :param root: fixture folder
+    :return: (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer)
+    """
+    fonts = os.path.join(root, "fonts")
+    text = os.path.join(root, "text", "words.txt")
+    backgrounds = os.path.join(root, "background", "val2017")
+    textures = os.path.join(root, "textures", "dtd", "images")
+
+    if not os.path.exists(os.path.join(root, ".done")):
+        os.makedirs(fonts, exist_ok=True)
+        os.makedirs(os.path.dirname(text), exist_ok=True)
+        for i in range(numFonts):
+            buildFont(os.path.join(fonts, f"fixture{i}.ttf"), seed=seed + i)
+        buildCorpus(text, n=2000, seed=seed)
+        buildImages(backgrounds, n=numBackgrounds, minSize=400, maxSize=640, seed=seed)
+        for i, category in enumerate(["banded", "dotted", "woven"]):
+            buildImages(os.path.join(textures, category), n=numTextures // 3, minSize=300, maxSize=640,
+                        seed=seed + 100 + i)
+        open(os.path.join(root, ".done"), 'w').close()
+
+    cfg = [readYAML(os.path.join(REPO, "configs", f"{name}.yaml"))
+           for name in ["base", "charAugmentations", "textAugmentations", "background", "textProducer"]]
+    (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer) = cfg
+    cfg_Base["root"] = os.path.join(root, "output")
+    cfg_Base["FONT"]["fonts"] = fonts
+    cfg_TextAugmentations["Texture"]["TextureMixer"]["root"] = textures
+    cfg_Background["BackgroundTexture"]["root"] = backgrounds
+    cfg_TextProducer["datasets"] = [text]
+    cfg_TextProducer["corpus"] = os.path.join(root, "corpus.bin")
+    return cfg
+
+
+def getParser(description: str = None, fixtures: bool = True, seed: bool = True):
+    """
+        argument parser of a benchmark with the shared options: --output (JSON results path), --fixtures (fixture
+        folder) and --seed
+    :param description: usage shown by --help (the module docstring)
+    :param fixtures: add --fixtures
+    :param seed: add --seed
+    """
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    if fixtures:
+        parser.add_argument("--fixtures", default="./benchmarks/fixtures_data", help="fixture folder, built if missing")
+    if seed:
+        parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON results path")
+    return parser
+
+
+def saveResults(results: dict, path: str = None):
+    """
+        write the results of a benchmark as JSON, nothing is written if path is None
+    """
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+    return
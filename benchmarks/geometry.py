@@ -0,0 +1,149 @@
+"""
+    Benchmark of the OpenCV arc and affine projection distortions (Augmentations/Geometry.py) against the Wand
+    (ImageMagick) path they replace. Geometry is compared with the output size and the IoU of the alpha masks.
+    Wand is an optional dependency of the benchmark (pip install Wand), without it only the OpenCV timings are
+    reported. Arcs are also timed with a warm map cache (RemapCache), the single remap the WrapText augmentation costs
+    on a hit. The layout chain (arc, affine, perspective) is timed applied step by step and fused into a single remap
+    (renderTransforms), without and with a warm cache of the maps of the fused chain.
+
+    python -m benchmarks.geometry --output geometry.json
+"""
+import time
+
+import numpy
+
+from Augmentations.Augmentations import WrapText, AffineTransform, Transformation3D
+from Augmentations.Geometry import arcDistort, affineProjection, renderTransforms, RemapCache
+from Components.CharImage import CharImage
+from Components.TextImage import TextImage
+from Texture import Font, Painter
+from benchmarks.fixtures import buildFixtures, getParser, saveResults
+
+try:
+    from wand.image import Image as WImage
+except ImportError:
+    WImage = None
+
+
+def wandDistort(image: numpy.ndarray, method: str, args):
+    """
+        the previous implementation of WrapText / AffineTransform
+    """
+    with WImage.from_array(numpy.array(image)) as wImage:
+        wImage.virtual_pixel = 'transparent'
+        wImage.distort(method, args)
+        return numpy.array(wImage)
+
+
+def median(fn, repeat: int):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return float(numpy.median(times))
+
+
+def alphaIoU(a: numpy.ndarray, b: numpy.ndarray):
+    """
+        IoU of the opaque (alpha > 127) pixels, images are compared on their common top-left area
+    """
+    h, w = min(a.shape[0], b.shape[0]), min(a.shape[1], b.shape[1])
+    maskA = a[:h, :w, 3] > 127
+    maskB = b[:h, :w, 3] > 127
+    union = (maskA | maskB).sum()
+    return float((maskA & maskB).sum() / union) if union > 0 else 1.0
+
+
+def getWordImages(cfg, texts):
+    (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer) = cfg
+    font = Font(cfg_Base["FONT"]).getFont(0, 40)
+    rng = numpy.random.default_rng(0)
+    images = []
+    for text in texts:
+        chars = [CharImage(text=c, font=font, color=(0, 0, 0, 255)) for c in text]
+        image, _ = TextImage(chars).getWordImage()
+        images.append(Painter()(image, rng))
+    return images
+
+
+CASES = {
+    "arc/5,0": ("arc", (5, 0)),
+    "arc/25,5": ("arc", (25, 5)),
+    "arc/90,10": ("arc", (90, 10)),
+    "arc/160,20": ("arc", (160, 20)),
+    "affine/rotate": ("affine_projection", (1, 0.08, -0.06, 1, 0, 0)),
+    "affine/translate": ("affine_projection", (1, 0, 0, 1, 4, -3)),
+    "affine/both": ("affine_projection", (1, -0.1, 0.05, 1, -5, 2)),
+}
+
+
+if __name__ == '__main__':
+    parser = getParser(__doc__, seed=False)
+    parser.add_argument("--repeat", type=int, default=50)
+    opt = parser.parse_args()
+
+    cfg = buildFixtures(opt.fixtures)
+    images = getWordImages(cfg, ["ab", "benchmark", "çığöşüÇİĞÖŞÜ12345"])
+    if WImage is None:
+        print("Wand is not installed, only OpenCV timings are reported.")
+
+    cache = RemapCache(maxBytes=64 * 2 ** 20)
+    results = {}
+    print(f"{'case':<20}{'size':>12}{'opencv ms':>12}{'cached ms':>11}{'wand ms':>10}{'speedup':>10}"
+          f"{'alpha IoU':>11}{'same size':>11}")
+    for name, (method, args) in CASES.items():
+        for image in images:
+            h, w = image.shape[:2]
+            if method == "arc":
+                fn = lambda: arcDistort(image, *args)
+            else:
+                fn = lambda: affineProjection(image, args)
+            r = {"opencvSeconds": median(fn, opt.repeat)}
+            if method == "arc":
+                r["cachedSeconds"] = median(lambda: arcDistort(image, *args, cache=cache, quantize=4), opt.repeat)
+            if WImage is not None:
+                reference = wandDistort(image, method, args)
+                output = fn()
+                r["wandSeconds"] = median(lambda: wandDistort(image, method, args), opt.repeat)
+                r["speedup"] = r["wandSeconds"] / r["opencvSeconds"]
+                r["alphaIoU"] = alphaIoU(output, reference)
+                r["sameSize"] = output.shape == reference.shape
+            results[f"{name}/{w}x{h}"] = r
+            print(f"{name:<20}{f'{w}x{h}':>12}{1000 * r['opencvSeconds']:>12.3f}"
+                  f"{1000 * r.get('cachedSeconds', numpy.nan):>11.3f}"
+                  f"{1000 * r.get('wandSeconds', numpy.nan):>10.3f}{r.get('speedup', numpy.nan):>10.1f}"
+                  f"{r.get('alphaIoU', numpy.nan):>11.3f}{str(r.get('sameSize', '-')):>11}")
+
+    layouts = {"layout": [WrapText(1, [5, 25], [0, 5]), AffineTransform(1, 10, 5), Transformation3D(1, 45, 45, 1)],
+               # warm chain map cache, the maps of the whole fused chain are reused
+               "layout cached": [WrapText(1, [5, 25], [0, 5], cacheBytes=64 * 2 ** 20, quantize=4,
+                                          chainCacheBytes=64 * 2 ** 20),
+                                 AffineTransform(1, 10, 5), Transformation3D(1, 45, 45, 1)]}
+    print(f"{'layout chain':<20}{'size':>12}{'steps ms':>12}{'fused ms':>11}{'alpha IoU':>11}")
+    for name, layout in layouts.items():
+        for image in images:
+            h, w = image.shape[:2]
+            rng = numpy.random.default_rng(0)
+            transforms = []
+            for aug in layout:
+                transform = aug.getTransform(*(transforms[-1].size if transforms else (w, h)), rng)
+                transforms.append(transform)
+
+            def steps():
+                output = image
+                for transform in transforms:
+                    output = transform.render(output)
+                return output
+
+            r = results[f"{name}/{w}x{h}"] = {"stepsSeconds": median(steps, opt.repeat),
+                                              "fusedSeconds": median(lambda: renderTransforms(image, transforms),
+                                                                     opt.repeat),
+                                              "alphaIoU": alphaIoU(steps(), renderTransforms(image, transforms))}
+            print(f"{name:<20}{f'{w}x{h}':>12}{1000 * r['stepsSeconds']:>12.3f}{1000 * r['fusedSeconds']:>11.3f}"
+                  f"{r['alphaIoU']:>11.3f}")
+
+    results["arcMaps"] = cache.stats()
+    print(f"arc map cache: {results['arcMaps']}")
+
+    saveResults(results, opt.output)
@@ -0,0 +1,109 @@
+"""
+    Memory benchmark of the sample fan-out of TextImage: peak traced memory and allocated bytes per word, for
+    getSamples, iterSamples (samples consumed one by one) and a reference fan-out which deep copies every parent as
+    getSamples used to do.
+
+    python -m benchmarks.memory --words 50 --output memory.json
+"""
+import copy
+import time
+import tracemalloc
+
+import numpy
+
+from Components.CharImage import CharImage
+from Components.GlyphAtlas import GlyphAtlas
+from Components.TextImage import TextImage
+from Components.TextPipeline import TextPipeline
+from Components.TextProducer import TextProducer
+from Texture import Font
+from benchmarks.fixtures import buildFixtures, getParser, saveResults
+from utils import getWordRandom
+
+
+def copyingSamples(textImage: TextImage, N: list):
+    """
+        reference fan-out, parents are deep copied for every branch
+    """
+    images = []
+    for i in range(N[0]):
+        image, charBboxes = copy.deepcopy(textImage.wordImage), textImage.charBBoxes
+        image = textImage.pipeline.charImageAugmentations.apply(image=image, bboxes=charBboxes, rng=textImage.rng)
+        for j in range(N[1]):
+            image_ = copy.deepcopy(image)
+            image_ = textImage.pipeline.textImageAugmentations.apply(image=image_, rng=textImage.rng,
+                                                                     paletteSeed=textImage.paletteSeed)
+            blended = textImage.pipeline.blendBackground.blendBatch(image_, n=N[2], rng=textImage.rng,
+                                                                    paletteSeed=textImage.paletteSeed)
+            for k in range(N[2]):
+                images.append(copy.deepcopy(blended[k]))
+    return images
+
+
+def consume(samples):
+    """
+        iterate samples without keeping them
+    """
+    n = 0
+    for _ in samples:
+        n += 1
+    return n
+
+
+MODES = {
+    "copying": lambda textImage, N: copyingSamples(textImage, N),
+    "getSamples": lambda textImage, N: textImage.getSamples(N),
+    "iterSamples": lambda textImage, N: consume(textImage.iterSamples(N)),
+}
+
+
+def measure(cfg, mode: str, numWords: int):
+    """
+        peak traced memory above the word's starting point, per word
+    """
+    (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer) = cfg
+    font = Font(cfg_Base["FONT"])
+    textProducer = TextProducer(cfg_TextProducer)
+    atlas = GlyphAtlas(maxBytes=cfg_Base["GlyphAtlas"]["maxBytes"])
+    pipeline = TextPipeline(cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background)
+    run = MODES[mode]
+
+    peaks = []
+    seconds = 0.0
+    tracemalloc.start()
+    for index in range(numWords):
+        rng, paletteSeed = getWordRandom(cfg_Base["seed"], index, cfg_Base["paletteBlock"])
+        text = textProducer.getText(rng)
+        fontSample = font.getRandomFont(rng)
+        chars = [CharImage(text=c, font=fontSample, color=(0, 0, 0, 255), atlas=atlas) for c in text]
+        textImage = TextImage(chars, pipeline, rng=rng, paletteSeed=paletteSeed)
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        t = time.perf_counter()
+        run(textImage, cfg_Base["getSamples"])
+        seconds += time.perf_counter() - t
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - start)
+    tracemalloc.stop()
+    return {"words": numWords,
+            "meanPeakBytes": float(numpy.mean(peaks)),
+            "maxPeakBytes": int(numpy.max(peaks)),
+            "secondsPerWord": seconds / numWords}
+
+
+if __name__ == '__main__':
+    parser = getParser(__doc__)
+    parser.add_argument("--words", type=int, default=50)
+    opt = parser.parse_args()
+
+    cfg = buildFixtures(opt.fixtures, seed=opt.seed)
+    cfg[0]["seed"] = opt.seed
+
+    results = {}
+    print(f"{'mode':<15}{'mean peak KB':>15}{'max peak KB':>15}{'ms/word':>10}")
+    for mode in MODES:
+        r = results[mode] = measure(cfg, mode, opt.words)
+        print(f"{mode:<15}{r['meanPeakBytes'] / 1024:>15.1f}{r['maxPeakBytes'] / 1024:>15.1f}"
+              f"{1000 * r['secondsPerWord']:>10.2f}")
+
+    saveResults(results, opt.output)
@@ -0,0 +1,105 @@
+"""
+    Transfer throughput of samples from producer processes to a consumer: the shared-memory ring (ringbuffer.py)
+    against pickling the samples through a multiprocessing pipe (multiprocessing.Queue). Producers send the same
+    random RGBA samples in both cases, the consumer reads every sample's pixels once (an xor checksum) so both paths deliver
+    usable data.
+
+    python -m benchmarks.ringbuffer --producers 4 --samples 4000 --output ringbuffer.json
+"""
+import multiprocessing
+import time
+
+import numpy
+
+from benchmarks.fixtures import getParser, saveResults
+from ringbuffer import SampleRing, iterRing
+
+CTX = multiprocessing.get_context("fork")
+
+
+def getSamples(shape: tuple, n: int, seed: int):
+    rng = numpy.random.default_rng(seed)
+    images = [rng.integers(0, 256, shape, dtype=numpy.uint8) for _ in range(4)]
+    boxes = [[i * 20, 4, i * 20 + 18, shape[0] - 4] for i in range(10)]
+    return [("benchmark", images[i % len(images)], boxes) for i in range(n)]
+
+
+def getChecksum(image: numpy.ndarray):
+    """
+        xor of the 8-byte words of the image, reads every pixel
+    """
+    return int(numpy.bitwise_xor.reduce(image.reshape(-1).view(numpy.uint64)))
+
+
+def ringProducer(ring: SampleRing, shape: tuple, n: int, seed: int):
+    for i, (text, image, boxes) in enumerate(getSamples(shape, n, seed)):
+        ring.put(text, image, boxes, index=i)
+    ring.finish()
+
+
+def queueProducer(sampleQueue, shape: tuple, n: int, seed: int):
+    for i, (text, image, boxes) in enumerate(getSamples(shape, n, seed)):
+        sampleQueue.put((i, text, image, boxes))
+    sampleQueue.put(None)
+
+
+def runRing(numProducers: int, shape: tuple, n: int, slots: int):
+    ring = SampleRing(slots=slots, slotBytes=int(numpy.prod(shape)))
+    producers = [CTX.Process(target=ringProducer, args=(ring, shape, n, i)) for i in range(numProducers)]
+    t = time.perf_counter()
+    for p in producers:
+        p.start()
+    count, checksum = 0, 0
+    for index, text, image, boxes in iterRing(ring, numProducers, producers=producers):
+        checksum ^= getChecksum(image)
+        count += 1
+    seconds = time.perf_counter() - t
+    for p in producers:
+        p.join()
+    ring.unlink()
+    return count, seconds, checksum
+
+
+def runQueue(numProducers: int, shape: tuple, n: int, slots: int):
+    sampleQueue = CTX.Queue(maxsize=slots)
+    producers = [CTX.Process(target=queueProducer, args=(sampleQueue, shape, n, i)) for i in range(numProducers)]
+    t = time.perf_counter()
+    for p in producers:
+        p.start()
+    count, checksum, finished = 0, 0, 0
+    while finished < numProducers:
+        item = sampleQueue.get()
+        if item is None:
+            finished += 1
+            continue
+        index, text, image, boxes = item
+        checksum ^= getChecksum(image)
+        count += 1
+    seconds = time.perf_counter() - t
+    for p in producers:
+        p.join()
+    return count, seconds, checksum
+
+
+if __name__ == '__main__':
+    parser = getParser(__doc__, fixtures=False, seed=False)
+    parser.add_argument("--producers", type=int, default=4)
+    parser.add_argument("--samples", type=int, default=4000, help="samples per producer")
+    parser.add_argument("--height", type=int, default=64)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--slots", type=int, default=64, help="ring slots / queue size")
+    opt = parser.parse_args()
+
+    shape = (opt.height, opt.width, 4)
+    results = {}
+    print(f"{opt.producers} producers, {opt.samples} samples each, {shape} uint8")
+    for name, run in [("ring", runRing), ("pickle-pipe", runQueue)]:
+        count, seconds, checksum = run(opt.producers, shape, opt.samples, opt.slots)
+        results[name] = {"samples": count, "seconds": seconds, "samplesPerSecond": count / seconds,
+                         "MBPerSecond": count * numpy.prod(shape) / seconds / 2 ** 20, "checksum": checksum}
+        r = results[name]
+        print(f"{name:<15}{r['samplesPerSecond']:>12.0f} samples/s{r['MBPerSecond']:>10.0f} MB/s")
+    assert results["ring"]["checksum"] == results["pickle-pipe"]["checksum"], "Transferred samples differ!"
+    print(f"speedup {results['ring']['samplesPerSecond'] / results['pickle-pipe']['samplesPerSecond']:.2f}x")
+
+    saveResults(results, opt.output)
@@ -0,0 +1,232 @@
+"""
+    Offline benchmarks of the generator pipeline on synthetic fixtures (see fixtures.py).
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --output results.json --baseline baseline.json
+"""
+import json
+import os
+import platform
+import sys
+import time
+import traceback
+from functools import partial
+
+import cv2
+import numpy
+
+from Augmentations import CharImageAugmentations, TextImageAugmentations
+from Augmentations.Augmentations import (PadLeftRight, ResizeChar, WrapText, AffineTransform, Transformation3D)
+from Components.BackgroundBlender import BackgroundBlender
+from Components.CharImage import CharImage
+from Components.GlyphAtlas import GlyphAtlas
+from Components.TextImage import TextImage
+from Components.TextPipeline import TextPipeline
+from Components.TextProducer import TextProducer
+from Texture import Font, Painter
+from benchmarks.fixtures import buildFixtures, getParser, saveResults, LOWER
+from utils import ImageEncoder, getWordRandom
+
+RESULTS = {}
+
+
+def bench(name: str, fn, minTime: float = 0.5, minCalls: int = 5):
+    """
+        run fn until minTime seconds and minCalls calls have passed, record the median time per call. An exception
+        is recorded as the error of the benchmark, the run then fails (see failures).
+    """
+    times = []
+    start = time.perf_counter()
+    try:
+        while len(times) < minCalls or time.perf_counter() - start < minTime:
+            t = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t)
+    except Exception as e:
+        RESULTS[name] = {"error": repr(e)}
+        print(f"{name:<45}{'error: ' + repr(e)}")
+        traceback.print_exc()
+        return
+    RESULTS[name] = {"seconds": float(numpy.median(times)), "calls": len(times)}
+    print(f"{name:<45}{1000 * RESULTS[name]['seconds']:>10.3f} ms{len(times):>8} calls")
+    return
+
+
+def getWordImage(font, text: str, atlas: GlyphAtlas = None):
+    chars = [CharImage(text=c, font=font, color=(0, 0, 0, 255), atlas=atlas) for c in text]
+    return TextImage(chars)
+
+
+def microBenchmarks(cfg, seed: int):
+    (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer) = cfg
+    font = Font(cfg_Base["FONT"]).getFont(0, 40)
+    rng = numpy.random.default_rng(seed)
+    paletteSeed = (seed, 0)
+
+    # glyphs
+    chars = iter(rng.choice(list(LOWER), size=10 ** 6))
+    bench("glyph/render", lambda: CharImage(text=next(chars), font=font, color=(0, 0, 0, 255)).render())
+    atlas = GlyphAtlas()
+    bench("glyph/atlas", lambda: CharImage(text=next(chars), font=font, color=(0, 0, 0, 255), atlas=atlas).getImage())
+
+    text = "benchmarkçığöşü"
+    textImage = getWordImage(font, text, atlas)
+    wordImage, bboxes = textImage.getWordImage()
+    painted = Painter()(wordImage, rng)
+
+    # char augmentations
+    charAugmentations = CharImageAugmentations(cfg_CharAugmentations)
+    bench("char/CharImageAugmentations.apply", lambda: charAugmentations.apply(image=wordImage, bboxes=bboxes, rng=rng))
+    x1, _, x2, _ = bboxes[0]
+    crop = wordImage[:, x1:x2]
+    bench("char/ElasticTransformation", lambda: charAugmentations.augmentationSequence(image=crop))
+
+    # custom augmentations, always applied
+    augmentations = {
+        "PadLeftRight": PadLeftRight(1, pad=[0.05, 0.25]),
+        "ResizeChar": ResizeChar(1, ratio=[0.4, 2.5], minW=7, minH=10),
+        "WrapText": WrapText(1, arcAngle=[5, 25], rotateAngle=[0, 5]),
+        "AffineTransform": AffineTransform(1, maxRotate=10, maxTranslate=5),
+        "Transformation3D": Transformation3D(1, maxTheta=45, maxPhi=45, maxGamma=1),
+    }
+    for name, aug in augmentations.items():
+        image = crop if name == "ResizeChar" else painted
+        bench(f"augmentation/{name}", partial(aug.apply, image, rng))
+
+    # text augmentations
+    textAugmentations = TextImageAugmentations(cfg_TextAugmentations)
+    bench("text/TextImageAugmentations.apply",
+          lambda: textAugmentations.apply(image=painted, rng=rng, paletteSeed=paletteSeed))
+    bench("text/Painter", lambda: textAugmentations.painter(wordImage, rng))
+    mixer = textAugmentations.texture
+    h, w, _ = painted.shape
+    texture = mixer.getTextureImage(w=w, h=h, rng=rng, paletteSeed=paletteSeed)
+    bench("text/TextureMixer.getTextureImage",
+          lambda: mixer.getTextureImage(w=w, h=h, rng=rng, paletteSeed=paletteSeed))
+    bench("text/TextureMixer.blend", lambda: mixer.blend(textImage=painted, texture=texture, rng=rng))
+
+    # backgrounds
+    blender = BackgroundBlender(cfg_Background)
+    resized = cv2.resize(painted, blender.resizeSize, interpolation=cv2.INTER_CUBIC)
+    backgrounds = [blender.getBackgroundImage(w=w, h=h, rng=rng, paletteSeed=paletteSeed)
+                   for _ in range(blender.batchSize)]
+    bench("background/getBackgroundImage", lambda: blender.getBackgroundImage(w=w, h=h, rng=rng,
+                                                                              paletteSeed=paletteSeed))
+    bench("background/isAppropriate", lambda: blender.isAppropriate(imageResized=resized, background=backgrounds[0]))
+    bench(f"background/areAppropriate[{len(backgrounds)}]",
+          lambda: blender.areAppropriate(imageResized=resized, backgrounds=backgrounds))
+    n = cfg_Base["getSamples"][2]
+    bench(f"background/blendBatch[{n}]", lambda: blender.blendBatch(painted, n=n, rng=rng, paletteSeed=paletteSeed))
+
+    # texts
+    textProducer = TextProducer(cfg_TextProducer)
+    bench("text/TextProducer.getText", lambda: textProducer.getText(rng))
+    bench("text/TextProducer.getTexts[1000]", lambda: textProducer.getTexts(1000, rng))
+
+    # encoding
+    sample = blender.blendBatch(painted, n=1, rng=rng)[0]
+    for fmt in ["jpg", "png", "webp"]:
+        encoder = ImageEncoder({"format": fmt, "quality": cfg_Base["encoder"]["quality"] if fmt != "png" else 3})
+        bench(f"encode/{fmt}", partial(encoder.encode, sample))
+    return
+
+
+def runGenerator(cfg, numWords: int):
+    """
+        words/sec and samples/sec of main.generator, samples are encoded but not written
+    """
+    import main
+    (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer) = cfg
+    font = Font(cfg_Base["FONT"])
+    textProducer = TextProducer(cfg_TextProducer)
+    atlas = GlyphAtlas(maxBytes=cfg_Base["GlyphAtlas"]["maxBytes"])
+    encoder = ImageEncoder(cfg_Base["encoder"])
+    pipeline = TextPipeline(cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background)
+
+    counter = {"samples": 0}
+
+    def write(text, samples, bboxes=None):
+        encoder.encodeBatch(samples)
+        counter["samples"] += len(samples)
+
+    start = time.perf_counter()
+    for index in range(numWords):
+        rng, paletteSeed = getWordRandom(cfg_Base["seed"], index, cfg_Base["paletteBlock"])
+        main.generator(textProducer.getText(rng), font.getRandomFont(rng), cfg_Base, cfg_CharAugmentations,
+                       cfg_TextAugmentations, cfg_Background, write, atlas=atlas, rng=rng, paletteSeed=paletteSeed,
+                       pipeline=pipeline)
+    seconds = time.perf_counter() - start
+    encoder.close()
+    RESULTS["macro/generator"] = {"words": numWords,
+                                  "samples": counter["samples"],
+                                  "seconds": seconds,
+                                  "wordsPerSecond": numWords / seconds,
+                                  "samplesPerSecond": counter["samples"] / seconds}
+    print(f"{'macro/generator':<45}{numWords / seconds:>10.2f} words/s{counter['samples'] / seconds:>10.1f} samples/s")
+    return
+
+
+def failures(results: dict):
+    """
+        names of the benchmarks which raised
+    """
+    return [name for name, result in results.items() if "error" in result]
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+        print per benchmark ratios against baseline
+    :return: names of benchmarks slower than baseline by more than tolerance
+    """
+    regressions = []
+    print(f"\n{'benchmark':<45}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, result in results.items():
+        if name not in baseline or "error" in result or "error" in baseline[name]:
+            continue
+        if "samplesPerSecond" in result:
+            # throughput, higher is better
+            old, new = baseline[name]["samplesPerSecond"], result["samplesPerSecond"]
+            ratio = old / new
+        else:
+            old, new = baseline[name]["seconds"], result["seconds"]
+            ratio = new / old
+        flag = "  <-- regression" if ratio > 1 + tolerance else ""
+        print(f"{name:<45}{old:>12.5f}{new:>12.5f}{ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = getParser(__doc__)
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown ratio against baseline")
+    parser.add_argument("--words", type=int, default=20, help="number of words of the macro benchmark")
+    opt = parser.parse_args()
+
+    cfg = buildFixtures(opt.fixtures, seed=opt.seed)
+    cfg[0]["encoder"]["threads"] = 0
+    cfg[0]["seed"] = opt.seed
+
+    microBenchmarks(cfg, seed=opt.seed)
+    runGenerator(cfg, numWords=opt.words)
+
+    output = {"meta": {"python": platform.python_version(),
+                       "numpy": numpy.__version__,
+                       "opencv": cv2.__version__,
+                       "machine": platform.machine(),
+                       "cpus": os.cpu_count(),
+                       "seed": opt.seed},
+              "results": RESULTS}
+    saveResults(output, opt.output)
+
+    failed = failures(RESULTS)
+    regressions = []
+    if opt.baseline is not None:
+        with open(opt.baseline, 'r') as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(RESULTS, baseline, opt.tolerance)
+    if len(failed) > 0:
+        print(f"\nFailed benchmarks: {failed}")
+    if len(failed) > 0 or len(regressions) > 0:
+        sys.exit(1)
@@ -0,0 +1,113 @@
+"""
+    Read throughput of raw pixel shards (shards.py) against JPEG in LMDB, for the samples of the pipeline on synthetic
+    fixtures. Both outputs are written with ImageWriter from the same samples. A read gives an owned height x width x 3
+    array of the target height, so JPEG reads include decoding and resizing and raw reads include a copy (as the
+    conversion to a tensor would). Random reads of compressed shards decompress a whole chunk per sample, compressed
+    shards are meant to be read in order (e.g. shuffled within a buffer).
+
+    python -m benchmarks.shards --samples 2000 --output shards.json
+"""
+import os
+import shutil
+import time
+
+import cv2
+import lmdb
+import numpy
+
+from benchmarks.fixtures import buildFixtures, getParser, saveResults
+from shards import RawShardReader, getCodec
+from stream import iterSamples
+from utils import ImageWriter, ImageEncoder
+
+CODECS = ["none", "zlib", "lz4", "zstd"]
+
+
+def getFolderBytes(root: str):
+    """
+        allocated bytes of a folder (the LMDB map file is sparse)
+    """
+    return sum(os.stat(os.path.join(d, f)).st_blocks * 512 for d, _, files in os.walk(root) for f in files)
+
+
+def writeSamples(root: str, words: list, encoderArgs: dict, rawArgs: dict = None):
+    """
+        write the samples of words with ImageWriter
+    """
+    shutil.rmtree(root, ignore_errors=True)
+    writer = ImageWriter(root=root, isLMDB=True, encoder=ImageEncoder(encoderArgs),
+                         lmdbArgs={"txnRecords": 1000, "bulkLoad": True}, rawArgs=rawArgs)
+    for index, (text, samples) in enumerate(words):
+        writer.writeSamples(text, samples, index)
+    writer.close()
+    return getFolderBytes(root)
+
+
+def readLMDB(root: str, height: int, order: list):
+    env = lmdb.open(os.path.join(root, "SyntheticTurkishStyleText"), readonly=True, lock=False)
+    with env.begin() as txn:
+        keys = [k for k in txn.cursor().iternext(values=False)]
+        t = time.perf_counter()
+        for i in order:
+            image = cv2.imdecode(numpy.frombuffer(txn.get(keys[i]), numpy.uint8), cv2.IMREAD_COLOR)
+            h, w = image.shape[:2]
+            cv2.resize(image, (max(1, round(w * height / h)), height), interpolation=cv2.INTER_AREA)
+        seconds = time.perf_counter() - t
+    env.close()
+    return seconds
+
+
+def readRaw(root: str, order: list):
+    reader = RawShardReader(os.path.join(root, "raw"))
+    t = time.perf_counter()
+    for i in order:
+        _, image = reader[i]
+        numpy.array(image)
+    return time.perf_counter() - t
+
+
+def isAvailable(codec: str):
+    try:
+        getCodec(codec)
+        return True
+    except Exception:
+        return False
+
+
+if __name__ == '__main__':
+    parser = getParser(__doc__)
+    parser.add_argument("--output-root", default="/tmp/sts_shards", help="folder of the written outputs")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=32)
+    opt = parser.parse_args()
+
+    cfg = buildFixtures(opt.fixtures, seed=opt.seed)
+    words, count = [], 0
+    for text, image, _ in iterSamples(cfg, seed=opt.seed):
+        if len(words) == 0 or words[-1][0] != text:
+            words.append((text, []))
+        words[-1][1].append(image)
+        count += 1
+        if count == opt.samples:
+            break
+
+    rng = numpy.random.default_rng(opt.seed)
+    orders = {"sequential": list(range(count)), "random": rng.permutation(count).tolist()}
+    results = {}
+    root = os.path.join(opt.output_root, "jpg")
+    results["jpg-lmdb"] = {"bytes": writeSamples(root, words, {"format": "jpg", "quality": 75})}
+    for name, order in orders.items():
+        results["jpg-lmdb"][name] = count / readLMDB(root, opt.height, order)
+    for codec in filter(isAvailable, CODECS):
+        root = os.path.join(opt.output_root, f"raw-{codec}")
+        result = results[f"raw-{codec}"] = {
+            "bytes": writeSamples(root, words, {"format": "raw", "height": opt.height},
+                                  {"compression": codec, "shardBytes": 2 ** 26, "chunkBytes": 2 ** 20})}
+        for name, order in orders.items():
+            result[name] = count / readRaw(root, order)
+
+    print(f"{count} samples, height {opt.height}")
+    print(f"{'layout':<15}{'MB':>10}{'sequential/s':>15}{'random/s':>12}")
+    for name, r in results.items():
+        print(f"{name:<15}{r['bytes'] / 2 ** 20:>10.1f}{r['sequential']:>15.0f}{r['random']:>12.0f}")
+    saveResults(results, opt.output)
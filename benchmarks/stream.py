@@ -0,0 +1,43 @@
+"""
+    Benchmark of the streaming API (stream.py) on synthetic fixtures: time to the first sample (configs, fonts, corpus
+    and caches are set up lazily by the first next()) and steady-state samples/sec after a warm-up.
+
+    python -m benchmarks.stream --samples 500 --output stream.json
+"""
+import time
+
+from benchmarks.fixtures import buildFixtures, getParser, saveResults
+from stream import iterSamples
+
+
+def measure(cfg, numSamples: int, warmup: int, rgb: bool, seed: int):
+    t = time.perf_counter()
+    samples = iterSamples(cfg, seed=seed, rgb=rgb)
+    next(samples)
+    firstSample = time.perf_counter() - t
+
+    for _ in range(warmup):
+        next(samples)
+    boxes = 0
+    t = time.perf_counter()
+    for _ in range(numSamples):
+        _, _, charBBoxes = next(samples)
+        boxes += len(charBBoxes)
+    seconds = time.perf_counter() - t
+    samples.close()
+    return {"firstSampleSeconds": firstSample, "samples": numSamples, "seconds": seconds,
+            "samplesPerSecond": numSamples / seconds, "boxesPerSample": boxes / numSamples}
+
+
+if __name__ == '__main__':
+    parser = getParser(__doc__)
+    parser.add_argument("--samples", type=int, default=500, help="timed samples")
+    parser.add_argument("--warmup", type=int, default=50, help="samples before timing")
+    parser.add_argument("--rgb", action="store_true", help="stream RGB instead of RGBA")
+    opt = parser.parse_args()
+
+    result = measure(buildFixtures(opt.fixtures, seed=opt.seed), opt.samples, opt.warmup, opt.rgb, opt.seed)
+    print(f"first sample {1000 * result['firstSampleSeconds']:.1f} ms, "
+          f"{result['samplesPerSecond']:.1f} samples/s ({result['samples']} samples, "
+          f"{result['boxesPerSample']:.1f} boxes/sample)")
+    saveResults(result, opt.output)
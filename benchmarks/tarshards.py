@@ -0,0 +1,107 @@
+"""
+    Tar shards (shards.TarShardWriter) of the samples of the pipeline on synthetic fixtures: write time with several
+    writer threads, and sequential read throughput from a local folder (members only, and with JPEG decoding and box
+    parsing) against a sequential cursor scan of the same samples in LMDB. Outputs were just written, reads are served
+    from the page cache unless it is dropped.
+
+    python -m benchmarks.tarshards --samples 4000 --output tarshards.json
+"""
+import json
+import os
+import shutil
+import time
+
+import cv2
+import lmdb
+import numpy
+
+from benchmarks.fixtures import buildFixtures, getParser, saveResults
+from shards import iterTarShards
+from stream import iterIndexedSamples
+from utils import ImageWriter, ImageEncoder
+
+
+def getWords(cfg, numSamples: int, seed: int, encoderArgs: dict = None):
+    """
+        (index, text, encoded samples, boxes) of the first words of the stream with numSamples samples
+    :param encoderArgs: ImageEncoder args of the samples (default: jpg, quality 75)
+    """
+    encoder = ImageEncoder(encoderArgs if encoderArgs is not None else {"format": "jpg", "quality": 75})
+    words, count = [], 0
+    for index, text, image, charBBoxes in iterIndexedSamples(cfg, seed=seed):
+        if len(words) == 0 or words[-1][0] != index:
+            words.append((index, text, [], []))
+        words[-1][2].append(encoder.encode(image))
+        words[-1][3].append(charBBoxes)
+        count += 1
+        if count == numSamples:
+            break
+    return words
+
+
+def writeWords(root: str, words: list, tarArgs: dict = None):
+    shutil.rmtree(root, ignore_errors=True)
+    writer = ImageWriter(root=root, isLMDB=True, encoder=ImageEncoder({"format": "jpg"}),
+                         lmdbArgs={"txnRecords": 1000, "bulkLoad": True}, tarArgs=tarArgs)
+    t = time.perf_counter()
+    for index, text, samples, bboxes in words:
+        writer.writeEncodedSamples(text, samples, index, bboxes=bboxes)
+    writer.close()
+    return time.perf_counter() - t
+
+
+def readTar(root: str, decode: bool):
+    t = time.perf_counter()
+    count, numBytes = 0, 0
+    for key, sample in iterTarShards(root):
+        numBytes += sum(len(v) for v in sample.values())
+        if decode:
+            cv2.imdecode(numpy.frombuffer(sample[".jpg"], numpy.uint8), cv2.IMREAD_COLOR)
+            json.loads(sample[".json"])
+        count += 1
+    return count, numBytes, time.perf_counter() - t
+
+
+def readLMDB(root: str, decode: bool):
+    env = lmdb.open(os.path.join(root, "SyntheticTurkishStyleText"), readonly=True, lock=False)
+    t = time.perf_counter()
+    count, numBytes = 0, 0
+    with env.begin() as txn:
+        for key, value in txn.cursor():
+            numBytes += len(key) + len(value)
+            if decode:
+                cv2.imdecode(numpy.frombuffer(value, numpy.uint8), cv2.IMREAD_COLOR)
+            count += 1
+    seconds = time.perf_counter() - t
+    env.close()
+    return count, numBytes, seconds
+
+
+if __name__ == '__main__':
+    parser = getParser(__doc__)
+    parser.add_argument("--output-root", default="/tmp/sts_tarshards", help="folder of the written outputs")
+    parser.add_argument("--samples", type=int, default=4000)
+    parser.add_argument("--maxRecords", type=int, default=500, help="samples per tar shard")
+    parser.add_argument("--threads", type=int, default=4, help="tar writer threads")
+    opt = parser.parse_args()
+
+    words = getWords(buildFixtures(opt.fixtures, seed=opt.seed), opt.samples, opt.seed)
+    tarRoot = os.path.join(opt.output_root, "tar")
+    lmdbRoot = os.path.join(opt.output_root, "lmdb")
+    results = {"tar": {"writeSeconds": writeWords(tarRoot, words, {"enabled": True, "maxRecords": opt.maxRecords,
+                                                                     "threads": opt.threads})},
+               "lmdb": {"writeSeconds": writeWords(lmdbRoot, words)}}
+    readers = {"tar": lambda decode: readTar(os.path.join(tarRoot, "tar"), decode),
+               "lmdb": lambda decode: readLMDB(lmdbRoot, decode)}
+
+    print(f"{'layout':<10}{'write s':>10}{'read samples/s':>16}{'MB/s':>8}{'decoded samples/s':>19}")
+    for name, read in readers.items():
+        r = results[name]
+        count, numBytes, seconds = read(False)
+        r.update({"samples": count, "bytes": numBytes, "samplesPerSecond": count / seconds,
+                  "MBPerSecond": numBytes / seconds / 2 ** 20})
+        count, _, seconds = read(True)
+        r["decodedSamplesPerSecond"] = count / seconds
+        print(f"{name:<10}{r['writeSeconds']:>10.2f}{r['samplesPerSecond']:>16.0f}{r['MBPerSecond']:>8.0f}"
+              f"{r['decodedSamplesPerSecond']:>19.0f}")
+    saveResults(results, opt.output)
@@ -0,0 +1,233 @@
+import collections
+import multiprocessing
+import queue
+
+import tqdm
+
+from Texture.ImageCache import getImageSizeIndex, getCacheStats, mergeCacheStats
+from profiler import PROFILER
+from utils import ImageWriter, ImageEncoder, StageTracer, Checkpoint, getWordRandom
+
+
+class ParallelEngine:
+    """
+        Multi-process generation engine.
+
+        Word indices are dispatched as jobs to a pool of forked worker processes, each word is generated from
+        (seed, index) only, so the output does not depend on which worker generates it. Every worker has its own job
+        queue and counts its finished words, so the engine knows the words in flight of every worker. Fonts, corpus
+        and image indexes are loaded once before forking and shared copy-on-write. Workers encode their samples and
+        stream them to a single writer process which owns the LMDB environment and the checkpoint.
+        A worker which dies is replaced and its unfinished words are queued again, the writer drops the second copy of
+        a word whose worker died after sending it. Words missing from the output at the end of the run (the checkpoint
+        stops before them) are reported.
+    """
+
+    def __init__(self, numWorkers: int, queueSize: int = None):
+        assert numWorkers > 0
+        self.numWorkers = numWorkers
+        self.queueSize = queueSize if queueSize is not None else 4 * numWorkers
+        self.ctx = multiprocessing.get_context("fork")
+        return
+
+    def run(self, generator, font, textProducer, cfg, checkpoint: Checkpoint, tracer: StageTracer = None):
+        """
+            generate the words from checkpoint.next to numUniqueText in parallel
+        :param generator: generator function (see main.generator)
+        :param font: Font object, shared by the workers
+        :param textProducer: TextProducer object, shared by the workers
+        :param cfg: configs
+        :param checkpoint: checkpoint of the run, updated by the writer process
+        :param tracer: tracer used by the generator, flushed when a worker finishes
+        """
+        (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer) = cfg
+
+        # index image folders once, forked workers inherit them
+        getImageSizeIndex(cfg_Background["BackgroundTexture"]["root"])
+        getImageSizeIndex(cfg_TextAugmentations["Texture"]["TextureMixer"]["root"], depth=1)
+
+        # samples are written to the pipe when put (no feeder thread), so a word counted as finished reached the pipe
+        sampleQueue = self.ctx.SimpleQueue()
+        statsQueue = self.ctx.Queue()
+        # jobs finished by the worker of every slot, a worker signals every finished job
+        finished = self.ctx.Array('q', self.numWorkers, lock=False)
+        finishedSignal = self.ctx.Semaphore(0)
+
+        writer = self.ctx.Process(target=writerLoop, args=(sampleQueue, statsQueue, cfg_Base, checkpoint),
+                                  name="writer")
+        writer.start()
+
+        workerArgs = (sampleQueue, statsQueue, finished, finishedSignal, generator, font, textProducer, cfg, tracer)
+        workers = [self.startWorker(k, workerArgs) for k in range(self.numWorkers)]
+        # words sent to the worker of every slot and not finished yet, in order
+        assigned = [collections.deque() for _ in range(self.numWorkers)]
+        seen = [0] * self.numWorkers
+        pending = collections.deque(range(checkpoint.next, cfg_Base["numUniqueText"]))
+        requeued = []
+        stats = []
+
+        tbar = tqdm.tqdm(total=cfg_Base["numUniqueText"], initial=checkpoint.next, colour='GREEN')
+        while len(pending) > 0 or any(len(a) > 0 for a in assigned):
+            while len(pending) > 0 and sum(len(a) for a in assigned) < self.queueSize:
+                k = min(range(self.numWorkers), key=lambda k: len(assigned[k]))
+                assigned[k].append(pending.popleft())
+                workers[k][1].put(assigned[k][-1])
+            finishedSignal.acquire(timeout=1)
+            if writer.exitcode is not None:
+                raise Exception(f"Writer process failed with exit code {writer.exitcode}!")
+            tbar.update(self.collect(finished, seen, assigned))
+            for k, (w, _) in enumerate(workers):
+                if w.exitcode is None:
+                    continue
+                tbar.update(self.collect(finished, seen, assigned))
+                lost = list(assigned[k])
+                print(f"Worker {w.pid} died with exit code {w.exitcode}, restarting, words {lost} are queued again.")
+                assigned[k].clear()
+                pending.extendleft(reversed(lost))
+                requeued.extend(lost)
+                finished[k], seen[k] = 0, 0
+                workers[k] = self.startWorker(k, workerArgs)
+        tbar.close()
+
+        for w, jobQueue in workers:
+            jobQueue.put(None)
+        # stats are drained while joining, a process exits only once its stats are in the pipe
+        self.join([w for w, _ in workers], statsQueue, stats)
+        for w, _ in workers:
+            if w.exitcode != 0:
+                print(f"Worker {w.pid} failed with exit code {w.exitcode} after its last word.")
+        sampleQueue.put(None)
+        self.join([writer], statsQueue, stats)
+        if writer.exitcode != 0:
+            raise Exception(f"Writer process failed with exit code {writer.exitcode}!")
+        self.drain(statsQueue, stats)
+
+        # stats of every finished process (crashed workers do not report)
+        encoderStats = ImageEncoder.mergeStats([s["encoder"] for s in stats if "encoder" in s])
+        print(f"Encoding: {encoderStats}")
+        for s in stats:
+            PROFILER.merge(s["profiler"])
+        if len(requeued) > 0:
+            print(f"Words queued again after worker crashes: {sorted(requeued)}")
+        written = [s["checkpoint"] for s in stats if "checkpoint" in s][0]
+        duplicates = [s["duplicates"] for s in stats if "duplicates" in s][0]
+        if len(duplicates) > 0:
+            print(f"Words sent twice by workers which died after sending them, written once: {sorted(duplicates)}")
+        missing = sorted(set(range(written["next"], cfg_Base["numUniqueText"])) - set(written["done"]))
+        if len(missing) > 0:
+            print(f"{len(missing)} words were not written, the checkpoint stops at {written['next']}: "
+                  f"{missing[:100]}{' ...' if len(missing) > 100 else ''}")
+        PROFILER.report(extra={"encoder": encoderStats,
+                               "caches": mergeCacheStats([s["caches"] for s in stats if "caches" in s]),
+                               "workers": len([s for s in stats if "encoder" in s]),
+                               "requeued": sorted(requeued), "duplicates": sorted(duplicates),
+                               "missing": missing})
+        return
+
+    def startWorker(self, k: int, workerArgs):
+        """
+            start the worker of slot k with a new job queue
+        :return: worker process, job queue
+        """
+        jobQueue = self.ctx.Queue()
+        worker = self.ctx.Process(target=workerLoop, args=(k, jobQueue) + workerArgs, daemon=True)
+        worker.start()
+        return worker, jobQueue
+
+    @staticmethod
+    def collect(finished, seen, assigned):
+        """
+            remove the finished words of every worker from its assigned words
+        :return: number of words finished since the last call
+        """
+        count = 0
+        for k in range(len(seen)):
+            done = finished[k] - seen[k]
+            for _ in range(done):
+                assigned[k].popleft()
+            seen[k] += done
+            count += done
+        return count
+
+    @staticmethod
+    def drain(statsQueue, stats):
+        while True:
+            try:
+                stats.append(statsQueue.get_nowait())
+            except queue.Empty:
+                return
+
+    def join(self, processes, statsQueue, stats):
+        while any(p.is_alive() for p in processes):
+            self.drain(statsQueue, stats)
+            for p in processes:
+                p.join(timeout=0.1)
+        return
+
+
+def workerLoop(k, jobQueue, sampleQueue, statsQueue, finished, finishedSignal, generator, font, textProducer, cfg,
+               tracer):
+    """
+        worker process of slot k: generate samples of a word and send encoded samples to the writer, count the
+        finished words in finished[k]
+    """
+    (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer) = cfg
+
+    encoder = ImageEncoder(cfg_Base["encoder"])
+
+    while True:
+        index = jobQueue.get()
+        if index is None:
+            break
+        rng, paletteSeed = getWordRandom(cfg_Base["seed"], index, cfg_Base["paletteBlock"])
+        text = None
+
+        def write(text, samples, bboxes=None):
+            sampleQueue.put((index, text, encoder.encodeBatch(samples), bboxes))
+
+        try:
+            text = textProducer.getText(rng)
+            fontSample = font.getRandomFont(rng)
+            with PROFILER.word():
+                generator(text, fontSample, cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background,
+                          write, rng=rng, paletteSeed=paletteSeed)
+        except Exception as e:
+            print(e)
+            # the word is done, without samples
+            sampleQueue.put((index, text, [], None))
+        finished[k] += 1
+        finishedSignal.release()
+    encoder.close()
+    if tracer is not None:
+        tracer.close()
+    statsQueue.put({"encoder": encoder.stats(), "profiler": PROFILER.snapshot(), "caches": getCacheStats()})
+    return
+
+
+def writerLoop(sampleQueue, statsQueue, cfg_Base, checkpoint):
+    """
+        writer process: the only owner of the output (LMDB environment or folder) and of the checkpoint
+    """
+    # samples arrive encoded, the encoder only names the files
+    writer = ImageWriter(root=cfg_Base["root"], isLMDB=cfg_Base["isLMDB"],
+                         encoder=ImageEncoder(dict(cfg_Base["encoder"], threads=0)), lmdbArgs=cfg_Base["lmdb"],
+                         checkpoint=checkpoint, rawArgs=cfg_Base.get("raw"), tarArgs=cfg_Base.get("tar"))
+    # words received in this run, a word queued again after its worker died past sending it arrives twice
+    received = Checkpoint(path=None, seed=checkpoint.seed, resume=False)
+    received.next = checkpoint.next
+    duplicates = []
+    while True:
+        item = sampleQueue.get()
+        if item is None:
+            break
+        index, text, samples, bboxes = item
+        if index < received.next or index in received.done:
+            duplicates.append(index)
+            continue
+        received.update([index])
+        # a failed write stops the writer, the checkpoint stays before the words it did not write
+        writer.writeEncodedSamples(text, samples, index, bboxes=bboxes)
+    writer.close()
+    statsQueue.put({"profiler": PROFILER.snapshot(), "duplicates": duplicates,
+                    "checkpoint": {"next": checkpoint.next, "done": sorted(checkpoint.done)}})
+    return
@@ -1,33 +1,71 @@
+import argparse
+import os
+from functools import partial
+
 from Components.CharImage import CharImage
+from Components.GlyphAtlas import GlyphAtlas
 from Components.TextImage import TextImage
+from Components.TextPipeline import TextPipeline
 from Components.TextProducer import TextProducer
 from Texture import Font
-from utils import readYAML, ImageWriter
+from Texture.ImageCache import getCacheStats
+from engine import ParallelEngine
+from profiler import PROFILER
+from utils import readYAML, ImageWriter, ImageEncoder, StageTracer, Checkpoint, getWordRandom
 
 
-def main(cfg):
+def main(cfg, workers: int = 1):
     """
         main function
     :param cfg: configs
+    :param workers: number of generator processes
     """
     (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer) = cfg
 
+    PROFILER.configure(cfg_Base["profile"])
     font = Font(cfg_Base["FONT"])
 
     textProducer = TextProducer(cfg_TextProducer)
-    writer = ImageWriter(root=cfg_Base["root"], isLMDB=cfg_Base["isLMDB"])
-
-    for _ in range(cfg_Base["numUniqueText"]):
-        text = textProducer.getText()
-        fontSample = font.getRandomFont()
+    atlas = GlyphAtlas(maxBytes=cfg_Base["GlyphAtlas"]["maxBytes"])
+    # augmentation stages are built once, forked workers inherit them
+    pipeline = TextPipeline(cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background)
+    tracer = StageTracer(cfg_Base["trace"])
+    checkpoint = Checkpoint(os.path.join(cfg_Base["root"], "checkpoint.json"), seed=cfg_Base["seed"],
+                            resume=cfg_Base["resume"])
+    if checkpoint.next > 0:
+        print(f"Resuming from word {checkpoint.next}.")
+    if workers > 1:
+        ParallelEngine(numWorkers=workers).run(partial(generator, atlas=atlas, tracer=tracer, pipeline=pipeline), font, textProducer, cfg,
+                                               checkpoint, tracer=tracer)
+        return
+
+    writer = ImageWriter(root=cfg_Base["root"], isLMDB=cfg_Base["isLMDB"], encoder=ImageEncoder(cfg_Base["encoder"]),
+                         lmdbArgs=cfg_Base["lmdb"], checkpoint=checkpoint, rawArgs=cfg_Base.get("raw"),
+                         tarArgs=cfg_Base.get("tar"))
+
+    for index in range(checkpoint.next, cfg_Base["numUniqueText"]):
+        rng, paletteSeed = getWordRandom(cfg_Base["seed"], index, cfg_Base["paletteBlock"])
+        text = textProducer.getText(rng)
+        fontSample = font.getRandomFont(rng)
+        write = partial(writer.writeSamples, index=index)
         try:
-            generator(text, fontSample, cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, writer.writeSamples)
+            with PROFILER.word():
+                generator(text, fontSample, cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background,
+                          write, atlas=atlas, tracer=tracer, rng=rng, paletteSeed=paletteSeed, pipeline=pipeline)
         except Exception as e:
             print(e)
+            # the word is done, without samples
+            writer.writeEncodedSamples(text, [], index)
+    print(f"Encoding: {writer.encoder.stats()}")
+    writer.close()
+    tracer.close()
+    PROFILER.report(extra={"encoder": writer.encoder.stats(), "glyphAtlas": atlas.stats(), "caches": getCacheStats()})
     return
 
 
-def generator(text, font, cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, writer):
+def generator(text, font, cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, writer,
+              atlas: GlyphAtlas = None, tracer: StageTracer = None, rng=None, paletteSeed: tuple = None,
+              pipeline: TextPipeline = None):
     """
         Image generator
     :param text: text
@@ -36,7 +74,12 @@ def generator(text, font, cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations
     :param cfg_CharAugmentations: char augmentation config
     :param cfg_TextAugmentations: text augmentation config
     :param cfg_Background: background augmentation config
-    :param writer: writer function pointer
+    :param writer: writer function pointer, writer(text, samples, bboxes=character boxes of every sample)
+    :param atlas: glyph cache
+    :param tracer: dumps intermediate images of some words
+    :param rng: random generator of the word (see utils.getWordRandom)
+    :param paletteSeed: seed of the background and texture palettes
+    :param pipeline: augmentation stages shared by the words (None: built from the configs for this word)
     """
 
     # get character images
@@ -46,21 +89,28 @@ def generator(text, font, cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations
                             font=font,
                             colorType="OneColor",
                             color=(0, 0, 0, 255),
-                            bold=False)
+                            bold=False,
+                            atlas=atlas)
         char_list.append(charImg)
 
     # get text images
-    txtImage = TextImage(char_list, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background)
+    if pipeline is None:
+        pipeline = TextPipeline(cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background)
+    txtImage = TextImage(char_list, pipeline, tracer=tracer, rng=rng, paletteSeed=paletteSeed)
 
     # get samples
-    samples = txtImage.getSamples(cfg_Base["getSamples"])
+    samples, bboxes = zip(*txtImage.iterLabeledSamples(cfg_Base["getSamples"]))
 
     # write samples
-    writer(text, samples)
+    writer(text, list(samples), bboxes=list(bboxes))
     return samples[0]
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="number of generator processes")
+    opt = parser.parse_args()
+
     cfgBase = "configs/base.yaml"
     cfgCharAugmentations = "configs/charAugmentations.yaml"
     cfgTextAugmentations = "configs/textAugmentations.yaml"
@@ -75,4 +125,4 @@ if __name__ == '__main__':
 
     cfg = (cfgBase, cfgCharAugmentations, cfgTextAugmentations, cfgBackground, cfgTextProducer)
 
-    main(cfg)
+    main(cfg, workers=opt.workers)
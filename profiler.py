@@ -0,0 +1,150 @@
+import cProfile
+import glob
+import json
+import os
+import pstats
+import random
+import time
+from contextlib import nullcontext
+
+import numpy
+
+
+class Stage:
+    """
+        timer of one stage call
+    """
+
+    def __init__(self, profiler, name: str, pixels: int):
+        self.profiler = profiler
+        self.name = name
+        self.pixels = pixels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, time.perf_counter() - self.start, self.pixels)
+        return False
+
+
+class StageProfiler:
+    """
+        Records wall time, call count and pixel throughput of pipeline stages, and captures cProfile data for a
+        sampled subset of words. Disabled by default, stages cost a single check then.
+        Nested stages are named with "/" (e.g. "TextImageAugmentations/WrapText"), their time is included in parents.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reportPath = None
+        self.cProfileRate = 0.0
+        self.random = random.Random()
+
+        self.stages = {}
+        self.profile = None
+        self.profiledWords = 0
+        self.nullStage = nullcontext()
+        return
+
+    def configure(self, args: dict):
+        """
+        :param args: enabled, report (JSON report path), cProfileRate (ratio of words captured with cProfile)
+        """
+        self.enabled = args.get("enabled", False)
+        self.reportPath = args.get("report")
+        self.cProfileRate = args.get("cProfileRate", 0.0)
+        return
+
+    def stage(self, name: str, image: numpy.ndarray = None):
+        """
+            context manager timing a stage
+        :param name: stage name
+        :param image: processed image, its pixel count is recorded
+        """
+        if not self.enabled:
+            return self.nullStage
+        pixels = image.shape[0] * image.shape[1] if image is not None else 0
+        return Stage(self, name, pixels)
+
+    def record(self, name: str, seconds: float, pixels: int = 0):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = [0, 0.0, 0]
+        stage[0] += 1
+        stage[1] += seconds
+        stage[2] += pixels
+        return
+
+    def word(self):
+        """
+            context manager around a word, captured with cProfile for a sampled subset of words
+        """
+        if not self.enabled or self.cProfileRate <= 0 or self.random.random() >= self.cProfileRate:
+            return self.nullStage
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+        self.profiledWords += 1
+        return self.profile
+
+    def snapshot(self):
+        """
+            stage records of this process, cProfile data is dumped next to the report
+        """
+        if self.profile is not None and self.reportPath is not None:
+            self.profile.dump_stats(f"{os.path.splitext(self.reportPath)[0]}-{os.getpid()}.prof")
+        return {"stages": {k: list(v) for k, v in self.stages.items()}, "profiledWords": self.profiledWords}
+
+    def merge(self, snapshot: dict):
+        """
+            add records of another process
+        """
+        for name, (calls, seconds, pixels) in snapshot["stages"].items():
+            stage = self.stages.setdefault(name, [0, 0.0, 0])
+            stage[0] += calls
+            stage[1] += seconds
+            stage[2] += pixels
+        self.profiledWords += snapshot["profiledWords"]
+        return
+
+    def report(self, extra: dict = None):
+        """
+            print a text report and write the JSON report, cProfile dumps of all processes are merged
+        :param extra: additional sections of the report (e.g. encoder or cache stats)
+        :return: report
+        """
+        if not self.enabled:
+            return None
+        stages = {}
+        for name, (calls, seconds, pixels) in sorted(self.stages.items(), key=lambda x: -x[1][1]):
+            stages[name] = {"calls": calls,
+                            "seconds": seconds,
+                            "msPerCall": 1000 * seconds / calls if calls > 0 else 0.0,
+                            "MPixelsPerSecond": pixels / 1e6 / seconds if seconds > 0 else 0.0}
+        report = {"stages": stages, "profiledWords": self.profiledWords}
+        if extra is not None:
+            report.update(extra)
+
+        print(f"{'stage':<50}{'calls':>10}{'seconds':>12}{'ms/call':>10}{'MPix/s':>10}")
+        for name, s in stages.items():
+            print(f"{name:<50}{s['calls']:>10}{s['seconds']:>12.2f}{s['msPerCall']:>10.3f}{s['MPixelsPerSecond']:>10.2f}")
+
+        if self.reportPath is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.reportPath)), exist_ok=True)
+            with open(self.reportPath, 'w') as f:
+                json.dump(report, f, indent=2)
+            self.snapshot()
+            prefix = os.path.splitext(self.reportPath)[0]
+            dumps = glob.glob(f"{prefix}-*.prof")
+            if len(dumps) > 0:
+                stats = pstats.Stats(*dumps)
+                stats.dump_stats(f"{prefix}.prof")
+                for path in dumps:
+                    os.remove(path)
+        return report
+
+
+# process wide profiler, forked workers get their own copy
+PROFILER = StageProfiler()
@@ -0,0 +1,224 @@
+"""
+    Shared-memory ring buffer of samples: producer processes write finished samples into fixed-size slots of one
+    multiprocessing.shared_memory block and a consumer (e.g. a training job on the same machine) reads them in place,
+    no sample is pickled or copied through a pipe.
+
+    Every slot has a header (word index, text, image shape, character boxes) and a pixel area of slotBytes bytes.
+    Producers claim slots in ring order under a lock and block while the ring is full (backpressure), every slot has
+    a semaphore a producer releases once the slot is written. The consumer waits on the semaphores in the same order
+    and frees the slots when it releases them.
+
+    ring = SampleRing(slots=64, slotBytes=2 ** 20)
+    producers = startProducers(ring, cfg, numProducers=4, seed=0, numWords=1000)
+    for index, text, image, charBBoxes in iterRing(ring, numProducers=4, producers=producers):
+        ...  # image is a view of the slot, valid until the next sample
+    ring.unlink()
+"""
+import multiprocessing
+import time
+from collections import deque, namedtuple
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy
+
+from stream import iterIndexedSamples
+
+RingSample = namedtuple("RingSample", ["index", "text", "image", "bboxes", "slot"])
+
+# word index of the slot written by SampleRing.finish
+END = -1
+
+
+def getHeaderType(maxLabelBytes: int, maxBoxes: int):
+    """
+        numpy dtype of a slot header
+    """
+    return numpy.dtype([("index", numpy.int64), ("shape", numpy.uint32, 3),
+                        ("labelBytes", numpy.uint32), ("numBoxes", numpy.uint32),
+                        ("label", numpy.uint8, maxLabelBytes), ("boxes", numpy.int32, (maxBoxes, 4))], align=True)
+
+
+class SampleRing:
+    """
+        fixed-size ring of sample slots in shared memory, for any number of producer processes and one consumer.
+        Processes must be forked after the ring is created (they inherit the memory and the semaphores).
+    """
+
+    def __init__(self, slots: int = 64, slotBytes: int = 2 ** 20, maxLabelBytes: int = 256, maxBoxes: int = 64,
+                 ctx=None):
+        """
+        :param slots: number of slots, producers block while all of them hold unreleased samples
+        :param slotBytes: pixel bytes of a slot, larger samples are rejected
+        :param maxLabelBytes: UTF-8 bytes of the longest text
+        :param maxBoxes: most character boxes of a sample
+        :param ctx: multiprocessing context of the semaphores (default: fork)
+        """
+        assert slots > 0 and slotBytes > 0
+        ctx = ctx if ctx is not None else multiprocessing.get_context("fork")
+        self.slots = slots
+        self.slotBytes = slotBytes
+        self.maxLabelBytes = maxLabelBytes
+        self.maxBoxes = maxBoxes
+        headerType = getHeaderType(maxLabelBytes, maxBoxes)
+        # pixel areas are 64-byte aligned
+        self.dataOffset = -(-(8 + slots * headerType.itemsize) // 64) * 64
+        self.shm = SharedMemory(create=True, size=self.dataOffset + slots * slotBytes)
+
+        self.head = numpy.ndarray((1,), numpy.int64, buffer=self.shm.buf)
+        self.head[0] = 0
+        self.headers = numpy.ndarray((slots,), headerType, buffer=self.shm.buf, offset=8)
+        # field columns, indexing them is much faster than fields of a header record
+        self.index, self.shape = self.headers["index"], self.headers["shape"]
+        self.labelBytes, self.label = self.headers["labelBytes"], self.headers["label"]
+        self.numBoxes, self.boxes = self.headers["numBoxes"], self.headers["boxes"]
+        self.data = numpy.ndarray((slots, slotBytes), numpy.uint8, buffer=self.shm.buf, offset=self.dataOffset)
+
+        self.lock = ctx.Lock()
+        self.free = ctx.Semaphore(slots)
+        # released by the producer of a slot once it is written
+        self.written = [ctx.Semaphore(0) for _ in range(slots)]
+
+        # consumer side
+        self.tail = 0
+        self.outstanding = deque()
+        self.released = set()
+        return
+
+    def getData(self, slot: int, shape: tuple):
+        return self.data[slot, :shape[0] * shape[1] * shape[2]].reshape(shape)
+
+    def put(self, text: str, image: numpy.ndarray, bboxes: list = (), index: int = 0, timeout: float = None):
+        """
+            write a sample into the next slot, blocks while the ring is full
+        :param text: label
+        :param image: uint8 image (h, w) or (h, w, c)
+        :param bboxes: [x1, y1, x2, y2] character boxes
+        :param index: word index
+        :param timeout: seconds to wait for a free slot (None: forever)
+        :return: False if no slot became free in time
+        """
+        label = text.encode("utf-8")
+        shape = image.shape + (1,) * (3 - image.ndim)
+        if image.nbytes > self.slotBytes or len(label) > self.maxLabelBytes or len(bboxes) > self.maxBoxes:
+            raise Exception(f"Sample of '{text}' ({image.shape}, {len(bboxes)} boxes) does not fit a ring slot!")
+        if not self.free.acquire(timeout=timeout):
+            return False
+        with self.lock:
+            slot = int(self.head[0]) % self.slots
+            self.head[0] += 1
+
+        self.index[slot] = index
+        self.shape[slot] = shape
+        self.labelBytes[slot] = len(label)
+        self.label[slot, :len(label)] = numpy.frombuffer(label, numpy.uint8)
+        self.numBoxes[slot] = len(bboxes)
+        if len(bboxes) > 0:
+            self.boxes[slot, :len(bboxes)] = numpy.array(bboxes, numpy.int32)
+        self.getData(slot, shape)[...] = image.reshape(shape)
+        self.written[slot].release()
+        return True
+
+    def finish(self):
+        """
+            end of the samples of a producer
+        """
+        self.put("", numpy.empty((0, 0, 0), numpy.uint8), index=END)
+
+    def get(self, timeout: float = None):
+        """
+            next sample, its image and boxes are views of the slot until it is released (consumer only)
+        :param timeout: seconds to wait for a sample (None: forever)
+        :return: RingSample, None if no sample arrived in time
+        """
+        # with several producers a later slot can be written first, slots are read in ring order
+        slot = self.tail % self.slots
+        if not self.written[slot].acquire(timeout=timeout):
+            return None
+        self.tail += 1
+        self.outstanding.append(slot)
+        shape = self.shape[slot].tolist()
+        text = self.label[slot, :self.labelBytes[slot]].tobytes().decode("utf-8")
+        return RingSample(int(self.index[slot]), text, self.getData(slot, shape),
+                          self.boxes[slot, :self.numBoxes[slot]], slot)
+
+    def release(self, sample: RingSample):
+        """
+            free the slot of a sample, its views must not be used anymore. Slots are freed in ring order, a slot
+            released early is freed with the older ones.
+        """
+        self.released.add(sample.slot)
+        while len(self.outstanding) > 0 and self.outstanding[0] in self.released:
+            slot = self.outstanding.popleft()
+            self.released.discard(slot)
+            self.free.release()
+        return
+
+    def unlink(self):
+        """
+            destroy the shared memory (owner only, after every process is done with it)
+        """
+        self.head = self.headers = self.data = None
+        self.index = self.shape = self.labelBytes = self.label = self.numBoxes = self.boxes = None
+        self.shm.close()
+        self.shm.unlink()
+        return
+
+
+def iterRing(ring: SampleRing, numProducers: int, timeout: float = None, producers: list = None):
+    """
+        samples of the ring until every producer finished, a sample is released when the next one is taken
+    :param ring: ring
+    :param numProducers: number of producers (finish calls)
+    :param timeout: seconds to wait for a sample, the iteration stops after it
+    :param producers: producer processes, checked every second while waiting, the iteration raises when one of them
+                      died (a producer which died after claiming a slot never writes it)
+    :return: generator of (index, text, image, bboxes) views
+    """
+    poll = 1 if producers is not None else timeout
+    finished = 0
+    while finished < numProducers:
+        t = time.time()
+        while True:
+            sample = ring.get(timeout=poll if timeout is None or poll is None else min(poll, timeout))
+            if sample is not None:
+                break
+            for p in producers if producers is not None else []:
+                if p.exitcode is not None and p.exitcode != 0:
+                    raise Exception(f"Producer {p.pid} died with exit code {p.exitcode}!")
+            if timeout is not None and time.time() - t >= timeout:
+                print(f"No sample in {timeout} seconds, {numProducers - finished} producers did not finish.")
+                return
+        if sample.index == END:
+            finished += 1
+        else:
+            yield sample.index, sample.text, sample.image, sample.bboxes
+        ring.release(sample)
+    return
+
+
+def produce(ring: SampleRing, cfg, seed: int = None, start: int = 0, step: int = 1, numWords: int = None,
+            rgb: bool = False):
+    """
+        producer process: generate the samples of words start, start + step, ... below numWords into the ring
+    """
+    for index, text, image, charBBoxes in iterIndexedSamples(cfg, seed, start, step, numWords, rgb):
+        try:
+            ring.put(text, image, charBBoxes, index=index)
+        except Exception as e:
+            print(e)
+    ring.finish()
+    return
+
+
+def startProducers(ring: SampleRing, cfg, numProducers: int, seed: int = None, numWords: int = None,
+                   rgb: bool = False):
+    """
+        fork producer processes, word i is generated by producer i % numProducers
+    :return: producer processes, the consumer reads numProducers finish slots (see iterRing)
+    """
+    ctx = multiprocessing.get_context("fork")
+    producers = [ctx.Process(target=produce, args=(ring, cfg, seed, i, numProducers, numWords, rgb), daemon=True)
+                 for i in range(numProducers)]
+    for p in producers:
+        p.start()
+    return producers
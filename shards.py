@@ -0,0 +1,533 @@
+"""
+    Raw pixel shards: samples resized to a fixed height (see ImageEncoder, format raw) are packed as raw RGB uint8
+    pixels into large shard files which readers memory-map, no image is decoded when training.
+
+    Layout of <root>:
+        manifest.json: height, channels, compression and every shard with its number of samples and bytes
+        shard-00000.bin: chunks of samples, each chunk compressed on its own (or stored as is)
+        shard-00000.npy: one record per sample, word index, sample number, width and byte offset in the
+                         uncompressed shard
+        shard-00000.chunks.npy: uncompressed offset, file offset and file bytes of every chunk
+        shard-00000.txt: labels, one per line
+
+    A shard holds whole words and is listed in the manifest when it is closed, the checkpoint follows the closed
+    shards.
+    Compressed shards are read a chunk at a time, they suit sequential reads (e.g. shuffled within a buffer), random
+    access decompresses a chunk per sample.
+
+    Tar shards (WebDataset layout): every sample is a group of members <key>.jpg (or the extension of the encoder),
+    <key>.txt (label) and optionally <key>.json (character boxes) in tar files of a bounded number of samples or bytes.
+    Several shards are written at the same time by writer threads, a manifest lists the closed shards. Members are
+    regular files with USTAR headers, written and read directly (tarfile formats and parses every header in Python,
+    which costs more than the member itself).
+"""
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+from typing import List
+
+import numpy
+
+from profiler import PROFILER
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_TYPE = numpy.dtype([("index", numpy.int64), ("sample", numpy.uint32), ("width", numpy.uint32),
+                          ("offset", numpy.uint64)])
+CHUNK_TYPE = numpy.dtype([("offset", numpy.uint64), ("fileOffset", numpy.uint64), ("fileBytes", numpy.uint64)])
+
+TAR_BLOCK = 512
+# tar files are padded to whole records of 20 blocks, as tarfile and GNU tar do
+TAR_RECORD = 20 * TAR_BLOCK
+
+
+def getCodec(compression: str):
+    """
+        (compress, decompress) functions of a chunk compression, None for uncompressed chunks
+    :param compression: none, zlib, lz4 (lz4 package) or zstd (zstandard package)
+    """
+    if compression == "none":
+        return None
+    if compression == "zlib":
+        import zlib
+        return (lambda b: zlib.compress(b, 1)), zlib.decompress
+    if compression == "lz4":
+        if lz4 is None:
+            raise Exception("lz4 compression needs the lz4 package!")
+        return lz4.compress, lz4.decompress
+    if compression == "zstd":
+        if zstandard is None:
+            raise Exception("zstd compression needs the zstandard package!")
+        return zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress
+    raise Exception(f"Unknown compression {compression}!")
+
+
+def getShardName(k: int):
+    return f"shard-{k:05d}"
+
+
+def readManifest(root: str):
+    path = os.path.join(root, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class RawShardWriter:
+    """
+        writes raw samples of words to shards
+    """
+
+    def __init__(self, root: str, height: int, shardBytes: int = 2 ** 30, chunkBytes: int = 2 ** 22,
+                 compression: str = "none", checkpoint=None):
+        """
+        :param root: shard folder
+        :param height: height of every sample
+        :param shardBytes: a shard is closed when its uncompressed samples reach this size
+        :param chunkBytes: uncompressed bytes of a chunk (the unit of compression and of reads of compressed shards)
+        :param compression: none, zlib, lz4 or zstd
+        :param checkpoint: updated with the words of every closed shard. When it resumes, the shards of the manifest
+                           are kept and words already in them are not written again.
+        """
+        self.root = root
+        self.height = height
+        self.channels = 3
+        self.shardBytes = shardBytes
+        self.chunkBytes = chunkBytes
+        self.compression = compression
+        self.codec = getCodec(compression)
+        self.checkpoint = checkpoint
+        os.makedirs(root, exist_ok=True)
+
+        self.shards = []
+        self.written = set()
+        manifest = readManifest(root)
+        if manifest is not None and checkpoint is not None and checkpoint.next > 0:
+            assert manifest["height"] == height, f"Shards of {root} have height {manifest['height']}, not {height}!"
+            self.shards = manifest["shards"]
+            for shard in self.shards:
+                index = numpy.load(os.path.join(root, f"{shard['name']}.npy"), mmap_mode='r')["index"]
+                self.written.update(int(i) for i in numpy.unique(index[index >= checkpoint.next]))
+        self.openShard()
+        return
+
+    def openShard(self):
+        self.name = getShardName(len(self.shards))
+        self.file = open(os.path.join(self.root, f"{self.name}.bin"), 'wb')
+        self.records = []
+        self.chunks = []
+        self.labels = []
+        self.indices = []
+        self.chunk = bytearray()
+        self.chunkOffset = 0
+        self.offset = 0
+        self.fileOffset = 0
+        return
+
+    def write(self, text: str, samples: List[bytes], index: int):
+        """
+            write the samples of a word
+        :param text: label
+        :param samples: raw RGB pixels of samples (height x width x 3), empty if the word failed
+        :param index: word index
+        """
+        self.indices.append(index)
+        if index in self.written:
+            return
+        for i, sample in enumerate(samples):
+            width = len(sample) // (self.height * self.channels)
+            assert width * self.height * self.channels == len(sample), "Sample is not a raw image of the height!"
+            self.records.append((index, i, width, self.offset))
+            self.labels.append(text)
+            self.chunk += sample
+            self.offset += len(sample)
+            if len(self.chunk) >= self.chunkBytes:
+                self.flushChunk()
+        if self.offset >= self.shardBytes:
+            self.closeShard()
+            self.openShard()
+        return
+
+    def flushChunk(self):
+        if len(self.chunk) == 0:
+            return
+        with PROFILER.stage("RawShardWriter.flush"):
+            data = self.chunk if self.codec is None else self.codec[0](bytes(self.chunk))
+            self.file.write(data)
+        self.chunks.append((self.chunkOffset, self.fileOffset, len(data)))
+        self.fileOffset += len(data)
+        self.chunkOffset = self.offset
+        self.chunk = bytearray()
+        return
+
+    def closeShard(self):
+        """
+            write the index of the shard and list it in the manifest, an empty shard is dropped
+        """
+        self.flushChunk()
+        self.file.close()
+        if len(self.records) > 0:
+            numpy.save(os.path.join(self.root, f"{self.name}.npy"), numpy.array(self.records, dtype=INDEX_TYPE))
+            numpy.save(os.path.join(self.root, f"{self.name}.chunks.npy"), numpy.array(self.chunks, dtype=CHUNK_TYPE))
+            with open(os.path.join(self.root, f"{self.name}.txt"), 'w', encoding='utf-8') as f:
+                f.write("".join(f"{label}\n" for label in self.labels))
+            self.shards.append({"name": self.name, "samples": len(self.records), "bytes": self.offset,
+                                "fileBytes": self.fileOffset})
+        else:
+            os.remove(os.path.join(self.root, f"{self.name}.bin"))
+        self.writeManifest()
+        if self.checkpoint is not None:
+            self.checkpoint.update(self.indices)
+            self.checkpoint.save()
+        return
+
+    def writeManifest(self):
+        manifest = {"height": self.height, "channels": self.channels, "compression": self.compression,
+                    "samples": sum(s["samples"] for s in self.shards), "shards": self.shards}
+        path = os.path.join(self.root, "manifest.json")
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+        return
+
+    def close(self):
+        self.closeShard()
+        return
+
+
+class RawShardReader:
+    """
+        random access to the samples of a shard folder. Images of uncompressed shards are views of the memory-mapped
+        shard files, images of compressed shards are views of their decompressed chunk (the last chunk of every shard
+        is kept).
+    """
+
+    def __init__(self, root: str):
+        manifest = readManifest(root)
+        if manifest is None:
+            raise Exception(f"{root} has no manifest.json!")
+        self.height = manifest["height"]
+        self.channels = manifest["channels"]
+        self.codec = getCodec(manifest["compression"])
+        self.data, self.index, self.chunks, self.labels = [], [], [], []
+        for shard in manifest["shards"]:
+            path = os.path.join(root, shard["name"])
+            self.data.append(numpy.memmap(f"{path}.bin", dtype=numpy.uint8, mode='r'))
+            self.index.append(numpy.load(f"{path}.npy", mmap_mode='r'))
+            self.chunks.append(numpy.load(f"{path}.chunks.npy"))
+            with open(f"{path}.txt", 'r', encoding='utf-8') as f:
+                self.labels.append(f.read().split("\n")[:-1])
+        self.starts = numpy.cumsum([0] + [shard["samples"] for shard in manifest["shards"]])
+        self.cache = {}
+        return
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def __getitem__(self, i: int):
+        """
+        :return: label, height x width x 3 RGB image (read-only view)
+        """
+        if i < 0:
+            i += len(self)
+        k = int(numpy.searchsorted(self.starts, i, side="right")) - 1
+        j = i - int(self.starts[k])
+        index, sample, width, offset = self.index[k][j].tolist()
+        size = self.height * width * self.channels
+        if self.codec is None:
+            pixels = self.data[k][offset:offset + size]
+        else:
+            c = int(numpy.searchsorted(self.chunks[k]["offset"], offset, side="right")) - 1
+            pixels = self.getChunk(k, c)[offset - int(self.chunks[k]["offset"][c]):][:size]
+        return self.labels[k][j], pixels.reshape(self.height, width, self.channels)
+
+    def getChunk(self, k: int, c: int):
+        """
+            decompressed chunk c of shard k
+        """
+        cached = self.cache.get(k)
+        if cached is None or cached[0] != c:
+            _, fileOffset, fileBytes = self.chunks[k][c].tolist()
+            data = self.codec[1](self.data[k][fileOffset:fileOffset + fileBytes])
+            cached = self.cache[k] = (c, numpy.frombuffer(data, dtype=numpy.uint8))
+        return cached[1]
+
+    def getKey(self, i: int):
+        """
+            word index and sample number of sample i
+        """
+        k = int(numpy.searchsorted(self.starts, i, side="right")) - 1
+        index, sample, _, _ = self.index[k][i - int(self.starts[k])].tolist()
+        return index, sample
+
+
+class TarShardWriter:
+    """
+        writes encoded samples of words to tar shards, words are spread over writer threads which have a shard open
+        each. A shard is written as <name>.tar.tmp and renamed when it is closed. A failed write stops the writer
+        and drops the shard it was writing, write and close raise the error.
+    """
+
+    def __init__(self, root: str, extension: str = ".jpg", maxRecords: int = 10000, maxBytes: int = 2 ** 30,
+                 threads: int = 4, boxes: bool = True, checkpoint=None):
+        """
+        :param root: shard folder
+        :param extension: extension of the encoded images
+        :param maxRecords: a shard is closed when it holds this many samples
+        :param maxBytes: a shard is closed when its members reach this size
+        :param threads: writer threads (shards written at the same time)
+        :param boxes: write the character boxes of samples as <key>.json
+        :param checkpoint: updated with the words of every closed shard. When it resumes, the shards of the manifest
+                           are kept and words already in them are not written again.
+        """
+        assert threads > 0
+        self.root = root
+        self.extension = extension
+        self.maxRecords = maxRecords
+        self.maxBytes = maxBytes
+        self.boxes = boxes
+        self.checkpoint = checkpoint
+        os.makedirs(root, exist_ok=True)
+
+        self.shards = []
+        self.written = set()
+        manifest = readManifest(root)
+        if manifest is not None and checkpoint is not None and checkpoint.next > 0:
+            self.shards = manifest["shards"]
+            for shard in self.shards:
+                if shard["maxIndex"] >= checkpoint.next:
+                    self.written.update(i for i in self.getWords(shard["name"]) if i >= checkpoint.next)
+        self.nextShard = max((int(s["name"].split("-")[1]) + 1 for s in self.shards), default=0)
+        # shards left open by an interrupted run, their words are not in the checkpoint
+        for name in os.listdir(root):
+            if name.endswith(".tar.tmp"):
+                os.remove(os.path.join(root, name))
+
+        self.lock = threading.Lock()
+        self.error = None
+        self.jobs = queue.Queue(maxsize=4 * threads)
+        self.threads = [threading.Thread(target=self.writerLoop, daemon=True) for _ in range(threads)]
+        for t in self.threads:
+            t.start()
+        return
+
+    def getWords(self, name: str):
+        """
+            word indices of the samples of a shard, from its member names
+        """
+        return set(int(key.split("_")[0]) for key, _ in iterTarSamples(os.path.join(self.root, f"{name}.tar")))
+
+    def write(self, text: str, samples: List[bytes], index: int, bboxes: list = None):
+        """
+            queue the samples of a word, blocks while the writer threads are behind
+        :param text: label
+        :param samples: encoded samples, empty if the word failed
+        :param index: word index
+        :param bboxes: [x1, y1, x2, y2] character boxes of every sample
+        """
+        if self.error is not None:
+            raise Exception(f"Tar shard writer failed: {self.error}")
+        self.jobs.put((text, samples, index, bboxes))
+        return
+
+    def writerLoop(self):
+        shard = None
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if self.error is not None:
+                # the writer failed, queued words are dropped (they are not in the checkpoint)
+                continue
+            text, samples, index, bboxes = job
+            try:
+                if shard is None:
+                    shard = self.openShard()
+                self.writeWord(shard, text, samples, index, bboxes)
+                if shard["samples"] >= self.maxRecords or shard["bytes"] >= self.maxBytes:
+                    self.closeShard(shard)
+                    shard = None
+            except Exception as e:
+                self.fail(e, shard)
+                shard = None
+        if shard is not None:
+            try:
+                self.closeShard(shard)
+            except Exception as e:
+                self.fail(e, shard)
+        return
+
+    def fail(self, error: Exception, shard: dict = None):
+        """
+            stop the writer: the open shard may end with a partial member, it is dropped and its words stay out of
+            the checkpoint, write and close raise the error
+        """
+        print(f"Tar shard writer failed: {error}")
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        if shard is not None:
+            if not shard["file"].closed:
+                shard["file"].close()
+            if os.path.exists(f"{shard['path']}.tmp"):
+                os.remove(f"{shard['path']}.tmp")
+        return
+
+    def openShard(self):
+        with self.lock:
+            name = getShardName(self.nextShard)
+            self.nextShard += 1
+        path = os.path.join(self.root, f"{name}.tar")
+        return {"name": name, "path": path, "file": open(f"{path}.tmp", 'wb'), "samples": 0, "bytes": 0,
+                "indices": [], "minIndex": None, "maxIndex": None}
+
+    def writeWord(self, shard: dict, text: str, samples: List[bytes], index: int, bboxes: list):
+        """
+            write the members of every sample of a word, the word is added to the shard once all are written
+        """
+        if index in self.written:
+            shard["indices"].append(index)
+            return
+        label = text.encode("utf-8")
+        mtime = int(time.time())
+        # members are built before anything is written, a bad box fails before the shard is touched
+        members = []
+        for i, sample in enumerate(samples):
+            key = f"{index:09d}_{i}"
+            members += [(f"{key}{self.extension}", sample), (f"{key}.txt", label)]
+            if self.boxes and bboxes is not None:
+                members.append((f"{key}.json", json.dumps([[int(v) for v in box] for box in bboxes[i]]).encode()))
+        for name, data in members:
+            shard["file"].write(getTarHeader(name, len(data), mtime))
+            shard["file"].write(data)
+            shard["file"].write(bytes(-len(data) % TAR_BLOCK))
+            shard["bytes"] += TAR_BLOCK + len(data) + (-len(data) % TAR_BLOCK)
+        shard["samples"] += len(samples)
+        shard["indices"].append(index)
+        shard["minIndex"] = index if shard["minIndex"] is None else min(shard["minIndex"], index)
+        shard["maxIndex"] = index if shard["maxIndex"] is None else max(shard["maxIndex"], index)
+        return
+
+    def closeShard(self, shard: dict):
+        """
+            close the tar file, list it in the manifest and mark its words in the checkpoint, an empty shard is
+            dropped
+        """
+        # end of archive: two zero blocks, padded to a whole record
+        end = shard["file"].tell() + 2 * TAR_BLOCK
+        shard["file"].write(bytes(2 * TAR_BLOCK + (-end % TAR_RECORD)))
+        shard["file"].close()
+        if shard["samples"] > 0:
+            os.replace(f"{shard['path']}.tmp", shard["path"])
+        else:
+            os.remove(f"{shard['path']}.tmp")
+        with self.lock:
+            if shard["samples"] > 0:
+                self.shards.append({"name": shard["name"], "samples": shard["samples"],
+                                    "bytes": os.path.getsize(shard["path"]), "words": len(shard["indices"]),
+                                    "minIndex": shard["minIndex"], "maxIndex": shard["maxIndex"]})
+                self.writeManifest()
+            if self.checkpoint is not None:
+                self.checkpoint.update(shard["indices"])
+                self.checkpoint.save()
+        return
+
+    def writeManifest(self):
+        shards = sorted(self.shards, key=lambda s: s["name"])
+        manifest = {"extension": self.extension, "boxes": self.boxes, "samples": sum(s["samples"] for s in shards),
+                    "bytes": sum(s["bytes"] for s in shards), "shards": shards}
+        path = os.path.join(self.root, "manifest.json")
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+        return
+
+    def close(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+        if self.error is not None:
+            raise Exception(f"Tar shard writer failed: {self.error}")
+        return
+
+
+def getTarHeader(name: str, size: int, mtime: int):
+    """
+        USTAR header block of a regular file
+    """
+    name = name.encode("utf-8")
+    assert len(name) <= 100, "Tar member names are limited to 100 bytes!"
+    header = bytearray(TAR_BLOCK)
+    header[0:len(name)] = name
+    header[100:108] = b"0000644\0"
+    header[108:116] = b"0000000\0"
+    header[116:124] = b"0000000\0"
+    header[124:136] = b"%011o\0" % size
+    header[136:148] = b"%011o\0" % mtime
+    header[148:156] = b" " * 8
+    header[156:157] = b"0"
+    header[257:265] = b"ustar\x0000"
+    header[148:156] = b"%06o\0 " % sum(header)
+    return bytes(header)
+
+
+def iterTarSamples(path: str):
+    """
+        samples of a tar shard, members of a sample are consecutive
+    :param path: tar file of regular file members
+    :return: generator of (key, {extension: bytes})
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    key, sample = None, {}
+    position = 0
+    while position + TAR_BLOCK <= size:
+        header = mm[position:position + TAR_BLOCK]
+        if header[0] == 0:
+            break
+        if header[156:157] not in (b"0", b"\0"):
+            raise Exception(f"{path}: only regular files are read, {header[:100].rstrip(bytes(1))} is not one!")
+        name = header[0:100].split(b"\0", 1)[0]
+        prefix = header[345:500].split(b"\0", 1)[0]
+        name = (prefix + b"/" + name if prefix else name).decode("utf-8")
+        memberSize = int(header[124:136].strip(b"\0 ") or b"0", 8)
+        position += TAR_BLOCK
+        name, extension = os.path.splitext(name)
+        if name != key:
+            if key is not None:
+                yield key, sample
+            key, sample = name, {}
+        sample[extension] = mm[position:position + memberSize]
+        position += memberSize + (-memberSize % TAR_BLOCK)
+    if key is not None:
+        yield key, sample
+    mm.close()
+    return
+
+
+def iterTarShards(root: str):
+    """
+        samples of the tar shards of a manifest, in shard order
+    :param root: shard folder
+    :return: generator of (key, {extension: bytes}) of every sample
+    """
+    manifest = readManifest(root)
+    if manifest is None:
+        raise Exception(f"{root} has no manifest.json!")
+    for shard in manifest["shards"]:
+        yield from iterTarSamples(os.path.join(root, f"{shard['name']}.tar"))
@@ -0,0 +1,122 @@
+"""
+    Streaming samples for on-the-fly training: words are generated lazily from (seed, index) as in main.py and the
+    samples are yielded as arrays with their text and character boxes, nothing is encoded or written.
+
+    for text, image, charBBoxes in iterSamples(cfg, seed=0):
+        ...
+
+    SampleStream is an iterable (a torch IterableDataset when torch is installed) which shards the word indices over
+    DataLoader workers and distributed ranks.
+"""
+import cv2
+import numpy
+
+from Components.CharImage import CharImage
+from Components.GlyphAtlas import GlyphAtlas
+from Components.TextImage import TextImage
+from Components.TextPipeline import TextPipeline
+from Components.TextProducer import TextProducer
+from Texture import Font
+from utils import getWordRandom, readYAML
+
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    IterableDataset = object
+
+    def get_worker_info():
+        return None
+
+CONFIGS = ("configs/base.yaml", "configs/charAugmentations.yaml", "configs/textAugmentations.yaml",
+           "configs/background.yaml", "configs/textProducer.yaml")
+
+
+def readConfigs(paths: tuple = CONFIGS):
+    """
+        (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer)
+    """
+    return tuple(readYAML(path) for path in paths)
+
+
+def toRGB(image: numpy.ndarray):
+    """
+        RGB image of an RGBA sample composited over a black background, as the samples written by main.py
+    """
+    alpha = cv2.cvtColor(image[..., 3], cv2.COLOR_GRAY2RGB)
+    return cv2.multiply(cv2.cvtColor(image, cv2.COLOR_RGBA2RGB), alpha, scale=1 / 255)
+
+
+def iterSamples(cfg, seed: int = None, start: int = 0, step: int = 1, numWords: int = None, rgb: bool = False):
+    """
+        samples of the words start, start + step, ... (the words of a run of the same seed)
+    :param cfg: (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer)
+    :param seed: run seed (None: cfg_Base["seed"])
+    :param start: first word index
+    :param step: word index step, workers sharing a run take the same step and different starts
+    :param numWords: last word index is below it (None: endless)
+    :param rgb: yield RGB images instead of RGBA
+    :return: generator of (text, image, [x1, y1, x2, y2] character boxes), cfg_Base["getSamples"] samples per word
+    """
+    for _, text, image, charBBoxes in iterIndexedSamples(cfg, seed, start, step, numWords, rgb):
+        yield text, image, charBBoxes
+
+
+def iterIndexedSamples(cfg, seed: int = None, start: int = 0, step: int = 1, numWords: int = None,
+                       rgb: bool = False):
+    """
+        iterSamples, with the word index of every sample
+    :return: generator of (word index, text, image, [x1, y1, x2, y2] character boxes)
+    """
+    (cfg_Base, cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background, cfg_TextProducer) = cfg
+    seed = cfg_Base["seed"] if seed is None else seed
+    font = Font(cfg_Base["FONT"])
+    textProducer = TextProducer(cfg_TextProducer)
+    atlas = GlyphAtlas(maxBytes=cfg_Base["GlyphAtlas"]["maxBytes"])
+    pipeline = TextPipeline(cfg_CharAugmentations, cfg_TextAugmentations, cfg_Background)
+
+    index = start
+    while numWords is None or index < numWords:
+        rng, paletteSeed = getWordRandom(seed, index, cfg_Base["paletteBlock"])
+        text = textProducer.getText(rng)
+        fontSample = font.getRandomFont(rng)
+        wordIndex, index = index, index + step
+        try:
+            chars = [CharImage(text=c, font=fontSample, colorType="OneColor", color=(0, 0, 0, 255), bold=False,
+                               atlas=atlas) for c in text]
+            txtImage = TextImage(chars, pipeline, rng=rng, paletteSeed=paletteSeed, progress=False)
+            for image, charBBoxes in txtImage.iterLabeledSamples(cfg_Base["getSamples"]):
+                yield wordIndex, text, toRGB(image) if rgb else image, charBBoxes
+        except Exception as e:
+            # the word is skipped, as in main.py
+            print(e)
+
+
+class SampleStream(IterableDataset):
+    """
+        endless (or numWords words) sample stream, every DataLoader worker and rank generates its own words
+    """
+
+    def __init__(self, cfg, seed: int = None, numWords: int = None, rgb: bool = False, rank: int = 0,
+                 worldSize: int = 1):
+        """
+        :param cfg: configs, see iterSamples
+        :param seed: run seed (None: cfg_Base["seed"]), use a new seed per epoch for new samples
+        :param numWords: number of words of the stream (None: endless)
+        :param rgb: yield RGB images instead of RGBA
+        :param rank: rank of the process in distributed training
+        :param worldSize: number of processes in distributed training
+        """
+        super().__init__()
+        self.cfg = cfg
+        self.seed = seed
+        self.numWords = numWords
+        self.rgb = rgb
+        self.rank = rank
+        self.worldSize = worldSize
+
+    def __iter__(self):
+        info = get_worker_info()
+        workerId, numWorkers = (info.id, info.num_workers) if info is not None else (0, 1)
+        # word i goes to shard i % (worldSize * numWorkers)
+        return iterSamples(self.cfg, seed=self.seed, start=self.rank * numWorkers + workerId,
+                           step=self.worldSize * numWorkers, numWords=self.numWords, rgb=self.rgb)
@@ -6,6 +6,7 @@ from PIL import ImageFont, Image
 
 from Components.CharImage import CharImage
 from Components.TextImage import TextImage
+from Components.TextPipeline import TextPipeline
 from Components.TextProducer import TextProducer
 from Texture import Font
 from utils import readYAML, saveRGBAImage
@@ -25,10 +26,12 @@ def demo1():
     cfg_TextProducer = readYAML(cfg_TextProducer)
 
     textProducer = TextProducer(cfg_TextProducer)
+    pipeline = TextPipeline(cfgCharAugmentations, cfgTextAugmentations, cfgBackground)
+    rng = numpy.random.default_rng()
     cnt = 0
     for _ in range(1000):
         # text = "ÖĞRENCİ"
-        text = textProducer.getText()
+        text = textProducer.getText(rng)
         root = "./sources/fonts/"
         fonts = [os.path.join(root, l) for l in os.listdir(root)]
         for f in sorted(fonts):
@@ -45,7 +48,7 @@ def demo1():
                                     bold=False)
                 char_list.append(charImg)
 
-            txtImage = TextImage(char_list, cfgCharAugmentations, cfgTextAugmentations, cfgBackground)
+            txtImage = TextImage(char_list, pipeline)
 
             samples = txtImage.getSamples((1, 1, 1))
 
@@ -90,7 +93,7 @@ def demo2():
                             bold=False)
         char_list.append(charImg)
 
-    txtImage = TextImage(char_list, cfgCharAugmentations, cfgTextAugmentations, cfgBackground)
+    txtImage = TextImage(char_list, TextPipeline(cfgCharAugmentations, cfgTextAugmentations, cfgBackground))
 
     samples = txtImage.getSamples((2, 2, 2))
 
@@ -1,11 +1,20 @@
+import json
 import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List
-from datetime import datetime
 
+import cv2
 import lmdb
 import numpy
 import yaml
-from PIL import Image
+
+from profiler import PROFILER
+from shards import RawShardWriter, TarShardWriter
 
 
 def readYAML(path: str):
@@ -16,61 +25,430 @@ def readYAML(path: str):
 
 def saveRGBAImage(image: numpy.ndarray, path: str, raw: bool = True):
     if raw:
-        image = Image.fromarray(image)
-        new_image = Image.new("RGBA", image.size)  # Create a white rgba background
-        new_image.paste(image, (0, 0), image)
-        new_image.convert('RGB').save(path, "JPEG")
+        with open(path, 'wb') as f:
+            f.write(encodeRGBAImage(image))
     else:
         raise NotImplementedError()
     return
 
 
+def encodeRGBAImage(image: numpy.ndarray, format: str = "jpg", quality: int = 75):
+    """
+        encode RGBA image in memory, the image is composited over a black background
+    :param image: RGBA image
+    :param format: jpg, png or webp
+    :param quality: JPEG / WebP quality (PNG: compression level 0-9)
+    :return: encoded bytes
+    """
+    image = image.astype(numpy.uint8)
+    alpha = cv2.cvtColor(image[..., 3], cv2.COLOR_GRAY2BGR)
+    image = cv2.multiply(cv2.cvtColor(image, cv2.COLOR_RGBA2BGR), alpha, scale=1 / 255)
+    ok, buffer = cv2.imencode(ImageEncoder.extensions[format], image, ImageEncoder.getParams(format, quality))
+    if not ok:
+        raise Exception(f"Image could not be encoded as {format}!")
+    return buffer.tobytes()
+
+
+def encodeRawImage(image: numpy.ndarray, height: int):
+    """
+        raw RGB pixels of an RGBA image resized to a fixed height (aspect ratio kept), composited over a black
+        background as encoded images
+    :param image: RGBA image
+    :param height: output height
+    :return: height x width x 3 uint8 pixels
+    """
+    image = image.astype(numpy.uint8)
+    h, w = image.shape[:2]
+    width = max(1, round(w * height / h))
+    image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA if height < h else cv2.INTER_LINEAR)
+    alpha = cv2.cvtColor(image[..., 3], cv2.COLOR_GRAY2RGB)
+    return cv2.multiply(cv2.cvtColor(image, cv2.COLOR_RGBA2RGB), alpha, scale=1 / 255).tobytes()
+
+
+class ImageEncoder:
+    """
+        in-memory image encoder, batches are encoded by a thread pool (cv2 releases the GIL while encoding).
+        The raw format gives RGB pixels resized to a fixed height (args["height"]), for raw shards (see shards.py).
+    """
+    extensions = {"jpg": ".jpg", "jpeg": ".jpg", "png": ".png", "webp": ".webp", "raw": ".raw"}
+
+    def __init__(self, args: dict = None):
+        args = args if args is not None else {}
+        self.format = args.get("format", "jpg").lower()
+        if self.format not in self.extensions:
+            raise Exception(f"Unknown image format {self.format}!")
+        self.extension = self.extensions[self.format]
+        self.quality = args.get("quality", 75)
+        self.height = args.get("height", 32)
+        threads = args.get("threads", 0)
+        self.pool = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+
+        self.numImages = 0
+        self.numBytes = 0
+        self.encodeTime = 0.0
+        return
+
+    @staticmethod
+    def getParams(format: str, quality: int):
+        if format in ("jpg", "jpeg"):
+            return [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif format == "png":
+            return [cv2.IMWRITE_PNG_COMPRESSION, quality]
+        else:
+            return [cv2.IMWRITE_WEBP_QUALITY, quality]
+
+    def encode(self, image: numpy.ndarray):
+        if self.format == "raw":
+            return encodeRawImage(image, self.height)
+        return encodeRGBAImage(image, format=self.format, quality=self.quality)
+
+    def encodeBatch(self, images: List[numpy.ndarray]):
+        """
+            encode a batch of images (e.g. all samples of a word)
+        :param images: RGBA images
+        :return: list of encoded bytes
+        """
+        start = time.perf_counter()
+        if self.pool is None or len(images) == 1:
+            encoded = [self.encode(image) for image in images]
+        else:
+            encoded = list(self.pool.map(self.encode, images))
+        seconds = time.perf_counter() - start
+        self.encodeTime += seconds
+        self.numImages += len(encoded)
+        self.numBytes += sum(len(e) for e in encoded)
+        if PROFILER.enabled:
+            PROFILER.record("ImageEncoder", seconds, sum(image.shape[0] * image.shape[1] for image in images))
+        return encoded
+
+    def stats(self):
+        return self.getStats(self.numImages, self.numBytes, self.encodeTime)
+
+    @staticmethod
+    def getStats(numImages: int, numBytes: int, seconds: float):
+        return {"images": numImages,
+                "bytes": numBytes,
+                "seconds": seconds,
+                "imagesPerSecond": numImages / seconds if seconds > 0 else 0.0,
+                "MBPerSecond": numBytes / 2 ** 20 / seconds if seconds > 0 else 0.0}
+
+    @staticmethod
+    def mergeStats(stats: List[dict]):
+        """
+            merge stats of several encoders (e.g. one per worker), rates are per encoder thread time
+        """
+        return ImageEncoder.getStats(sum(s["images"] for s in stats),
+                                     sum(s["bytes"] for s in stats),
+                                     sum(s["seconds"] for s in stats))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+        return
+
+
+@lru_cache(maxsize=None)
+def listImagePaths(root: str, depth: int = 0):
+    """
+        list image paths under root, cached so each process (and its forks) reads the folder once
+    :param root: image folder
+    :param depth: number of sub folder levels (0: images are directly under root)
+    :return: tuple of paths
+    """
+    paths = [os.path.join(root, p) for p in os.listdir(root)]
+    for _ in range(depth):
+        paths = [os.path.join(path, p) for path in paths for p in os.listdir(path)]
+    # sorted, so random choices do not depend on the file system order
+    return tuple(sorted(paths))
+
+
+class StageTracer:
+    """
+        dumps intermediate images of traced words from a background thread, off by default
+    """
+
+    def __init__(self, args: dict = None):
+        """
+        :param args: enabled, root (output folder), sampleRate (ratio of traced words), texts (always traced), seed
+        """
+        args = args if args is not None else {}
+        self.enabled = args.get("enabled", False)
+        self.root = args.get("root", "tests/results")
+        self.sampleRate = args.get("sampleRate", 0.0)
+        self.texts = set(args.get("texts") or [])
+        # own random state, tracing does not change the generated samples
+        self.random = random.Random(args.get("seed"))
+
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        return
+
+    def isTraced(self, text: str):
+        if not self.enabled:
+            return False
+        return text in self.texts or self.random.random() < self.sampleRate
+
+    def dump(self, text: str, name: str, image: numpy.ndarray):
+        """
+            queue an image to be saved as <root>/<text>-<name>.jpg
+        """
+        # threads do not survive fork, each process starts its own
+        if self.pid != os.getpid():
+            os.makedirs(self.root, exist_ok=True)
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+        self.queue.put((os.path.join(self.root, f"{text}-{name}.jpg"), numpy.array(image)))
+        return
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, image = item
+            try:
+                saveRGBAImage(image, path)
+            except Exception as e:
+                print(e)
+        return
+
+    def close(self):
+        """
+            wait until queued images are written
+        """
+        if self.pid == os.getpid():
+            self.queue.put(None)
+            self.thread.join()
+            self.pid = None
+        return
+
+
+def getWordRandom(seed: int, index: int, paletteBlock: int):
+    """
+        random state of a word, it depends only on the run seed and the word index
+    :param seed: run seed
+    :param index: word index
+    :param paletteBlock: number of consecutive words sharing background and texture palettes
+    :return: random generator, palette seed
+    """
+    return numpy.random.default_rng([seed, index]), (seed, index // paletteBlock)
+
+
+class Checkpoint:
+    """
+        index of the next word of a run, every word before it is written.
+        Words are generated from (seed, index) only, so a run restarted from the checkpoint produces the same records.
+    """
+
+    def __init__(self, path: str, seed: int, resume: bool = True):
+        """
+        :param path: checkpoint file
+        :param seed: run seed, a checkpoint of another seed can not be resumed
+        :param resume: start from the checkpoint file if it exists, otherwise from the first word
+        """
+        self.path = path
+        self.seed = seed
+        self.next = 0
+        # words written out of order (e.g. by parallel workers), waiting for the words before them
+        self.done = set()
+        if resume and os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            if state["seed"] != seed:
+                raise Exception(f"Checkpoint {path} belongs to seed {state['seed']}, not {seed}!")
+            self.next = state["next"]
+        return
+
+    def update(self, indices: List[int]):
+        """
+            mark words as written
+        :param indices: word indices
+        """
+        self.done.update(indices)
+        while self.next in self.done:
+            self.done.remove(self.next)
+            self.next += 1
+        return
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"seed": self.seed, "next": self.next}, f)
+        os.replace(tmp, self.path)
+        return
+
+
 class ImageWriter:
     """
         image writer
     """
 
-    def __init__(self, root: str, isLMDB: bool):
+    def __init__(self, root: str, isLMDB: bool, encoder: ImageEncoder = None, lmdbArgs: dict = None,
+                 checkpoint: Checkpoint = None, rawArgs: dict = None, tarArgs: dict = None):
+        """
+        :param root: output folder
+        :param isLMDB: write to LMDB or to image files, samples of the raw encoder format are written to raw shards
+                       under <root>/raw and tar shards (if enabled) are written under <root>/tar instead
+        :param encoder: image encoder
+        :param lmdbArgs: mapSize (initial, default 1 GB, grown when full), txnRecords / txnBytes (records and bytes
+                         per commit), bulkLoad (writemap and asynchronous flushes, commits are not synced to disk),
+                         syncCommits / syncSeconds (with bulkLoad, the environment is synced and the checkpoint saved
+                         every syncCommits commits or syncSeconds seconds, and on close)
+        :param checkpoint: updated with written words, saved after every LMDB commit or sync with bulkLoad (every
+                           word for image files, every shard for raw and tar shards)
+        :param rawArgs: shardBytes, chunkBytes and compression of raw shards (see RawShardWriter)
+        :param tarArgs: enabled, maxRecords, maxBytes, threads and boxes of tar shards (see TarShardWriter)
+        """
         self.isLMDB = isLMDB
         self.root = root
         self.sep = "-*-"
+        self.encoder = encoder if encoder is not None else ImageEncoder()
+        self.ext = self.encoder.extension
+        self.checkpoint = checkpoint
+        self.isRaw = self.encoder.format == "raw"
+        tarArgs = dict(tarArgs) if tarArgs is not None else {}
+        self.isTar = tarArgs.pop("enabled", False) and not self.isRaw
 
-        if self.isLMDB:
-            path = os.path.join(root, "SyntheticTurkishStyleText_Samples")
-            os.makedirs(path, exist_ok=True)
+        if self.isTar:
+            self.isLMDB = False
+            self.shards = TarShardWriter(os.path.join(root, "tar"), extension=self.ext, checkpoint=checkpoint,
+                                         **tarArgs)
+        elif self.isRaw:
+            self.isLMDB = False
+            self.shards = RawShardWriter(os.path.join(root, "raw"), height=self.encoder.height,
+                                         checkpoint=checkpoint, **(rawArgs if rawArgs is not None else {}))
+        elif self.isLMDB:
+            lmdbArgs = lmdbArgs if lmdbArgs is not None else {}
+            self.txnRecords = lmdbArgs.get("txnRecords", 1)
+            self.txnBytes = lmdbArgs.get("txnBytes", 0)
+            bulkLoad = lmdbArgs.get("bulkLoad", False)
+            self.bulkLoad = bulkLoad
+            self.syncCommits = lmdbArgs.get("syncCommits", 10)
+            self.syncSeconds = lmdbArgs.get("syncSeconds", 300)
+            self.pending = {}
+            self.pendingBytes = 0
+            self.pendingIndices = []
+            # committed words not synced to disk yet (bulkLoad)
+            self.unsyncedIndices = []
+            self.unsyncedCommits = 0
+            self.lastSync = time.time()
 
             path = os.path.join(root, "SyntheticTurkishStyleText")
             os.makedirs(path, exist_ok=True)
-            self.env = lmdb.open(path, map_size=1099511627776)
-
-    def writeSamples(self, text: str, samples: List[numpy.ndarray]):
-        if self.isLMDB:
-            now = datetime.now()
-            date_time = now.strftime("%H-%M-%S")
-            saveRGBAImage(samples[0], os.path.join(
-                self.root,"SyntheticTurkishStyleText_Samples", f"{text}{self.sep}{0}{self.sep}{date_time}.jpg"))
-            cache = {}
-            for i, img in enumerate(samples):
-                now = datetime.now()
-                date_time = now.strftime("%H-%M-%S")
-                imageKey = f"{text}{self.sep}{i}{self.sep}{date_time}"
+            self.env = lmdb.open(path,
+                                 map_size=lmdbArgs.get("mapSize", 2 ** 30),
+                                 writemap=bulkLoad,
+                                 map_async=bulkLoad,
+                                 sync=not bulkLoad,
+                                 metasync=not bulkLoad)
 
-                # because of jpeg compression
-                path = os.path.join(self.root, f"temp.jpg")
-                saveRGBAImage(img, path)
-                with open(path, 'rb') as f:
-                    imageBin = f.read()
+    def writeSamples(self, text: str, samples: List[numpy.ndarray], index: int, bboxes: list = None):
+        self.writeEncodedSamples(text, self.encoder.encodeBatch(samples), index, bboxes=bboxes)
 
+    def writeEncodedSamples(self, text: str, samples: List[bytes], index: int, bboxes: list = None):
+        """
+            write already encoded samples of a word (see ImageEncoder), keys are deterministic so a resumed run
+            overwrites the records of words it generates again
+        :param text: text of samples
+        :param samples: JPEG bytes of samples, empty if the word failed
+        :param index: word index
+        :param bboxes: character boxes of every sample (written to tar shards only)
+        """
+        if self.isTar:
+            self.shards.write(text, samples, index, bboxes)
+        elif self.isRaw:
+            self.shards.write(text, samples, index)
+        elif self.isLMDB:
+            cache = {}
+            for i, imageBin in enumerate(samples):
+                imageKey = f"{text}{self.sep}{i}{self.sep}{index}"
                 cache[imageKey.encode()] = imageBin
+            self.pendingIndices.append(index)
             self.writeCache(cache)
         else:
-            for i, img in enumerate(samples):
-                now = datetime.now()
-                date_time = now.strftime("%H-%M-%S")
-                path = os.path.join(self.root, f"{text}{self.sep}{i}{self.sep}{date_time}.jpg")
-                saveRGBAImage(img, path)
+            for i, imageBin in enumerate(samples):
+                path = os.path.join(self.root, f"{text}{self.sep}{i}{self.sep}{index}{self.ext}")
+                with open(path, 'wb') as f:
+                    f.write(imageBin)
+            if self.checkpoint is not None:
+                self.checkpoint.update([index])
+                self.checkpoint.save()
 
     def writeCache(self, cache):
-        with self.env.begin(write=True) as txn:
-            for k, v in cache.items():
-                txn.put(k, v)
+        """
+            buffer records, they are committed when the transaction thresholds are reached
+        :param cache: key -> value
+        """
+        self.pending.update(cache)
+        self.pendingBytes += sum(len(k) + len(v) for k, v in cache.items())
+        if len(self.pending) >= self.txnRecords or (0 < self.txnBytes <= self.pendingBytes):
+            self.commit()
+
+    def commit(self):
+        """
+            write buffered records in one transaction, the map is doubled whenever it is full.
+            The checkpoint is saved once the transaction is on disk: after every commit, or with bulkLoad after the
+            next sync.
+        """
+        if len(self.pending) == 0 and len(self.pendingIndices) == 0:
+            return
+        info = self.env.info()
+        used = (info["last_pgno"] + 1) * self.env.stat()["psize"]
+        while used + 2 * self.pendingBytes > info["map_size"]:
+            self.growMap()
+            info = self.env.info()
+        with PROFILER.stage("ImageWriter.commit"):
+            while True:
+                try:
+                    with self.env.begin(write=True) as txn:
+                        for k, v in self.pending.items():
+                            txn.put(k, v)
+                    break
+                except lmdb.MapFullError:
+                    self.growMap()
+        if self.bulkLoad:
+            self.unsyncedIndices += self.pendingIndices
+            self.unsyncedCommits += 1
+            if self.unsyncedCommits >= self.syncCommits or time.time() - self.lastSync >= self.syncSeconds:
+                self.sync()
+        elif self.checkpoint is not None:
+            self.checkpoint.update(self.pendingIndices)
+            self.checkpoint.save()
+        self.pending = {}
+        self.pendingBytes = 0
+        self.pendingIndices = []
+        return
+
+    def sync(self):
+        """
+            flush the environment to disk and save the checkpoint of the synced words
+        """
+        with PROFILER.stage("ImageWriter.sync"):
+            self.env.sync(True)
+        if self.checkpoint is not None:
+            self.checkpoint.update(self.unsyncedIndices)
+            self.checkpoint.save()
+        self.unsyncedIndices = []
+        self.unsyncedCommits = 0
+        self.lastSync = time.time()
+        return
+
+    def growMap(self):
+        self.env.set_mapsize(2 * self.env.info()["map_size"])
+        return
+
+    def close(self):
+        self.encoder.close()
+        if self.isTar or self.isRaw:
+            self.shards.close()
+        elif self.isLMDB:
+            self.commit()
+            if self.bulkLoad:
+                self.sync()
+            else:
+                self.env.sync(True)
+            self.env.close()